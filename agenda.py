@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+import logging
+
+from google.appengine.ext import ndb
+
+from caching import (
+    AGENDA_CACHE,
+    AGENDA_STORE_CACHE,
+    LOCAL_VERSIONED_TTL,
+    flights,
+    getBlob,
+    local,
+    packMessage,
+    setBlob,
+    stats,
+    unpackMessage
+)
+from models import ConferenceAgenda, SessionForms
+
+"""agenda.py
+
+Conference Central materialized conference agendas
+
+An agenda is the SessionForms of a Conference: its Sessions in date &
+start time order, with speaker names already resolved. It is stored
+pre-serialized (see the codec in caching.py) in memcache, fronted by the
+instance's local cache, and, as a fallback that survives eviction, in
+a ConferenceAgenda entity. All copies are tagged with the Conference's
+sessionsVersion, which every Session write bumps, so a stale agenda is
+never served; ConferenceApi rebuilds it from a coalesced task after a
+write, or inline if a reader gets there first. Either way a build goes
+through fillAgenda, so concurrent readers of a cold agenda wait for one
+build instead of each querying the Sessions. An agenda too big for one
+entity has no datastore copy; after an eviction it's rebuilt instead.
+
+"""
+
+
+MEMCACHE_AGENDA_KEY = 'AGENDA:%s:%d'  # websafe conference key, version
+AGENDA_CACHE_TIME = 24 * 60 * 60  # seconds
+AGENDA_STORE_MAX = 900 * 1000  # bytes; entities are limited to 1MB
+
+
+def sortKey(form):
+    """Sort SessionForms by date, start time, then name; the date and
+    time strings are ISO formatted, so they sort chronologically."""
+    return (form.date or '', form.startTime or '', form.name or '')
+
+
+def encodeAgenda(forms):
+    return packMessage(forms)
+
+
+def decodeAgenda(data):
+    return unpackMessage(SessionForms, data)
+
+
+def loadAgenda(wsck, version):
+    """Return the stored agenda of a Conference at sessionsVersion
+    `version`, or None if it hasn't been built."""
+    key = MEMCACHE_AGENDA_KEY % (wsck, version)
+    data = local.get(AGENDA_CACHE, key, lambda: getBlob(key),
+                     ttl=LOCAL_VERSIONED_TTL)
+    if data is not None:
+        stats.hit(AGENDA_CACHE)
+        return decodeAgenda(data)
+    stats.miss(AGENDA_CACHE)
+
+    stored = ndb.Key(ConferenceAgenda, wsck).get()
+    if stored is None or stored.sessionsVersion != version:
+        stats.miss(AGENDA_STORE_CACHE)
+        return None
+    stats.hit(AGENDA_STORE_CACHE)
+    setBlob(key, stored.forms, time=AGENDA_CACHE_TIME)
+    local.set(key, stored.forms, ttl=LOCAL_VERSIONED_TTL)
+    return decodeAgenda(stored.forms)
+
+
+@ndb.transactional()
+def _putAgenda(wsck, version, data):
+    """Store the agenda unless a newer one is already stored (builds
+    can finish out of order)."""
+    stored = ndb.Key(ConferenceAgenda, wsck).get()
+    if stored is not None and stored.sessionsVersion > version:
+        return False
+    ConferenceAgenda(id=wsck, sessionsVersion=version, forms=data).put()
+    return True
+
+
+def storeAgenda(wsck, version, forms):
+    """Store a freshly built agenda in memcache & the datastore;
+    return it encoded."""
+    data = encodeAgenda(forms)
+    key = MEMCACHE_AGENDA_KEY % (wsck, version)
+    setBlob(key, data, time=AGENDA_CACHE_TIME)
+    local.set(key, data, ttl=LOCAL_VERSIONED_TTL)
+    if len(data) > AGENDA_STORE_MAX:
+        logging.info('Agenda of %s is %d bytes; not stored', wsck,
+                     len(data))
+        return data
+    try:
+        _putAgenda(wsck, version, data)
+    except Exception:
+        # the datastore copy is only a fallback; the reader still
+        # gets the agenda
+        logging.exception('Failed to store the agenda of %s', wsck)
+    return data
+
+
+def fillAgenda(wsck, version, render):
+    """Return the agenda of a Conference at sessionsVersion `version`,
+    calling render() for its SessionForms & storing them unless it's
+    in memcache or another request is building it (singleflight)."""
+    key = MEMCACHE_AGENDA_KEY % (wsck, version)
+    data = flights.fill(
+        key,
+        lambda: getBlob(key),
+        lambda: storeAgenda(wsck, version, render())
+    )
+    return decodeAgenda(data)
@@ -0,0 +1,19 @@
+#!/usr/bin/env python
+import os
+
+from settings import PROFILE_STARTUP_IMPORTS
+from startup import profiler
+
+"""appengine_config.py
+
+Conference Central instance configuration; the runtime imports this
+module before the app, so it starts the startup import profiler (see
+startup.py) on the dev_appserver, or in production if settings.py
+turns it on. The warmup handler stops it.
+
+"""
+
+
+if PROFILE_STARTUP_IMPORTS or \
+        os.environ.get('SERVER_SOFTWARE', '').startswith('Development'):
+    profiler.install()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+import argparse
+import random
+import sys
+import time
+from datetime import date, time as dtime, timedelta
+
+from storage import getStorage
+
+"""benchmark.py
+
+Conference Central storage throughput benchmark
+
+Seeds a Storage backend with a deterministic data set and replays the
+access patterns ConferenceApi uses (multi-filter conference queries,
+agenda reads, speaker lookups, registrations, wishlist updates),
+reporting operations per second for each. The patterns are
+re-implemented against the Storage interface rather than run through
+ConferenceApi, whose caches and derived data (see storage.py) are
+ndb-only, so this measures the storage layer alone. Defaults to the in-process
+SQLite backend, so it runs without the App Engine SDK:
+
+    python benchmark.py --conferences 500 --iterations 2000
+
+"""
+
+
+CITIES = ('London', 'Paris', 'Tokyo', 'San Francisco', 'Chicago', 'Berlin')
+TOPICS = ('Medical Innovations', 'Programming Languages', 'Web Technologies',
+          'Movie Making', 'Health and Nutrition')
+SESSION_TYPES = ('Keynote', 'Lecture', 'Workshop', 'Roundtable', 'Brownbag')
+
+
+def seed(storage, rnd, conferences, sessions_per_conf, profiles):
+    """Fill storage with a deterministic data set; return its keys."""
+    users = ['user%d@example.com' % i for i in range(profiles)]
+    storage.putMulti([
+        storage.newProfile(u, displayName=u.split('@')[0],
+                           mainEmail=u, teeShirtSize='NOT_SPECIFIED')
+        for u in users])
+
+    conf_keys = []
+    session_keys = []
+    for i in range(conferences):
+        start = date(2026, 1, 1) + timedelta(days=rnd.randrange(365))
+        seats = rnd.choice((10, 50, 100, 500))
+        conf = storage.newConference(
+            rnd.choice(users),
+            name='Conference %d' % i,
+            city=rnd.choice(CITIES),
+            topics=rnd.sample(TOPICS, 2),
+            startDate=start,
+            endDate=start + timedelta(days=2),
+            month=start.month,
+            maxAttendees=seats,
+            seatsAvailable=seats)
+        conf_keys.append(storage.put(conf))
+
+        agenda = []
+        for j in range(sessions_per_conf):
+            agenda.append(storage.newSession(
+                conf.key,
+                name='Session %d.%d' % (i, j),
+                speaker=storage.profileKey(rnd.choice(users)),
+                typeOfSession=rnd.choice(SESSION_TYPES),
+                date=start + timedelta(days=rnd.randrange(3)),
+                duration=rnd.choice((30, 45, 60, 90)),
+                startTime=dtime(rnd.randrange(8, 20), 0)))
+        session_keys.extend(storage.putMulti(agenda))
+    return users, conf_keys, session_keys
+
+
+def queryConferences(storage, rnd, ctx):
+    """Two-filter query: keys per filter, intersect, get_multi."""
+    sets = None
+    for field, op, value in (('city', '=', rnd.choice(CITIES)),
+                             ('month', '>=', rnd.randrange(1, 13))):
+        keys = set(storage.conferenceKeysWhere(field, op, value))
+        sets = keys if sets is None else sets & keys
+    storage.getMulti(list(sets))
+
+
+def conferenceSessions(storage, rnd, ctx):
+    """Agenda read: all Sessions of a Conference."""
+    storage.sessionsForConference(rnd.choice(ctx['conferences']))
+
+
+def sessionsBySpeaker(storage, rnd, ctx):
+    """Speaker page: Sessions of one speaker across Conferences."""
+    storage.sessionsBySpeaker(storage.profileKey(rnd.choice(ctx['users'])))
+
+
+def register(storage, rnd, ctx):
+    """Registration: Profile + Conference read-modify-write."""
+    user = rnd.choice(ctx['users'])
+    c_key = rnd.choice(ctx['conferences'])
+
+    def txn():
+        prof, conf = storage.getMulti([storage.profileKey(user), c_key])
+        wsck = c_key.urlsafe()
+        if wsck in prof.conferenceKeysToAttend:
+            prof.conferenceKeysToAttend.remove(wsck)
+            conf.seatsAvailable += 1
+        elif conf.seatsAvailable > 0:
+            prof.conferenceKeysToAttend.append(wsck)
+            conf.seatsAvailable -= 1
+        storage.putMulti([prof, conf])
+    storage.transaction(txn, xg=True)
+
+
+def wishlist(storage, rnd, ctx):
+    """Wishlist add: Profile read-modify-write."""
+    prof = storage.get(storage.profileKey(rnd.choice(ctx['users'])))
+    sk = rnd.choice(ctx['sessions']).urlsafe()
+    if sk not in prof.sessionWishList:
+        prof.sessionWishList.append(sk)
+        storage.put(prof)
+
+
+BENCHMARKS = (
+    queryConferences,
+    conferenceSessions,
+    sessionsBySpeaker,
+    register,
+    wishlist,
+)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Conference Central storage throughput benchmark')
+    parser.add_argument('--backend', default='sqlite')
+    parser.add_argument('--db', default=':memory:',
+                        help='SQLite database path')
+    parser.add_argument('--conferences', type=int, default=200)
+    parser.add_argument('--sessions', type=int, default=20,
+                        help='sessions per conference')
+    parser.add_argument('--profiles', type=int, default=1000)
+    parser.add_argument('--iterations', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    options = {'path': args.db} if args.backend == 'sqlite' else {}
+    storage = getStorage(args.backend, **options)
+    rnd = random.Random(args.seed)
+
+    started = time.time()
+    users, confs, sessions = seed(
+        storage, rnd, args.conferences, args.sessions, args.profiles)
+    print('seeded %d conferences, %d sessions, %d profiles in %.2fs' % (
+        len(confs), len(sessions), len(users), time.time() - started))
+
+    ctx = {'users': users, 'conferences': confs, 'sessions': sessions}
+    for bench in BENCHMARKS:
+        rnd = random.Random(args.seed)
+        started = time.time()
+        for _ in range(args.iterations):
+            bench(storage, rnd, ctx)
+        elapsed = time.time() - started
+        print('%-20s %8.0f ops/s  %7.3f ms/op' % (
+            bench.__name__, args.iterations / elapsed,
+            elapsed * 1000 / args.iterations))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+import gzip
+import hashlib
+import io
+import os
+import re
+import sys
+from urlparse import urljoin
+
+"""build_assets.py
+
+Conference Central static asset build step
+
+Concatenates and minifies the local CSS and JS that templates/index.html
+loads (between its <!-- build:css --> / <!-- build:js --> markers) into
+content-hashed bundles under static/dist, writes templates/index.dist.html
+referencing the bundles, and regenerates the static handlers between the
+markers in app.yaml so that the bundles are served with a far-future
+expiration. Run it from the project root before deploying:
+
+    python build_assets.py
+
+"""
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+INDEX_SRC = 'templates/index.html'
+INDEX_DIST = 'templates/index.dist.html'
+DIST_DIR = 'static/dist'
+DIST_URL = '/dist'
+APP_YAML = 'app.yaml'
+
+# URL prefixes of the static_dir handlers, mapped to their directories
+STATIC_DIRS = [
+    ('/js', 'static/js'),
+    ('/img', 'static/img'),
+    ('/css', 'static/bootstrap/css'),
+    ('/fonts', 'static/fonts'),
+    ('/partials', 'static/partials'),
+]
+
+BUNDLE_EXPIRATION = '365d'  # bundles are content-hashed, never change
+DEFAULT_EXPIRATION = '1h'  # everything else (index, partials, images)
+
+BUILD_BLOCK = re.compile(
+    r'([ \t]*)<!-- build:(css|js) -->\s*(.*?)\s*<!-- endbuild -->',
+    re.S)
+ASSET_REF = re.compile(r'(?:href|src)="(/[^"]+)"')
+YAML_BEGIN = '# BEGIN static handlers (generated by build_assets.py)'
+YAML_END = '# END static handlers'
+
+
+# - - - Minifiers - - - - - - - - - - - - - - - - - - - - - - -
+
+def minifyCss(css, url):
+    """Strip comments & whitespace; make relative url()s absolute."""
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+
+    def absolute(match):
+        ref = match.group(2)
+        if re.match(r'^(/|data:|[a-z]+:)', ref):
+            return match.group(0)
+        return 'url(%s%s%s)' % (match.group(1), urljoin(url, ref),
+                                match.group(1))
+    css = re.sub(r'url\(\s*([\'"]?)(.*?)\1\s*\)', absolute, css)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,])\s*', r'\1', css)
+    css = css.replace(';}', '}')
+    return css.strip()
+
+
+def minifyJs(js):
+    """Conservatively minify JS: drop comments, indentation and blank
+    lines, but keep line breaks so automatic semicolon insertion still
+    behaves the same. String literals are left untouched."""
+    out = []
+    i = 0
+    n = len(js)
+    while i < n:
+        c = js[i]
+        if c in '\'"':
+            j = i + 1
+            while j < n and js[j] != c:
+                j += 2 if js[j] == '\\' else 1
+            out.append(js[i:j + 1])
+            i = j + 1
+        elif js.startswith('//', i):
+            i = js.find('\n', i)
+            if i < 0:
+                break
+        elif js.startswith('/*', i):
+            end = js.find('*/', i + 2)
+            i = n if end < 0 else end + 2
+        else:
+            out.append(c)
+            i += 1
+    lines = (line.strip() for line in ''.join(out).splitlines())
+    return '\n'.join(line for line in lines if line)
+
+
+# - - - Build - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def urlToPath(url):
+    """Return the file served for a static URL."""
+    for prefix, directory in STATIC_DIRS:
+        if url.startswith(prefix + '/'):
+            return os.path.join(ROOT, directory, url[len(prefix) + 1:])
+    raise ValueError('No static handler serves %s' % url)
+
+
+def gzippedSize(data):
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=9) as f:
+        f.write(data)
+    return len(buf.getvalue())
+
+
+def buildBundle(kind, urls, report):
+    """Write the minified, hashed bundle; return its URL."""
+    parts = []
+    for url in urls:
+        with open(urlToPath(url), 'rb') as f:
+            source = f.read()
+        report['before'].append((url, len(source), gzippedSize(source)))
+        if kind == 'css':
+            parts.append(minifyCss(source, url))
+        else:
+            parts.append(minifyJs(source))
+
+    if kind == 'css':
+        # @import rules are only valid at the top of a stylesheet
+        bundle = '\n'.join(parts)
+        imports = re.findall(r'@import[^;]+;', bundle)
+        bundle = ''.join(imports) + re.sub(r'@import[^;]+;', '', bundle)
+    else:
+        # guard against files that don't end with a semicolon
+        bundle = ';\n'.join(parts) + ';'
+
+    digest = hashlib.md5(bundle).hexdigest()[:12]
+    name = 'app.%s.%s' % (digest, kind)
+    if not os.path.isdir(os.path.join(ROOT, DIST_DIR)):
+        os.makedirs(os.path.join(ROOT, DIST_DIR))
+    with open(os.path.join(ROOT, DIST_DIR, name), 'wb') as f:
+        f.write(bundle)
+    report['after'].append(
+        (DIST_URL + '/' + name, len(bundle), gzippedSize(bundle)))
+    return DIST_URL + '/' + name
+
+
+def buildIndex(report):
+    """Bundle every build block of the index; write the dist index."""
+    with open(os.path.join(ROOT, INDEX_SRC)) as f:
+        html = f.read()
+
+    def replace(match):
+        indent, kind, block = match.groups()
+        url = buildBundle(kind, ASSET_REF.findall(block), report)
+        if kind == 'css':
+            return '%s<link rel="stylesheet" href="%s">' % (indent, url)
+        return '%s<script src="%s"></script>' % (indent, url)
+
+    html = BUILD_BLOCK.sub(replace, html)
+    with open(os.path.join(ROOT, INDEX_DIST), 'w') as f:
+        f.write(html)
+
+
+def staticHandlers():
+    """Return the app.yaml static handlers for the built site."""
+    lines = [
+        YAML_BEGIN,
+        '',
+        '- url: /favicon\\.ico',
+        '  static_files: favicon.ico',
+        '  upload: favicon\\.ico',
+        '',
+        '- url: %s' % DIST_URL,
+        '  static_dir: %s' % DIST_DIR,
+        '  expiration: "%s"' % BUNDLE_EXPIRATION,
+        '  http_headers:',
+        '    Vary: Accept-Encoding',
+        '',
+    ]
+    for prefix, directory in STATIC_DIRS:
+        lines.extend([
+            '- url: %s' % prefix,
+            '  static_dir: %s' % directory,
+            '  expiration: "%s"' % DEFAULT_EXPIRATION,
+            '',
+        ])
+    lines.extend([
+        '- url: /',
+        '  static_files: %s' % INDEX_DIST,
+        '  upload: %s' % re.escape(INDEX_DIST).replace('\\/', '/'),
+        '  expiration: "0s"',
+        '  secure: always',
+        '',
+        YAML_END,
+    ])
+    return '\n'.join(lines)
+
+
+def writeAppYaml():
+    """Replace the generated section of app.yaml."""
+    with open(os.path.join(ROOT, APP_YAML)) as f:
+        yaml = f.read()
+    start = yaml.index(YAML_BEGIN)
+    end = yaml.index(YAML_END) + len(YAML_END)
+    with open(os.path.join(ROOT, APP_YAML), 'w') as f:
+        f.write(yaml[:start] + staticHandlers() + yaml[end:])
+
+
+def printReport(report):
+    """Print first-load request count & bytes before and after."""
+    for label in ('before', 'after'):
+        rows = report[label]
+        print '%s: %d requests, %d bytes (%d gzipped)' % (
+            label, len(rows), sum(r[1] for r in rows),
+            sum(r[2] for r in rows))
+        for url, size, gz in rows:
+            print '    %-40s %8d %8d' % (url, size, gz)
+
+
+def main():
+    report = {'before': [], 'after': []}
+    buildIndex(report)
+    writeAppYaml()
+    printReport(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,431 @@
+#!/usr/bin/env python
+import logging
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from protorpc import protobuf
+
+from google.appengine.api import memcache
+
+"""caching.py
+
+Conference Central cache helpers
+
+Generation counters: cached values embed the current generation of the
+data they were built from in their memcache key, so bumping the
+generation invalidates every one of them at once without having to
+know their keys.
+
+Cache stats: hit/miss counters per cache, kept in-process and added
+to memcache totals periodically (reported by main.py).
+
+Local cache: a small in-process LRU cache in front of memcache for hot
+keys (the notices every page view reads, and versioned values such as
+agendas), so most reads of them take no RPC at all.
+
+Codec: cached ProtoRPC messages are stored protobuf-encoded, and
+zlib-compressed above COMPRESS_THRESHOLD. Values too big for one
+memcache item are split into chunks under key:0, key:1, ... with a
+header item under the key itself; the header and every chunk carry
+the same random generation, and a read that finds chunks from another
+generation (a concurrent rewrite, or an eviction followed by one) is
+a miss rather than a torn value.
+
+Singleflight: when a cached value goes cold (after an invalidation, or
+for a new conference), only one request rebuilds it. Concurrent
+requests in the same instance share that request's result, and other
+instances see its memcache lease and poll the cache for the result (or
+serve stale data if they have some) rather than rebuild it too.
+
+"""
+
+
+MEMCACHE_GENERATION_KEY = 'GENERATION:%s'
+MEMCACHE_CACHE_STATS_NAMESPACE = 'cachestats'
+STATS_FLUSH_INTERVAL = 60  # seconds between flushes of local counters
+
+LOCAL_CACHE_SIZE = 500  # entries kept in each instance's LocalCache
+LOCAL_CACHE_TTL = 10  # seconds an entry is fresh, unless set per key
+LOCAL_CACHE_STALE = 60  # seconds after that it may still be served
+# values whose key embeds a version/generation never change, so they
+# can stay fresh for as long as the LRU keeps them
+LOCAL_VERSIONED_TTL = 60 * 60
+
+COMPRESS_THRESHOLD = 1024  # bytes; smaller messages aren't compressed
+CHUNK_SIZE = 900 * 1000  # bytes per memcache item (the limit is 1MB)
+CHUNK_KEY = '%s:%d'  # key, chunk number
+_RAW = '\x00'  # packed message prefixes
+_COMPRESSED = '\x01'
+
+FILL_LEASE_KEY = 'FILL:%s'  # cache key being filled
+FILL_LEASE_TIME = 10  # seconds; a lease outlives a dead filler no longer
+FILL_WAIT = 2.0  # seconds to wait for someone else's fill
+FILL_POLL_INTERVAL = 0.1  # seconds between cache checks while waiting
+
+CONFERENCE_GENERATION = 'Conference'
+
+# names of the caches whose hit/miss counts are reported
+ANNOUNCEMENT_CACHE = 'announcement'
+FEATURED_SPEAKER_CACHE = 'featuredSpeaker'
+CONFERENCE_QUERY_CACHE = 'queryConferences'
+AGENDA_CACHE = 'agenda'
+AGENDA_STORE_CACHE = 'agendaDatastore'  # fallback after a memcache miss
+SPEAKER_CACHE = 'speakerProfile'
+POPULAR_CACHE = 'popularConferences'
+CACHES = (CONFERENCE_QUERY_CACHE, AGENDA_CACHE, AGENDA_STORE_CACHE,
+          SPEAKER_CACHE, POPULAR_CACHE)
+
+
+# - - - Generations - - - - - - - - - - - - - - - - - - - - - -
+
+def getGeneration(name):
+    """Return the current generation of the named data set."""
+    key = MEMCACHE_GENERATION_KEY % name
+    generation = memcache.get(key)
+    if generation is None:
+        # seed with the clock rather than 0 so that a counter lost to
+        # eviction never comes back at a value that old entries used
+        memcache.add(key, int(time.time()))
+        generation = memcache.get(key)
+    return generation
+
+
+def bumpGeneration(name):
+    """Invalidate everything cached against the named data set."""
+    return memcache.incr(
+        MEMCACHE_GENERATION_KEY % name, initial_value=int(time.time()))
+
+
+# - - - Stats - - - - - - - - - - - - - - - - - - - - - - - - -
+
+class CacheStats(object):
+    """CacheStats -- thread-safe hit/miss counters for named caches"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._lastFlush = time.time()
+
+    def hit(self, cache):
+        self._add('%s:hits' % cache)
+
+    def miss(self, cache):
+        self._add('%s:misses' % cache)
+
+    def _add(self, key):
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + 1
+            due = time.time() - self._lastFlush >= STATS_FLUSH_INTERVAL
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Add the local counts to the memcache totals and reset."""
+        with self._lock:
+            counts, self._counts = self._counts, {}
+            self._lastFlush = time.time()
+        if counts:
+            try:
+                memcache.offset_multi(
+                    counts, namespace=MEMCACHE_CACHE_STATS_NAMESPACE,
+                    initial_value=0)
+            except Exception:
+                logging.exception('Failed to flush cache stats')
+
+    def report(self, caches):
+        """Return {cache: {hits, misses, hitRate}} for named caches."""
+        keys = []
+        for cache in caches:
+            keys.extend(['%s:hits' % cache, '%s:misses' % cache])
+        totals = memcache.get_multi(
+            keys, namespace=MEMCACHE_CACHE_STATS_NAMESPACE) or {}
+        with self._lock:
+            for key, count in self._counts.items():
+                totals[key] = totals.get(key, 0) + count
+
+        report = {}
+        for cache in caches:
+            hits = totals.get('%s:hits' % cache, 0)
+            misses = totals.get('%s:misses' % cache, 0)
+            report[cache] = {
+                'hits': hits,
+                'misses': misses,
+                'hitRate': hits / float(hits + misses) if hits else 0.0,
+            }
+        return report
+
+
+stats = CacheStats()
+
+
+# - - - Codec - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def packMessage(message):
+    """Return a ProtoRPC message as bytes for caching."""
+    data = protobuf.encode_message(message)
+    if len(data) < COMPRESS_THRESHOLD:
+        return _RAW + data
+    return _COMPRESSED + zlib.compress(data)
+
+
+def unpackMessage(message_type, data):
+    """Return the message packed by packMessage; raise ValueError if
+    the data has no packMessage prefix (it's corrupt)."""
+    if data[:1] == _RAW:
+        data = data[1:]
+    elif data[:1] == _COMPRESSED:
+        data = zlib.decompress(data[1:])
+    else:
+        raise ValueError('Not a packed message')
+    return protobuf.decode_message(message_type, data)
+
+
+def setBlob(key, data, time=0):
+    """Store a str in memcache, in chunks if it's too big for one
+    item. Chunks go in before the header that points at them, so
+    readers never see a header without its chunks."""
+    if len(data) <= CHUNK_SIZE:
+        return memcache.set(key, data, time=time)
+    generation = os.urandom(8)
+    chunks = {}
+    for i, offset in enumerate(xrange(0, len(data), CHUNK_SIZE)):
+        chunks[CHUNK_KEY % (key, i)] = (
+            generation + data[offset:offset + CHUNK_SIZE])
+    if memcache.set_multi(chunks, time=time):
+        return False  # some chunks weren't stored
+    return memcache.set(
+        key, (generation, len(chunks), len(data)), time=time)
+
+
+def getBlob(key):
+    """Return a str stored by setBlob, or None on a miss (including
+    missing or torn chunks)."""
+    value = memcache.get(key)
+    if value is None or isinstance(value, str):
+        return value
+    if not isinstance(value, tuple):
+        return None  # written by older code
+    generation, count, length = value
+    keys = [CHUNK_KEY % (key, i) for i in xrange(count)]
+    chunks = memcache.get_multi(keys)
+    parts = []
+    for chunk_key in keys:
+        chunk = chunks.get(chunk_key)
+        if chunk is None or chunk[:len(generation)] != generation:
+            logging.info('Missing or torn chunk %s', chunk_key)
+            return None
+        parts.append(chunk[len(generation):])
+    data = ''.join(parts)
+    return data if len(data) == length else None
+
+
+# - - - Singleflight - - - - - - - - - - - - - - - - - - - - -
+
+class _Flight(object):
+    """_Flight -- one in-progress call, shared by concurrent callers"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.failed = False
+
+
+class SingleFlight(object):
+    """SingleFlight -- coalesces concurrent fills of the same key
+
+    do() runs a function once for all the threads of this instance that
+    ask for the same key at the same time. fill() adds a memcache lease
+    (add) around the build so that only one instance builds a key at a
+    time. A caller never waits more than FILL_WAIT for someone else:
+    after that it builds the value itself, so a lost lease or a dead
+    filler costs latency, not errors.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}  # key -> _Flight
+        self._counts = {'builds': 0, 'shared': 0, 'waited': 0,
+                        'stale': 0, 'timeouts': 0}
+
+    def do(self, key, func):
+        """Return func(); concurrent callers with the same key share
+        one call and its result."""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            if flight.done.wait(FILL_WAIT) and not flight.failed:
+                self._count('shared')
+                return flight.value
+            # the leader failed or is stuck; try for ourselves
+            self._count('timeouts')
+            return func()
+
+        try:
+            flight.value = func()
+        except Exception:
+            flight.failed = True
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+        return flight.value
+
+    def fill(self, key, check, build, stale=None):
+        """Return the cached value for key, building it if needed.
+
+        check() returns the cached value (typically a memcache get) or
+        None; build() computes the value, caches it and returns it.
+        While another instance holds the key's lease, return stale()
+        if it gives a value, else poll check() for up to FILL_WAIT.
+        """
+        def lead():
+            value = check()
+            if value is not None:
+                return value
+            lease = FILL_LEASE_KEY % key
+            if memcache.add(lease, 1, time=FILL_LEASE_TIME):
+                try:
+                    self._count('builds')
+                    return build()
+                finally:
+                    memcache.delete(lease)
+
+            value = stale() if stale else None
+            if value is not None:
+                self._count('stale')
+                return value
+            deadline = time.time() + FILL_WAIT
+            while time.time() < deadline:
+                time.sleep(FILL_POLL_INTERVAL)
+                value = check()
+                if value is not None:
+                    self._count('waited')
+                    return value
+            self._count('timeouts')
+            self._count('builds')
+            return build()
+
+        return self.do(key, lead)
+
+    def _count(self, counter):
+        with self._lock:
+            self._counts[counter] += 1
+
+    def report(self):
+        """Return this instance's counters."""
+        with self._lock:
+            report = dict(self._counts)
+            report['inFlight'] = len(self._flights)
+        return report
+
+
+flights = SingleFlight()
+
+
+# - - - Local cache - - - - - - - - - - - - - - - - - - - - - -
+
+class LocalCache(object):
+    """LocalCache -- thread-safe, size-bounded in-process LRU cache
+
+    Entries have a per-key TTL. Once an entry goes stale (but for no
+    longer than its stale period) it is still served, and the first
+    reader to find it stale reloads it while concurrent readers keep
+    getting the stale value (stale-while-revalidate). The loader is
+    typically a memcache get; concurrent misses of the same key share
+    one load. None results are never cached. Counters are per named
+    cache, for this instance only.
+    """
+
+    def __init__(self, maxSize=LOCAL_CACHE_SIZE):
+        self._lock = threading.Lock()
+        self._maxSize = maxSize
+        # key -> [value, freshUntil, staleUntil, refreshing]
+        self._entries = OrderedDict()
+        self._counts = {}
+        self._loads = SingleFlight()
+        self.evictions = 0
+
+    def get(self, cache, key, loader, ttl=LOCAL_CACHE_TTL,
+            stale=LOCAL_CACHE_STALE):
+        """Return the value for key, calling loader() to fill or
+        refresh it; cache names the read path for the counters."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and now < entry[2]:
+                self._entries[key] = entry  # most recently used
+                if now < entry[1]:
+                    self._count(cache, 'hits')
+                    return entry[0]
+                if entry[3]:
+                    # someone else is already reloading it
+                    self._count(cache, 'staleHits')
+                    return entry[0]
+                entry[3] = True
+            self._count(cache, 'misses')
+
+        try:
+            if entry is None:
+                value = self._loads.do(key, loader)
+            else:
+                value = loader()
+        except Exception:
+            if entry is None or now >= entry[2]:
+                raise
+            # keep serving the stale value; let the next reader retry
+            logging.exception('Failed to refresh local cache key %s', key)
+            entry[3] = False
+            return entry[0]
+        if value is None:
+            self.delete(key)
+        else:
+            self.set(key, value, ttl, stale)
+        return value
+
+    def set(self, key, value, ttl=LOCAL_CACHE_TTL, stale=LOCAL_CACHE_STALE):
+        """Store a value, evicting the least recently used entries if
+        the cache is full."""
+        now = time.time()
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = [value, now + ttl, now + ttl + stale, False]
+            while len(self._entries) > self._maxSize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _count(self, cache, counter):
+        """Bump a counter; call with the lock held."""
+        counts = self._counts.setdefault(
+            cache, {'hits': 0, 'staleHits': 0, 'misses': 0})
+        counts[counter] += 1
+
+    def report(self):
+        """Return this instance's counters & size."""
+        with self._lock:
+            report = dict((cache, dict(counts))
+                          for cache, counts in self._counts.items())
+            size = len(self._entries)
+        for counts in report.values():
+            served = counts['hits'] + counts['staleHits']
+            counts['hitRate'] = (
+                served / float(served + counts['misses']) if served else 0.0)
+        return {'caches': report, 'size': size, 'maxSize': self._maxSize,
+                'evictions': self.evictions}
+
+
+local = LocalCache()
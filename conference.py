@@ -1,20 +1,28 @@
 #!/usr/bin/env python
+import hashlib
+import json
+import time
 from datetime import datetime
 
 import endpoints
 from protorpc import messages, message_types, remote
 
-from google.appengine.api import memcache, taskqueue
+from google.appengine.api import memcache
 from google.appengine.ext import ndb
 from operator import attrgetter
 
 from models import (
     BooleanMessage,
+    BootstrapForm,
+    ChangesForm,
     Conference,
     ConferenceForm,
     ConferenceForms,
     ConferenceQueryForms,
     ConflictException,
+    NotModifiedException,
+    PopularConferenceForm,
+    PopularConferenceForms,
     Profile,
     ProfileForm,
     ProfileForms,
@@ -24,6 +32,7 @@ from models import (
     SessionForms,
     SessionQueryForms,
     SessionType,
+    SpeakerProfileForm,
     StringMessage,
     TeeShirtSize
 )
@@ -32,10 +41,79 @@ from settings import (
     WEB_CLIENT_ID,
     ANDROID_CLIENT_ID,
     IOS_CLIENT_ID,
-    ANDROID_AUDIENCE
+    ANDROID_AUDIENCE,
+    STORAGE_BACKEND
 )
 
-from utils import getUserId
+from agenda import fillAgenda, loadAgenda, sortKey
+from caching import (
+    ANNOUNCEMENT_CACHE,
+    CONFERENCE_GENERATION,
+    CONFERENCE_QUERY_CACHE,
+    FEATURED_SPEAKER_CACHE,
+    LOCAL_VERSIONED_TTL,
+    SPEAKER_CACHE,
+    bumpGeneration,
+    flights,
+    getBlob,
+    getGeneration,
+    local,
+    packMessage,
+    setBlob,
+    stats,
+    unpackMessage
+)
+from idempotency import getIdempotencyKey, idempotent
+from instrumentation import instrumented
+from leaderboard import (
+    POPULAR_TOP_K,
+    conferenceScopes,
+    popularConferences,
+    popularScope,
+    recordPopularity,
+    schedulePopularity,
+)
+from mailer import conferencePayload, queueEmail, scheduleDrain
+from queryplan import QueryPlan, describeFilter
+from recommendations import RECOMMEND_TOP_K, recommendationsKey
+from speakers import (
+    MEMCACHE_SPEAKER_PAGE_KEY,
+    SPEAKER_PAGE_CACHE_TIME,
+    SPEAKER_PAGE_MAX,
+    SPEAKER_PAGE_SIZE,
+    addToIndex,
+    buildIndex,
+    decodeCursor,
+    encodeCursor,
+    getIndex,
+    indexKey,
+    markDeleted,
+    sessionCount,
+    touchIndex
+)
+from storage import getStorage
+from sync import (
+    SYNC_PAGE_MAX,
+    SYNC_PAGE_SIZE,
+    changesPage,
+    decodeSyncCursor,
+    encodeSyncCursor,
+    newSync,
+    syncToken,
+    tombstone,
+    touch
+)
+from tasks import enqueueCoalesced
+from waitlist import addEntry, nextEntries, removeEntry, schedulePromotion
+from utils import (
+    IdPool,
+    copyPlan,
+    getUserId,
+    maskForm,
+    maskTag,
+    parseFields,
+    wants
+)
 
 """
 conference.py -- Udacity conference server-side Python App Engine API;
@@ -60,6 +138,15 @@ ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
 
 MEMCACHE_FEATURED_SPEAKER_KEY = "FEATURED_SPEAKER"
 FEATURED_SPEAKER_TPL = ('Featured speakers: %s.')
+
+# Conference IDs are allocated this many at a time per instance
+CONF_ID_POOL_SIZE = 20
+
+# queryConferences results, keyed by Conference generation & filters
+MEMCACHE_CONF_QUERY_KEY = "CONF_QUERY:%s:%s"
+# the latest results of each query, whatever their generation
+MEMCACHE_CONF_QUERY_LAST_KEY = "CONF_QUERY_LAST:%s"
+CONF_QUERY_CACHE_TIME = 60 * 60  # seconds
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 DEFAULTS = {
@@ -102,6 +189,26 @@ CONF_GET_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+# `fields` (on these & other list/get requests) is a comma-separated
+# mask of the form fields to return; see utils.parseFields
+CONF_FIELDS_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    fields=messages.StringField(2),
+)
+
+CONF_LIST_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    fields=messages.StringField(1),
+)
+
+CONF_POPULAR_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    city=messages.StringField(1),
+    month=messages.IntegerField(2, variant=messages.Variant.INT32),
+    limit=messages.IntegerField(3, variant=messages.Variant.INT32),
+)
+
 CONF_POST_REQUEST = endpoints.ResourceContainer(
     ConferenceForm,
     websafeConferenceKey=messages.StringField(1),
@@ -110,22 +217,46 @@ CONF_POST_REQUEST = endpoints.ResourceContainer(
 SESSION_LIST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
+    fields=messages.StringField(2),
 )
 
 SESSION_LIST_BY_SPEAKER = endpoints.ResourceContainer(
     message_types.VoidMessage,
     speaker=messages.StringField(1),
+    fields=messages.StringField(2),
+)
+
+SPEAKER_PROFILE_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    speaker=messages.StringField(1),
+    cursor=messages.StringField(2),
+    limit=messages.IntegerField(3, variant=messages.Variant.INT32),
+    fields=messages.StringField(4),  # applies to the sessions
 )
 
 SESSION_LIST_BY_TYPE = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
     typeOfSession=messages.StringField(2),
+    fields=messages.StringField(3),
 )
 
 SESSION_LIST_BY_USER_AS_SPEAKER = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
+    fields=messages.StringField(2),
+)
+
+SESSION_DELETE_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeSessionKey=messages.StringField(1),
+)
+
+SESSION_RECOMMENDED_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeSessionKey=messages.StringField(1),
+    limit=messages.IntegerField(2, variant=messages.Variant.INT32),
+    fields=messages.StringField(3),
 )
 
 SESSION_WISHLIST_ADD = endpoints.ResourceContainer(
@@ -135,6 +266,7 @@ SESSION_WISHLIST_ADD = endpoints.ResourceContainer(
 
 SESSION_WISHLIST = endpoints.ResourceContainer(
     message_types.VoidMessage,
+    fields=messages.StringField(1),
 )
 
 SESSION_QUERY = endpoints.ResourceContainer(
@@ -142,6 +274,19 @@ SESSION_QUERY = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+CHANGES_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    token=messages.StringField(1),  # syncToken of the previous sync
+    cursor=messages.StringField(2),
+    limit=messages.IntegerField(3, variant=messages.Variant.INT32),
+)
+
+CONF_ID_POOL = IdPool(Conference, CONF_ID_POOL_SIZE)
+
+# repository used by the endpoints for entity reads & writes; creating
+# Conferences & Sessions stays on ndb (transactions, tasks, ID pools)
+storage = getStorage(STORAGE_BACKEND)
+
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
@@ -162,26 +307,27 @@ class ConferenceApi(remote.Service):
 
 # - - - Conference objects - - - - - - - - - - - - - - - - -
 
-    def _copyConferenceToForm(self, conf, displayName):
-        """Copy relevant fields from Conference to ConferenceForm."""
+    def _copyConferenceToForm(self, conf, displayName, fields=None):
+        """Copy relevant fields from Conference to ConferenceForm;
+        fields is an optional mask of the fields to copy."""
         cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
-        if displayName:
+        for name in copyPlan(ConferenceForm, Conference):
+            if not wants(fields, name):
+                continue
+            # convert Date to date string; just copy others
+            if name.endswith('Date'):
+                setattr(cf, name, str(getattr(conf, name)))
+            else:
+                setattr(cf, name, getattr(conf, name))
+        cf.websafeKey = conf.key.urlsafe()
+        if displayName and wants(fields, 'organizerDisplayName'):
             setattr(cf, 'organizerDisplayName', displayName)
         cf.check_initialized()
         return cf
 
     def _createConferenceObject(self, request):
         """Create or update Conference object, returning
-        ConferenceForm/request."""
+        ConferenceForm."""
         # preload necessary data items
         user = endpoints.get_current_user()
         if not user:
@@ -199,6 +345,7 @@ class ConferenceApi(remote.Service):
         }
         del data['websafeKey']
         del data['organizerDisplayName']
+        del data['etag']
 
         # add default values for those missing
         # (both data model & outbound Message)
@@ -222,22 +369,59 @@ class ConferenceApi(remote.Service):
         # set seatsAvailable to be same as maxAttendees on creation
         if data["maxAttendees"] > 0:
             data["seatsAvailable"] = data["maxAttendees"]
-        # generate Profile Key based on user ID and Conference
-        # ID based on Profile key get Conference key from ID
-        p_key = ndb.Key(Profile, user_id)
-        c_id = Conference.allocate_ids(size=1, parent=p_key)[0]
-        c_key = ndb.Key(Conference, c_id, parent=p_key)
-        data['key'] = c_key
         data['organizerUserId'] = request.organizerUserId = user_id
+        email = (user.email(), 'conference_created',
+                 conferencePayload(request))
+
+        # generate Profile Key based on user ID; the Conference ID is
+        # derived from the client's idempotency key if one was sent (so
+        # a retried request maps onto the same Conference), otherwise
+        # it comes from this instance's pool of pre-allocated IDs
+        p_key = ndb.Key(Profile, user_id)
+        idempotency_key = self._getIdempotencyKey()
+        if idempotency_key:
+            c_key = ndb.Key(
+                Conference,
+                'req-' + hashlib.sha1(
+                    idempotency_key.encode('utf-8')).hexdigest(),
+                parent=p_key
+            )
+            conf, created = self._putNewConference(c_key, data, email)
+            if not created:
+                # retry of a request that already succeeded
+                return self._copyConferenceToForm(conf, None)
+        else:
+            while True:
+                c_key = ndb.Key(Conference, CONF_ID_POOL.next(), parent=p_key)
+                # pool IDs are allocated at the root, so they could
+                # clash with an older ID allocated under the Profile
+                conf, created = self._putNewConference(c_key, data, email)
+                if created:
+                    break
+
+        # the drain task is named (coalesced) so it can't be part of
+        # the transaction; the send_confirmation_emails cron covers us
+        # if it fails to enqueue
+        scheduleDrain()
+        bumpGeneration(CONFERENCE_GENERATION)
+        return self._copyConferenceToForm(conf, None)
+
+    @ndb.transactional()
+    def _putNewConference(self, c_key, data, email):
+        """Store a new Conference and queue its confirmation email in
+        one transaction; returns (Conference, whether it was created),
+        the Conference being the existing one if the key is taken."""
+        existing = c_key.get()
+        if existing:
+            return existing, False
+        conf = Conference(key=c_key, **data)
+        conf.put()
+        queueEmail(*email, transactional=True)
+        return conf, True
 
-        # create Conference, send email to organizer confirming
-        # creation of Conference & return (modified) ConferenceForm
-        Conference(**data).put()
-        taskqueue.add(params={
-            'email': user.email(),
-            'conferenceInfo': repr(request)
-        }, url='/tasks/send_confirmation_email')
-        return request
+    def _getIdempotencyKey(self):
+        """Return the client-supplied idempotency key, if any."""
+        return getIdempotencyKey(self.request_state)
 
     @ndb.transactional()
     def _updateConferenceObject(self, request):
@@ -268,6 +452,8 @@ class ConferenceApi(remote.Service):
 
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
+        seats = conf.seatsAvailable
+        scopes = conferenceScopes(conf)
         for field in request.all_fields():
             data = getattr(request, field.name)
             # only copy fields where we get data
@@ -279,7 +465,13 @@ class ConferenceApi(remote.Service):
                         conf.month = data.month
                 # write to Conference object
                 setattr(conf, field.name, data)
+        conf.version += 1
         conf.put()
+        # seats, city or month may have changed
+        schedulePopularity(conf, scopes)
+        # seats added by the organiser go to the waitlist first
+        if conf.seatsAvailable > seats:
+            schedulePromotion(conf.key)
         prof = ndb.Key(Profile, user_id).get()
         return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
 
@@ -290,8 +482,11 @@ class ConferenceApi(remote.Service):
         http_method='POST',
         name='createConference'
     )
+    @instrumented
     def createConference(self, request):
         """Create new conference."""
+        # not @idempotent: the idempotency key picks the Conference's
+        # ID, so a retry finds the Conference it created
         return self._createConferenceObject(request)
 
     @endpoints.method(
@@ -301,39 +496,77 @@ class ConferenceApi(remote.Service):
         http_method='PUT',
         name='updateConference'
     )
+    @instrumented
+    @idempotent(ConferenceForm)
     def updateConference(self, request):
         """Update conference w/provided fields & return w/updated info."""
-        return self._updateConferenceObject(request)
+        conf = self._updateConferenceObject(request)
+        bumpGeneration(CONFERENCE_GENERATION)
+        return conf
 
     @endpoints.method(
-        CONF_GET_REQUEST,
+        CONF_FIELDS_REQUEST,
         ConferenceForm,
         path='conference/{websafeConferenceKey}',
         http_method='GET',
         name='getConference'
     )
+    @instrumented
     def getConference(self, request):
         """Return requested conference (by websafeConferenceKey)."""
+        fields = self._fieldMask(ConferenceForm, request.fields)
         # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        conf = storage.get(storage.key(request.websafeConferenceKey))
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' %
                 request.websafeConferenceKey
             )
-        prof = conf.key.parent().get()
+        # skip the organiser lookup & form if the client is current
+        etag = '"c%d%s"' % (conf.version, maskTag(fields))
+        self._checkNotModified(etag)
+        displayName = None
+        if wants(fields, 'organizerDisplayName'):
+            displayName = getattr(
+                storage.get(conf.key.parent()), 'displayName')
         # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        cf = self._copyConferenceToForm(conf, displayName, fields)
+        cf.etag = etag
+        return cf
+
+    def _fieldMask(self, form_cls, fields):
+        """Return the parsed `fields` mask of a request (None if it
+        has none); raise BadRequestException for unknown fields."""
+        try:
+            return parseFields(form_cls, fields)
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
+
+    def _checkNotModified(self, etag):
+        """Raise NotModifiedException (HTTP 412) if the client sent
+        the current etag in If-None-Match. Endpoints v1 can't set
+        response headers, so etags are sent in the response body."""
+        header = self.request_state.headers.get('If-None-Match')
+        if not header:
+            return
+        for tag in header.split(','):
+            tag = tag.strip()
+            if tag.startswith('W/'):
+                tag = tag[2:]
+            if tag in (etag, '*'):
+                raise NotModifiedException()
 
     @endpoints.method(
-        message_types.VoidMessage,
+        CONF_LIST_REQUEST,
         ConferenceForms,
         path='getConferencesCreated',
         http_method='POST',
         name='getConferencesCreated'
     )
+    @instrumented
     def getConferencesCreated(self, request):
         """Return conferences created by user."""
+        fields = self._fieldMask(ConferenceForm, request.fields)
         # make sure user is authed
         user = endpoints.get_current_user()
         if not user:
@@ -341,39 +574,65 @@ class ConferenceApi(remote.Service):
         user_id = getUserId(user)
 
         # create ancestor query for all key matches for this user
-        confs = Conference.query(ancestor=ndb.Key(Profile, user_id))
-        prof = ndb.Key(Profile, user_id).get()
+        confs = storage.conferencesByOrganizer(user_id)
+        displayName = None
+        if wants(fields, 'organizerDisplayName'):
+            displayName = getattr(
+                storage.get(storage.profileKey(user_id)), 'displayName')
         # return set of ConferenceForm objects per Conference
         return ConferenceForms(
             items=[
-                self._copyConferenceToForm(
-                    conf, getattr(prof, 'displayName')) for conf in confs
+                self._copyConferenceToForm(conf, displayName, fields)
+                for conf in confs
             ]
         )
 
-    def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
-        q = Conference.query()
-        filters = self._formatFilters(request.filters, kind='conference')
-
+    def _canonicalFilters(self, filters):
+        """Return the submitted conference filters formatted, type
+        coerced, de-duplicated and sorted, so that equivalent filter
+        lists compare (and cache) equal."""
+        canonical = {}
+        for filtr in self._formatFilters(filters, kind='conference'):
+            if filtr["field"] in ["month", "maxAttendees"]:
+                try:
+                    filtr["value"] = int(filtr["value"])
+                except (TypeError, ValueError):
+                    raise endpoints.BadRequestException(
+                        "Filter value for '%s' must be a number." %
+                        filtr["field"])
+            canonical[
+                (filtr["field"], filtr["operator"], filtr["value"])] = filtr
+        return [canonical[k] for k in sorted(canonical)]
+
+    def _getQuery(self, filters, plan):
+        """Return formatted query from the canonical filters,
+        recording each step in the QueryPlan."""
         qf = []
         sets = None
         for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
-            formatted_query = ndb.query.FilterNode(
+            started = time.time()
+            qs = storage.conferenceKeysWhere(
                 filtr["field"], filtr["operator"], filtr["value"])
-            qs = q.filter(formatted_query).fetch(keys_only=True)
+            plan.record('filter', describeFilter(filtr), len(qs), started)
             qf.append(qs)
 
+        started = time.time()
         for idx, val in enumerate(qf):
             if (idx == 0):
                 sets = set(val)
             else:
                 sets = sets.intersection(val)
+                plan.record('intersect', 'AND filter %d' % (idx + 1),
+                            len(sets), started)
+                started = time.time()
 
+        started = time.time()
         if sets:
-            q = ndb.get_multi(sets)
+            q = storage.getMulti(list(sets))
+            plan.record('get_multi', 'Conference', len(q), started)
+        else:
+            q = storage.allConferences()
+            plan.record('scan', 'Conference', len(q), started)
 
         return q
 
@@ -406,16 +665,69 @@ class ConferenceApi(remote.Service):
         http_method='POST',
         name='queryConferences'
     )
+    @instrumented
     def queryConferences(self, request):
         """Query for conferences."""
-        conferences = self._getQuery(request)
+        fields = self._fieldMask(ConferenceForm, request.fields)
+        forms = self._conferenceQueryForms(request.filters, request.explain)
+        for form in forms.items:
+            maskForm(form, fields)
+        return forms
+
+    def _conferenceQueryForms(self, requestFilters, explain=False):
+        """Return ConferenceForms matching the query filters, from the
+        query cache if possible (never for explain). The forms are
+        complete, whatever the request's field mask, so that one cache
+        entry serves every mask."""
+        filters = self._canonicalFilters(requestFilters)
+        digest = hashlib.sha1(json.dumps(
+            [[f["field"], f["operator"], f["value"]] for f in filters]
+        )).hexdigest()
+        cache_key = MEMCACHE_CONF_QUERY_KEY % (
+            getGeneration(CONFERENCE_GENERATION), digest)
+
+        # explain requests always run the query so the plan is real
+        if explain:
+            plan = QueryPlan('Conference')
+            forms = self._fillConferenceQuery(filters, cache_key, plan)[0]
+            forms.plan = plan.toForm()
+            return forms
+
+        cached = local.get(
+            CONFERENCE_QUERY_CACHE, cache_key,
+            lambda: getBlob(cache_key), ttl=LOCAL_VERSIONED_TTL)
+        if cached:
+            stats.hit(CONFERENCE_QUERY_CACHE)
+        else:
+            stats.miss(CONFERENCE_QUERY_CACHE)
+            # one request runs the query; while it does, others get
+            # the results from before the last Conference write
+            last_key = MEMCACHE_CONF_QUERY_LAST_KEY % digest
+            cached = flights.fill(
+                cache_key,
+                lambda: getBlob(cache_key),
+                lambda: self._fillConferenceQuery(
+                    filters, cache_key, QueryPlan('Conference'),
+                    last_key)[1],
+                stale=lambda: getBlob(last_key)
+            )
+        return unpackMessage(ConferenceForms, cached)
+
+    def _fillConferenceQuery(self, filters, cache_key, plan, last_key=None):
+        """Run a conference query and cache its forms (also under
+        last_key, if given, as the fallback while the next generation
+        is being filled); return (forms, packed forms)."""
+        conferences = self._getQuery(filters, plan)
 
         # need to fetch organiser displayName from profiles
         # get all keys and use get_multi for speed
+        started = time.time()
         organisers = [
-            (ndb.Key(Profile, conf.organizerUserId)) for conf in conferences
+            storage.profileKey(conf.organizerUserId) for conf in conferences
         ]
-        profiles = ndb.get_multi(organisers)
+        profiles = storage.getMulti(organisers)
+        plan.record('get_multi', 'Profile (organisers)', len(profiles),
+                    started)
 
         # put display names in a dict for easier fetching
         names = {}
@@ -423,43 +735,74 @@ class ConferenceApi(remote.Service):
             names[profile.key.id()] = profile.displayName
 
         # return individual ConferenceForm object per Conference
-        return ConferenceForms(
+        conferences = sorted(conferences, key=attrgetter('name'))
+        forms = ConferenceForms(
             items=[
                 self._copyConferenceToForm(
                     conf, names[conf.organizerUserId]
-                ) for conf in sorted(conferences, key=attrgetter('name'))
+                ) for conf in conferences
             ]
         )
+        plan.logIfSlow()
+
+        # cache the rendered forms; any Conference write bumps the
+        # generation, which retires this entry
+        cached = packMessage(forms)
+        setBlob(cache_key, cached, time=CONF_QUERY_CACHE_TIME)
+        if last_key:
+            setBlob(last_key, cached, time=CONF_QUERY_CACHE_TIME)
+        local.set(cache_key, cached, ttl=LOCAL_VERSIONED_TTL)
+        return forms, cached
 
 
 # - - - Session objects - - - - - - - - - - - - - - - - - - -
 
-    def _copySessionToForm(self, _session):
-        """Copy relevant fields from Session to SessionForm."""
+    def _copySessionToForm(self, _session, speakers=None, fields=None):
+        """Copy relevant fields from Session to SessionForm; speakers
+        optionally maps speaker keys to already fetched Profiles, and
+        fields is an optional mask of the fields to copy (the speaker
+        is only looked up if it includes speakerName)."""
         sf = SessionForm()
-        for field in sf.all_fields():
-            if hasattr(_session, field.name):
-                if (field.name == 'date' or field.name == 'startTime'):
-                    setattr(sf, field.name, str(getattr(_session, field.name)))
-                elif (field.name == 'speaker'):
-                    if (getattr(_session, 'speaker')):
-                        speaker = getattr(_session, 'speaker').get()
-                        setattr(sf, 'speakerName', speaker.displayName)
-                        setattr(
-                            sf,
-                            field.name,
-                            getattr(_session, 'speaker').urlsafe()
-                        )
+        for name in copyPlan(SessionForm, Session):
+            if (name == 'speaker'):
+                s_key = getattr(_session, 'speaker')
+                if wants(fields, 'speaker'):
+                    setattr(sf, name, s_key.urlsafe() if s_key else None)
+                if not wants(fields, 'speakerName'):
+                    continue
+                if s_key:
+                    if speakers is not None and s_key in speakers:
+                        speaker = speakers[s_key]
                     else:
-                        setattr(sf, 'speakerName', 'TBA')
-                        setattr(sf, field.name, None)
+                        speaker = storage.get(s_key)
+                    setattr(sf, 'speakerName', speaker.displayName)
                 else:
-                    setattr(sf, field.name, getattr(_session, field.name))
-            elif field.name == "websafeKey":
-                setattr(sf, field.name, _session.key.urlsafe())
+                    setattr(sf, 'speakerName', 'TBA')
+            elif not wants(fields, name):
+                continue
+            elif (name == 'date' or name == 'startTime'):
+                setattr(sf, name, str(getattr(_session, name)))
+            else:
+                setattr(sf, name, getattr(_session, name))
+        sf.websafeKey = _session.key.urlsafe()
         sf.check_initialized()
         return sf
 
+    def _sessionForms(self, sessions, fields=None):
+        """Return SessionForms for Sessions, looking up their speakers
+        with one get_multi, or not at all if the field mask leaves out
+        speakerName."""
+        speakers = {}
+        if wants(fields, 'speakerName'):
+            s_keys = list(set(s.speaker for s in sessions if s.speaker))
+            speakers = dict(zip(s_keys, storage.getMulti(s_keys)))
+        return SessionForms(
+            items=[
+                self._copySessionToForm(_session, speakers, fields)
+                for _session in sessions
+            ]
+        )
+
     def _createSessionObject(self, request):
         """Create Session object, returning SessionForm/request."""
         # preload necessary data items
@@ -545,20 +888,34 @@ class ConferenceApi(remote.Service):
         s_key = ndb.Key(Session, s_id, parent=c_key)
         data['key'] = s_key
 
-        Session(**data).put()
+        _session = self._putSession(Session(**data))
         # after saving the Session, check for featured speakers
-        # and add notice to memcache using taskqueue
-        taskqueue.add(params={
-            'conf': request.websafeConferenceKey
-        }, url='/tasks/set_featured_speakers')
+        # and add notice to memcache using taskqueue; a burst of
+        # Session writes to one conference collapses into one task
+        enqueueCoalesced(
+            '/tasks/set_featured_speakers',
+            params={'conf': request.websafeConferenceKey},
+            bucket=request.websafeConferenceKey
+        )
+        self._agendaChanged(c_key)
         # return request
-        return self._copySessionToForm(s_key.get())
+        return self._copySessionToForm(_session)
 
-    def _getSessionQuery(self, request):
-        """Return formatted Session query from the submitted filters."""
-        # create a Session query
-        q = Session.query(
-            ancestor=ndb.Key(urlsafe=request.websafeConferenceKey))
+    @ndb.transactional(xg=True)
+    def _putSession(self, _session):
+        """Store a Session, bump its Conference's sessionsVersion and
+        add it to its speaker's index, in one transaction."""
+        conf = _session.key.parent().get()
+        conf.sessionsVersion += 1
+        ndb.put_multi([_session, conf])
+        if _session.speaker:
+            addToIndex(_session.speaker, _session.key)
+        return _session
+
+    def _getSessionQuery(self, request, plan):
+        """Return formatted Session query from the submitted filters,
+        recording each step in the QueryPlan."""
+        c_key = storage.key(request.websafeConferenceKey)
         # build the query filters from the submitted form
         filters = self._formatFilters(request.filters, kind='session')
 
@@ -572,6 +929,7 @@ class ConferenceApi(remote.Service):
         qf = []
         sets = None
         for filtr in filters:
+            started = time.time()
             op = filtr["operator"]
             # take string field inputs and transform them into
             # native values (int or datetime)
@@ -585,48 +943,44 @@ class ConferenceApi(remote.Service):
             elif (filtr["field"] == 'typeOfSession'):
                 # for typeOfSession, only '==' and '!=' queries
                 # are allowed
-                s_type = filtr["value"]
                 if not (op in ['=', '!=']):
                     raise endpoints.BadRequestException(
                         "You can only use EQ or NE queries on Session Type.")
 
-                if (op == '='):
-                    op = '=='
-
-                # fetch keys for the query, looking for Sessions that
-                # are equal to or not equal to a specified type
-                # (e.g.: 'Keynote')
-                # because typeOfSession is an Enum, we cannot use
-                # FilterNode as below
-                qs = eval(
-                    'q.filter(Session.typeOfSession ' +
-                    op + ' SessionType.lookup_by_name("' +
-                    s_type + '")).fetch(keys_only=True)')
-                # append the list of keys to the qf list
-                qf.append(qs)
-
-            if (filtr["field"] != 'typeOfSession'):
-                # fetch keys for the query, looking for Sessions
-                # based on provided search criteria
-                formatted_query = ndb.query.FilterNode(
-                    filtr["field"], op, filtr["value"])
-                qs = q.filter(formatted_query).fetch(keys_only=True)
-                # append the list of keys to the qf list
-                qf.append(qs)
+            # fetch keys for the query, looking for Sessions
+            # based on provided search criteria
+            try:
+                qs = storage.sessionKeysWhere(
+                    c_key, filtr["field"], op, filtr["value"])
+            except KeyError:
+                raise endpoints.BadRequestException(
+                    "Invalid session type: %s" % filtr["value"])
+            # append the list of keys to the qf list
+            qf.append(qs)
+            plan.record('filter', describeFilter(filtr), len(qs), started)
 
         # iterate through the complete list of entity keys from the
         # various query filters, building a set of keys that match
         # the search criteria; note this does mean that we're
         # exclusively ANDing the query filters...
+        started = time.time()
         for idx, val in enumerate(qf):
             if (idx == 0):
                 sets = set(val)
             else:
                 sets = sets.intersection(val)
+                plan.record('intersect', 'AND filter %d' % (idx + 1),
+                            len(sets), started)
+                started = time.time()
 
+        started = time.time()
         if sets:
             # then use get_multi to retrieve all the appropriate Sessions
-            q = ndb.get_multi(sets)
+            q = storage.getMulti(list(sets))
+            plan.record('get_multi', 'Session', len(q), started)
+        else:
+            q = storage.sessionsForConference(c_key)
+            plan.record('scan', 'Session', len(q), started)
 
         return q
 
@@ -637,10 +991,60 @@ class ConferenceApi(remote.Service):
         http_method='POST',
         name='createSession'
     )
+    @instrumented
+    @idempotent(SessionForm)
     def createSession(self, request):
         """Create new conference session."""
         return self._createSessionObject(request)
 
+    @endpoints.method(
+        SESSION_DELETE_REQUEST,
+        BooleanMessage,
+        path='session/{websafeSessionKey}',
+        http_method='DELETE',
+        name='deleteSession'
+    )
+    @instrumented
+    @idempotent(BooleanMessage)
+    def deleteSession(self, request):
+        """Delete a Session (conference owner only)."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = getUserId(user)
+
+        s_key = storage.key(request.websafeSessionKey)
+        _session = storage.get(s_key) if s_key.kind() == 'Session' else None
+        if not _session:
+            raise endpoints.NotFoundException(
+                'No session found with key: %s' % request.websafeSessionKey)
+        conf = storage.get(s_key.parent())
+        if user_id != conf.organizerUserId:
+            raise endpoints.ForbiddenException(
+                'Only the owner can delete sessions.')
+
+        self._deleteSession(_session)
+        # the featured speaker & agenda may have changed
+        enqueueCoalesced(
+            '/tasks/set_featured_speakers',
+            params={'conf': conf.key.urlsafe()},
+            bucket=conf.key.urlsafe()
+        )
+        self._agendaChanged(conf.key)
+        return BooleanMessage(data=True)
+
+    @ndb.transactional(xg=True)
+    def _deleteSession(self, _session):
+        """Delete a Session leaving a Tombstone, bump its Conference's
+        sessionsVersion and mark it deleted in its speaker's index, in
+        one transaction."""
+        conf = _session.key.parent().get()
+        conf.sessionsVersion += 1
+        ndb.put_multi([conf, tombstone(_session.key)])
+        _session.key.delete()
+        if _session.speaker:
+            markDeleted(_session.speaker, _session.key)
+
     @endpoints.method(
         SESSION_LIST,
         SessionForms,
@@ -648,18 +1052,60 @@ class ConferenceApi(remote.Service):
         http_method='GET',
         name='getConferenceSessions'
     )
+    @instrumented
     def getConferenceSessions(self, request):
         """Return sessions by conference."""
-        # create ancestor query for all key matches for this conference
-        sessions = Session.query(
-            ancestor=ndb.Key(urlsafe=request.websafeConferenceKey))
-        # return set of SessionForm objects per Session
-        return SessionForms(
-            items=[
-                self._copySessionToForm(session) for session in sessions
-            ]
+        fields = self._fieldMask(SessionForm, request.fields)
+        conf = storage.get(storage.key(request.websafeConferenceKey))
+        if not conf:
+            return SessionForms()
+        # skip the agenda lookup if the client is current
+        etag = '"s%d%s"' % (conf.sessionsVersion, maskTag(fields))
+        self._checkNotModified(etag)
+        # serve the pre-rendered agenda
+        forms = self._agendaForms(conf)
+        for form in forms.items:
+            maskForm(form, fields)
+        forms.etag = etag
+        return forms
+
+    def _agendaForms(self, conf):
+        """Return a Conference's agenda (see agenda.py), building it
+        now if it hasn't been built for its current sessionsVersion."""
+        forms = loadAgenda(conf.key.urlsafe(), conf.sessionsVersion)
+        if forms is None:
+            forms = fillAgenda(conf.key.urlsafe(), conf.sessionsVersion,
+                               lambda: self._renderAgenda(conf))
+        return forms
+
+    def _renderAgenda(self, conf):
+        """Return a Conference's Sessions as sorted SessionForms."""
+        sessions = storage.sessionsForConference(conf.key)
+        # resolve every speaker with a single get_multi
+        s_keys = list(set(s.speaker for s in sessions if s.speaker))
+        speakers = dict(zip(s_keys, storage.getMulti(s_keys)))
+        return SessionForms(items=sorted(
+            [self._copySessionToForm(s, speakers) for s in sessions],
+            key=sortKey))
+
+    def _agendaChanged(self, c_key):
+        """Schedule a rebuild of a Conference's agenda; a burst of
+        changes to one conference collapses into one task."""
+        enqueueCoalesced(
+            '/tasks/build_agenda',
+            params={'conf': c_key.urlsafe()},
+            bucket=c_key.urlsafe()
         )
 
+    @staticmethod
+    def _cacheAgenda(wsck):
+        """Rebuild a Conference's agenda, unless a reader already has;
+        used by the agenda task."""
+        conf = storage.get(storage.key(wsck))
+        if conf:
+            fillAgenda(wsck, conf.sessionsVersion,
+                       lambda: ConferenceApi()._renderAgenda(conf))
+
     @endpoints.method(
         SESSION_LIST_BY_SPEAKER,
         SessionForms,
@@ -667,18 +1113,97 @@ class ConferenceApi(remote.Service):
         http_method='GET',
         name='getSessionsBySpeaker'
     )
+    @instrumented
     def getSessionsBySpeaker(self, request):
         """Return sessions by speaker."""
-        # create query for all key matches for this speaker
-        speaker = ndb.Key(urlsafe=request.speaker).get()
-        sessions = Session.query(Session.speaker == speaker.key)
+        fields = self._fieldMask(SessionForm, request.fields)
+        # fetch the speaker (if their name is wanted) & all their
+        # Sessions (from the speaker index) in one batch
+        s_key = storage.key(request.speaker)
+        speaker_keys = [s_key] if wants(fields, 'speakerName') else []
+        results = storage.getMulti(
+            speaker_keys + getIndex(s_key).sessionKeys)
+        speakers = dict(zip(speaker_keys, results))
         # return set of SessionForm objects per Session
         return SessionForms(
             items=[
-                self._copySessionToForm(session) for session in sessions
+                self._copySessionToForm(session, speakers, fields)
+                for session in results[len(speaker_keys):] if session
             ]
         )
 
+    @endpoints.method(
+        SPEAKER_PROFILE_REQUEST,
+        SpeakerProfileForm,
+        path='speaker/profile',
+        http_method='GET',
+        name='getSpeakerProfile'
+    )
+    @instrumented
+    def getSpeakerProfile(self, request):
+        """Return a speaker and a page of their sessions across all
+        conferences; pass nextCursor back as cursor for the next page."""
+        s_key = storage.key(request.speaker)
+        try:
+            offset = decodeCursor(request.cursor)
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
+        limit = min(request.limit or SPEAKER_PAGE_SIZE, SPEAKER_PAGE_MAX)
+        if limit < 1:
+            raise endpoints.BadRequestException("Limit must be positive.")
+        fields = self._fieldMask(SessionForm, request.fields)
+
+        speaker, index = storage.getMulti([s_key, indexKey(s_key)])
+        if not speaker:
+            raise endpoints.NotFoundException(
+                'No speaker found matching key: %s' % request.speaker)
+        if index is None or not index.complete:
+            index = buildIndex(s_key)
+
+        # pages are cached against the index version, which changes
+        # whenever the speaker gets a new Session or is renamed
+        cache_key = MEMCACHE_SPEAKER_PAGE_KEY % (
+            s_key.urlsafe(), index.version, offset, limit)
+        cached = local.get(SPEAKER_CACHE, cache_key,
+                           lambda: getBlob(cache_key),
+                           ttl=LOCAL_VERSIONED_TTL)
+        if cached:
+            stats.hit(SPEAKER_CACHE)
+        else:
+            stats.miss(SPEAKER_CACHE)
+            cached = flights.fill(
+                cache_key,
+                lambda: getBlob(cache_key),
+                lambda: self._fillSpeakerPage(
+                    speaker, index, offset, limit, cache_key)
+            )
+        form = unpackMessage(SpeakerProfileForm, cached)
+        for session in form.sessions:
+            maskForm(session, fields)
+        return form
+
+    def _fillSpeakerPage(self, speaker, index, offset, limit, cache_key):
+        """Render & cache a page of a speaker's sessions; return it
+        packed."""
+        s_key = speaker.key
+        sessions = storage.getMulti(index.sessionKeys[offset:offset + limit])
+        form = SpeakerProfileForm(
+            displayName=speaker.displayName,
+            websafeKey=s_key.urlsafe(),
+            sessions=[
+                self._copySessionToForm(session, {s_key: speaker})
+                for session in sessions if session
+            ],
+            totalSessions=sessionCount(index)
+        )
+        if offset + limit < len(index.sessionKeys):
+            form.nextCursor = encodeCursor(offset + limit)
+
+        cached = packMessage(form)
+        setBlob(cache_key, cached, time=SPEAKER_PAGE_CACHE_TIME)
+        local.set(cache_key, cached, ttl=LOCAL_VERSIONED_TTL)
+        return cached
+
     @endpoints.method(
         SESSION_LIST_BY_TYPE,
         SessionForms,
@@ -686,24 +1211,25 @@ class ConferenceApi(remote.Service):
         http_method='GET',
         name='getConferenceSessionsByType'
     )
+    @instrumented
     def getConferenceSessionsByType(self, request):
         """Return sessions within a conference by type."""
-        # create ancestor query for all key matches for this conference
-        sessions = Session.query(
-            ancestor=ndb.Key(urlsafe=request.websafeConferenceKey))
-
-        # create filter for session type
+        fields = self._fieldMask(SessionForm, request.fields)
         s_type = request.typeOfSession
         try:
-            sessions = sessions.filter(
-                Session.typeOfSession == SessionType.lookup_by_name(s_type))
+            s_type = SessionType.lookup_by_name(s_type)
         except KeyError:
             raise endpoints.BadRequestException(
                 "Session type '%s' is invalid." % s_type)
-        # return set of SessionForm objects per Session
+        conf = storage.get(storage.key(request.websafeConferenceKey))
+        if not conf:
+            return SessionForms()
+        # filter the pre-rendered agenda down to the given type
         return SessionForms(
             items=[
-                self._copySessionToForm(session) for session in sessions
+                maskForm(form, fields)
+                for form in self._agendaForms(conf).items
+                if form.typeOfSession == s_type
             ]
         )
 
@@ -714,26 +1240,22 @@ class ConferenceApi(remote.Service):
         http_method='GET',
         name='getSessionsSpeaking'
     )
+    @instrumented
     def getSessionsSpeaking(self, request):
         """Get list of sessions that user is the speaker for."""
+        fields = self._fieldMask(SessionForm, request.fields)
         user = endpoints.get_current_user()
         if not user:
             # require authorization to create Sessions
             raise endpoints.UnauthorizedException('Authorization required')
 
         user_id = getUserId(user)
-        p_key = ndb.Key(Profile, user_id).get()
-
-        sessions = Session.query(
-            ancestor=ndb.Key(urlsafe=request.websafeConferenceKey))
-        sessions = sessions.filter(Session.speaker == p_key.key)
+        sessions = storage.sessionsForConference(
+            storage.key(request.websafeConferenceKey),
+            speakerKey=storage.profileKey(user_id))
 
         # return set of SessionForm objects per Session
-        return SessionForms(
-            items=[
-                self._copySessionToForm(session) for session in sessions
-            ]
-        )
+        return self._sessionForms(sessions, fields)
 
     @endpoints.method(
         SESSION_QUERY,
@@ -742,17 +1264,23 @@ class ConferenceApi(remote.Service):
         http_method='POST',
         name='querySessions'
     )
+    @instrumented
     def querySessions(self, request):
         """Query for sessions."""
-        sessions = self._getSessionQuery(request)
-
-        # return individual ConferenceForm object per Conference
-        return SessionForms(
-            items=[
-                self._copySessionToForm(_session) for _session in sorted(
-                    sessions, key=attrgetter('name'))
-            ]
-        )
+        fields = self._fieldMask(SessionForm, request.fields)
+        plan = QueryPlan('Session')
+        sessions = self._getSessionQuery(request, plan)
+
+        # return individual SessionForm object per Session
+        started = time.time()
+        forms = self._sessionForms(
+            sorted(sessions, key=attrgetter('name')), fields)
+        plan.record('render', 'SessionForm (speaker lookups)',
+                    len(forms.items), started)
+        plan.logIfSlow()
+        if request.explain:
+            forms.plan = plan.toForm()
+        return forms
 
     def _sessionWishlist(self, request, add=True):
         """add or remove session from user wishlist."""
@@ -762,7 +1290,7 @@ class ConferenceApi(remote.Service):
         # check if session exists given sessionKey
         # get session; check that it exists
         sk = request.sessionKey
-        _session = ndb.Key(urlsafe=sk).get()
+        _session = storage.get(storage.key(sk))
         if not _session:
             raise endpoints.NotFoundException(
                 'No session found with key: %s' % sk)
@@ -790,7 +1318,7 @@ class ConferenceApi(remote.Service):
                 retval = False
 
         # write things back to the datastore & return
-        prof.put()
+        storage.put(prof)
         return BooleanMessage(data=retval)
 
     @endpoints.method(
@@ -800,20 +1328,41 @@ class ConferenceApi(remote.Service):
         http_method='GET',
         name='getSessionsInWishlist'
     )
+    @instrumented
     def getSessionsInWishlist(self, request):
         """Get list of sessions that user has put in his/her wishlist."""
+        fields = self._fieldMask(SessionForm, request.fields)
         prof = self._getProfileFromUser()  # get user Profile
         session_keys = [
-            ndb.Key(urlsafe=sk) for sk in prof.sessionWishList
+            storage.key(sk) for sk in prof.sessionWishList
         ]
-        sessions = ndb.get_multi(session_keys)
+        sessions = storage.getMulti(session_keys)
 
-        # return set of SessionForm objects
-        return SessionForms(
-            items=[
-                self._copySessionToForm(_session) for _session in sessions
-            ]
-        )
+        # return set of SessionForm objects; skip deleted Sessions
+        return self._sessionForms([s for s in sessions if s], fields)
+
+    @endpoints.method(
+        SESSION_RECOMMENDED_REQUEST,
+        SessionForms,
+        path='session/{websafeSessionKey}/recommended',
+        http_method='GET',
+        name='getRecommendedSessions'
+    )
+    @instrumented
+    def getRecommendedSessions(self, request):
+        """Return the Sessions most often wishlisted together with a
+        Session, best first (computed nightly; see recommendations.py)."""
+        fields = self._fieldMask(SessionForm, request.fields)
+        limit = min(request.limit or RECOMMEND_TOP_K, RECOMMEND_TOP_K)
+        if limit < 1:
+            raise endpoints.BadRequestException("Limit must be positive.")
+        s_key = storage.key(request.websafeSessionKey)
+        recommended = storage.get(recommendationsKey(s_key))
+        if not recommended:
+            return SessionForms()
+        sessions = storage.getMulti(recommended.sessionKeys[:limit])
+        # skip Sessions deleted since the recommendations were made
+        return self._sessionForms([s for s in sessions if s], fields)
 
     @endpoints.method(
         SESSION_WISHLIST_ADD,
@@ -822,6 +1371,8 @@ class ConferenceApi(remote.Service):
         http_method='POST',
         name='addSessionToWishlist'
     )
+    @instrumented
+    @idempotent(BooleanMessage)
     def addSessionToWishlist(self, request):
         """Add session to user wishlist."""
         return self._sessionWishlist(request)
@@ -833,6 +1384,8 @@ class ConferenceApi(remote.Service):
         http_method='DELETE',
         name='deleteSessionInWishlist'
     )
+    @instrumented
+    @idempotent(BooleanMessage)
     def deleteSessionInWishlist(self, request):
         """Remove session from user wishlist."""
         return self._sessionWishlist(request, add=False)
@@ -844,16 +1397,13 @@ class ConferenceApi(remote.Service):
         """Copy relevant fields from Profile to ProfileForm."""
         # copy relevant fields from Profile to ProfileForm
         pf = ProfileForm()
-        for field in pf.all_fields():
-            if hasattr(prof, field.name):
-                # convert t-shirt string to Enum; just copy others
-                if field.name == 'teeShirtSize':
-                    setattr(pf, field.name, getattr(
-                        TeeShirtSize, getattr(prof, field.name)))
-                else:
-                    setattr(pf, field.name, getattr(prof, field.name))
-            elif field.name == "websafeKey":
-                setattr(pf, field.name, prof.key.urlsafe())
+        for name in copyPlan(ProfileForm, Profile):
+            # convert t-shirt string to Enum; just copy others
+            if name == 'teeShirtSize':
+                setattr(pf, name, getattr(TeeShirtSize, getattr(prof, name)))
+            else:
+                setattr(pf, name, getattr(prof, name))
+        pf.websafeKey = prof.key.urlsafe()
         pf.check_initialized()
         return pf
 
@@ -867,17 +1417,16 @@ class ConferenceApi(remote.Service):
 
         # get Profile from datastore
         user_id = getUserId(user)
-        p_key = ndb.Key(Profile, user_id)
-        profile = p_key.get()
+        profile = storage.get(storage.profileKey(user_id))
         # create new Profile if not there
         if not profile:
-            profile = Profile(
-                key=p_key,
+            profile = storage.newProfile(
+                user_id,
                 displayName=user.nickname(),
                 mainEmail=user.email(),
                 teeShirtSize=str(TeeShirtSize.NOT_SPECIFIED),
             )
-            profile.put()
+            storage.put(profile)
 
         return profile      # return Profile
 
@@ -887,21 +1436,50 @@ class ConferenceApi(remote.Service):
         prof = self._getProfileFromUser()
 
         # if saveProfile(), process user-modifyable fields
+        renamed = False
         if save_request:
             for field in ('displayName', 'teeShirtSize'):
                 if hasattr(save_request, field):
                     val = getattr(save_request, field)
                     if val:
                         setattr(prof, field, str(val))
+                        # organizerDisplayName is part of cached
+                        # ConferenceForms
+                        if field == 'displayName':
+                            bumpGeneration(CONFERENCE_GENERATION)
+                            renamed = True
                         # if field == 'teeShirtSize':
                         #    setattr(prof, field, str(val).upper())
                         # else:
                         #    setattr(prof, field, val)
-                        prof.put()
+                        storage.put(prof)
+
+        # agendas & speaker pages show speaker names, so rebuild the
+        # agendas of conferences this user speaks at
+        if renamed:
+            touchIndex(prof.key)
+            sessions = storage.sessionsBySpeaker(prof.key)
+            for c_key in set(s.key.parent() for s in sessions):
+                self._agendaChanged(c_key)
+            # their Conferences & Sessions show the name too; they're
+            # re-saved by a task so that delta syncs pick it up
+            enqueueCoalesced(
+                '/tasks/touch_profile',
+                params={'profile': prof.key.urlsafe()},
+                bucket=prof.key.urlsafe()
+            )
 
         # return ProfileForm
         return self._copyProfileToForm(prof)
 
+    @staticmethod
+    def _touchProfile(wspk):
+        """Re-save the Conferences a user organises & the Sessions
+        they speak at after a rename; used by the touch_profile task."""
+        p_key = storage.key(wspk)
+        touch([c.key for c in storage.conferencesByOrganizer(p_key.id())] +
+              [s.key for s in storage.sessionsBySpeaker(p_key)])
+
     def _createProfileObject(self, request):
         """Create Profile object, returning ProfileForm/request."""
         # preload necessary data items
@@ -949,6 +1527,8 @@ class ConferenceApi(remote.Service):
         http_method='POST',
         name='createProfile'
     )
+    @instrumented
+    @idempotent(ProfileForm)
     def createProfile(self, request):
         """Create new user Profile."""
         return self._createProfileObject(request)
@@ -960,6 +1540,7 @@ class ConferenceApi(remote.Service):
         http_method='GET',
         name='getProfile'
     )
+    @instrumented
     def getProfile(self, request):
         """Return user profile."""
         return self._doProfile()
@@ -971,6 +1552,8 @@ class ConferenceApi(remote.Service):
         http_method='POST',
         name='saveProfile'
     )
+    @instrumented
+    @idempotent(ProfileForm)
     def saveProfile(self, request):
         """Update & return user profile."""
         return self._doProfile(request)
@@ -982,6 +1565,7 @@ class ConferenceApi(remote.Service):
         http_method='POST',
         name='getProfiles'
     )
+    @instrumented
     def getProfiles(self, request):
         """Return user profiles."""
         user = endpoints.get_current_user()
@@ -989,7 +1573,7 @@ class ConferenceApi(remote.Service):
             # require authorization to list Profiles
             raise endpoints.UnauthorizedException('Authorization required')
 
-        profiles = Profile.query()
+        profiles = storage.allProfiles()
         # return set of ProfileForm objects per Profile
         return ProfileForms(
             items=[
@@ -998,6 +1582,140 @@ class ConferenceApi(remote.Service):
         )
 
 
+# - - - Bootstrap - - - - - - - - - - - - - - - - - - - - - -
+
+    @endpoints.method(
+        message_types.VoidMessage,
+        BootstrapForm,
+        path='bootstrap',
+        http_method='GET',
+        name='getSessionBootstrap'
+    )
+    @instrumented
+    def getSessionBootstrap(self, request):
+        """Return everything the client needs on first page load: the
+        user's profile, announcement, featured speaker, conferences
+        to attend and wishlist, in one round trip."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+
+        # start the profile get; the notices normally come from the
+        # local cache without an RPC meanwhile
+        prof_future = ndb.Key(Profile, getUserId(user)).get_async()
+        announcement = self._getNotice(
+            ANNOUNCEMENT_CACHE, MEMCACHE_ANNOUNCEMENTS_KEY)
+        featured = self._getNotice(
+            FEATURED_SPEAKER_CACHE, MEMCACHE_FEATURED_SPEAKER_KEY)
+
+        # a first-time user gets their Profile created here
+        prof = prof_future.get_result() or self._getProfileFromUser()
+        # the wishlist can name deleted Sessions; check which still
+        # exist while the conferences are fetched
+        wishlist = prof.sessionWishList
+        session_futures = ndb.get_multi_async(
+            [ndb.Key(urlsafe=wssk) for wssk in wishlist])
+        conferences = self._attendingConferenceForms(prof)
+
+        return BootstrapForm(
+            profile=self._copyProfileToForm(prof),
+            announcement=announcement,
+            featuredSpeaker=featured,
+            conferencesToAttend=conferences,
+            sessionWishList=[
+                wssk for wssk, future in zip(wishlist, session_futures)
+                if future.get_result() is not None
+            ]
+        )
+
+
+# - - - Delta sync - - - - - - - - - - - - - - - - - - - - -
+
+    @endpoints.method(
+        CHANGES_REQUEST,
+        ChangesForm,
+        path='changes',
+        http_method='GET',
+        name='getChangesSince'
+    )
+    @instrumented
+    def getChangesSince(self, request):
+        """Return Conferences & Sessions changed or deleted since a
+        sync token (everything, without one) a page at a time: pass
+        nextCursor back as cursor until the last page, whose syncToken
+        is the token for the next sync (see sync.py)."""
+        limit = min(request.limit or SYNC_PAGE_SIZE, SYNC_PAGE_MAX)
+        if limit < 1:
+            raise endpoints.BadRequestException("Limit must be positive.")
+        try:
+            if request.cursor:
+                state = decodeSyncCursor(request.cursor)
+            else:
+                state = newSync(request.token)
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
+
+        conferences, sessions, deleted, next_state = changesPage(
+            state, limit)
+        # organiser names with one get_multi
+        organisers = list(set(
+            storage.profileKey(conf.organizerUserId) for conf in conferences
+        ))
+        names = dict((prof.key.id(), prof.displayName)
+                     for prof in storage.getMulti(organisers) if prof)
+
+        form = ChangesForm(
+            conferences=[
+                self._copyConferenceToForm(
+                    conf, names.get(conf.organizerUserId))
+                for conf in conferences
+            ],
+            sessions=self._sessionForms(sessions).items,
+            deleted=deleted,
+            fullSync=state['since'] is None
+        )
+        if next_state:
+            form.nextCursor = encodeSyncCursor(next_state)
+        else:
+            form.syncToken = syncToken(state)
+        return form
+
+
+# - - - Warmup - - - - - - - - - - - - - - - - - - - - - - -
+
+    @staticmethod
+    def _warmup():
+        """Prepare a new instance before it serves traffic: work out
+        the copy plans and prime the caches the first page load
+        reads. Returns the time (in ms) each step took."""
+        timings = []
+
+        def step(name, func, *args):
+            started = time.time()
+            func(*args)
+            timings.append((name, int((time.time() - started) * 1000)))
+
+        step('copy plans', lambda: [
+            copyPlan(form, model) for form, model in (
+                (ConferenceForm, Conference),
+                (SessionForm, Session),
+                (ProfileForm, Profile))])
+        step('generation', getGeneration, CONFERENCE_GENERATION)
+        # the announcement is cheap to rebuild; the featured speaker
+        # notice needs a conference, so it's only read (into the
+        # local cache) here
+        step('announcement', lambda: (
+            memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) is not None or
+            ConferenceApi._cacheAnnouncement()))
+        step('notices', lambda: [
+            ConferenceApi._getNotice(cache, key) for cache, key in (
+                (ANNOUNCEMENT_CACHE, MEMCACHE_ANNOUNCEMENTS_KEY),
+                (FEATURED_SPEAKER_CACHE, MEMCACHE_FEATURED_SPEAKER_KEY))])
+        # the unfiltered conference list is the home page's query
+        step('conference query', ConferenceApi()._conferenceQueryForms, [])
+        return timings
+
+
 # - - - Announcements - - - - - - - - - - - - - - - - - - - -
 
     @staticmethod
@@ -1021,6 +1739,8 @@ class ConferenceApi(remote.Service):
             # delete the memcache announcements entry
             announcement = ""
             memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
+        # other instances pick it up when their local copy goes stale
+        local.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
 
         return announcement
 
@@ -1031,10 +1751,25 @@ class ConferenceApi(remote.Service):
         http_method='GET',
         name='getAnnouncement'
     )
+    @instrumented
     def getAnnouncement(self, request):
         """Return Announcement from memcache."""
-        return StringMessage(
-            data=memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) or "")
+        return self._noticeMessage(self._getNotice(
+            ANNOUNCEMENT_CACHE, MEMCACHE_ANNOUNCEMENTS_KEY))
+
+    @staticmethod
+    def _getNotice(cache, key):
+        """Return a notice kept in memcache ("" if there is none),
+        through the instance's local cache."""
+        return local.get(cache, key, lambda: memcache.get(key) or "")
+
+    def _noticeMessage(self, notice):
+        """Return a StringMessage for a notice, tagged with an etag
+        derived from its text; raise NotModifiedException (HTTP 412)
+        if the client already has it."""
+        etag = '"%s"' % hashlib.md5(notice.encode('utf-8')).hexdigest()
+        self._checkNotModified(etag)
+        return StringMessage(data=notice, etag=etag)
 
 
 # - - - Featured Speakers - - - - - - - - - - - - - - - - - - - -
@@ -1085,6 +1820,7 @@ class ConferenceApi(remote.Service):
             # delete the memcache feature notice entry
             feature = ""
             memcache.delete(MEMCACHE_FEATURED_SPEAKER_KEY)
+        local.set(MEMCACHE_FEATURED_SPEAKER_KEY, feature)
 
         return feature
 
@@ -1095,24 +1831,35 @@ class ConferenceApi(remote.Service):
         http_method='GET',
         name='getFeaturedSpeaker'
     )
+    @instrumented
     def getFeaturedSpeaker(self, request):
         """Return Featured Speaker notice from memcache."""
-        return StringMessage(
-            data=memcache.get(MEMCACHE_FEATURED_SPEAKER_KEY) or "")
+        return self._noticeMessage(self._getNotice(
+            FEATURED_SPEAKER_CACHE, MEMCACHE_FEATURED_SPEAKER_KEY))
 
 
 # - - - Registration - - - - - - - - - - - - - - - - - - - -
 
-    @ndb.transactional(xg=True)
     def _conferenceRegistration(self, request, reg=True):
         """Register or unregister user for selected conference."""
+        # Profile & Conference are separate entity groups
+        retval, conf = storage.transaction(
+            lambda: self._updateRegistration(request, reg), xg=True)
+        if retval.data:
+            recordPopularity(conf)
+        return retval
+
+    def _updateRegistration(self, request, reg):
+        """Move a seat between the Conference and the user's Profile;
+        must run inside a transaction. Returns the BooleanMessage and
+        the Conference."""
         retval = None
         prof = self._getProfileFromUser()  # get user Profile
 
         # check if conf exists given websafeConfKey
         # get conference; check that it exists
         wsck = request.websafeConferenceKey
-        conf = ndb.Key(urlsafe=wsck).get()
+        conf = storage.get(storage.key(wsck))
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
@@ -1127,11 +1874,13 @@ class ConferenceApi(remote.Service):
             # check if seats avail
             if conf.seatsAvailable <= 0:
                 raise ConflictException(
-                    "There are no seats available.")
+                    "There are no seats available; join the waitlist "
+                    "to be registered when one frees up.")
 
             # register user, take away one seat
             prof.conferenceKeysToAttend.append(wsck)
             conf.seatsAvailable -= 1
+            conf.version += 1
             retval = True
 
         # unregister
@@ -1142,49 +1891,88 @@ class ConferenceApi(remote.Service):
                 # unregister user, add back one seat
                 prof.conferenceKeysToAttend.remove(wsck)
                 conf.seatsAvailable += 1
+                conf.version += 1
                 retval = True
             else:
                 retval = False
 
         # write things back to the datastore & return
-        prof.put()
-        conf.put()
-        return BooleanMessage(data=retval)
+        storage.putMulti([prof, conf])
+        return BooleanMessage(data=retval), conf
+
+    def _seatsChanged(self):
+        """Invalidate cached data that depends on seatsAvailable."""
+        bumpGeneration(CONFERENCE_GENERATION)
+        # the "nearly sold out" announcement may have changed too
+        enqueueCoalesced('/tasks/set_announcement', bucket='announcement')
 
     @endpoints.method(
-        message_types.VoidMessage,
+        CONF_POPULAR_REQUEST,
+        PopularConferenceForms,
+        path='conferences/popular',
+        http_method='GET',
+        name='getPopularConferences'
+    )
+    @instrumented
+    def getPopularConferences(self, request):
+        """Return the most registered conferences, optionally of one
+        city or month (kept up to date incrementally; see
+        leaderboard.py)."""
+        if request.city and request.month:
+            raise endpoints.BadRequestException(
+                "Rank by city or by month, not both.")
+        if request.month is not None and not 1 <= request.month <= 12:
+            raise endpoints.BadRequestException(
+                "Month must be between 1 and 12.")
+        limit = min(request.limit or POPULAR_TOP_K, POPULAR_TOP_K)
+        if limit < 1:
+            raise endpoints.BadRequestException("Limit must be positive.")
+        scope = popularScope(request.city, request.month)
+        return PopularConferenceForms(items=[
+            PopularConferenceForm(**entry)
+            for entry in popularConferences(scope, limit)
+        ])
+
+    @endpoints.method(
+        CONF_LIST_REQUEST,
         ConferenceForms,
         path='conferences/attending',
         http_method='GET',
         name='getConferencesToAttend'
     )
+    @instrumented
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
+        fields = self._fieldMask(ConferenceForm, request.fields)
         prof = self._getProfileFromUser()  # get user Profile
-        conf_keys = [
-            ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend
-        ]
-        conferences = ndb.get_multi(conf_keys)
+        # return set of ConferenceForm objects per Conference
+        return ConferenceForms(
+            items=self._attendingConferenceForms(prof, fields))
 
-        # get organizers
-        organisers = [
-            ndb.Key(Profile, conf.organizerUserId) for conf in conferences
+    def _attendingConferenceForms(self, prof, fields=None):
+        """Return ConferenceForms for the conferences a Profile is
+        registered for; organisers are only looked up if the field
+        mask includes organizerDisplayName."""
+        conf_keys = [
+            storage.key(wsck) for wsck in prof.conferenceKeysToAttend
         ]
-        profiles = ndb.get_multi(organisers)
+        conferences = storage.getMulti(conf_keys)
 
-        # put display names in a dict for easier fetching
+        # put organiser display names in a dict for easier fetching
         names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
-
-        # return set of ConferenceForm objects per Conference
-        return ConferenceForms(
-            items=[
-                self._copyConferenceToForm(
-                    conf, names[conf.organizerUserId]
-                ) for conf in conferences
+        if wants(fields, 'organizerDisplayName'):
+            organisers = [
+                storage.profileKey(conf.organizerUserId)
+                for conf in conferences
             ]
-        )
+            for profile in storage.getMulti(organisers):
+                names[profile.key.id()] = profile.displayName
+
+        return [
+            self._copyConferenceToForm(
+                conf, names.get(conf.organizerUserId), fields
+            ) for conf in conferences
+        ]
 
     @endpoints.method(
         CONF_GET_REQUEST,
@@ -1193,9 +1981,17 @@ class ConferenceApi(remote.Service):
         http_method='POST',
         name='registerForConference'
     )
+    @instrumented
+    @idempotent(BooleanMessage)
     def registerForConference(self, request):
         """Register user for selected conference."""
-        return self._conferenceRegistration(request)
+        retval = self._conferenceRegistration(request)
+        self._seatsChanged()
+        # a waitlisted user who got a seat directly leaves the
+        # waitlist, so a later promotion can't re-register them
+        removeEntry(storage.key(request.websafeConferenceKey),
+                    getUserId(endpoints.get_current_user()))
+        return retval
 
     @endpoints.method(
         CONF_GET_REQUEST,
@@ -1204,9 +2000,119 @@ class ConferenceApi(remote.Service):
         http_method='DELETE',
         name='unregisterFromConference'
     )
+    @instrumented
+    @idempotent(BooleanMessage)
     def unregisterFromConference(self, request):
         """Unregister user for selected conference."""
-        return self._conferenceRegistration(request, reg=False)
+        retval = self._conferenceRegistration(request, reg=False)
+        if retval.data:
+            self._seatsChanged()
+            # offer the freed seat to the waitlist
+            schedulePromotion(storage.key(request.websafeConferenceKey))
+        return retval
+
+    @endpoints.method(
+        CONF_GET_REQUEST,
+        BooleanMessage,
+        path='conference/{websafeConferenceKey}/waitlist',
+        http_method='POST',
+        name='joinWaitlist'
+    )
+    @instrumented
+    @idempotent(BooleanMessage)
+    def joinWaitlist(self, request):
+        """Join the waitlist of a sold out conference; the user is
+        registered, in turn, when seats free up."""
+        prof = self._getProfileFromUser()  # get user Profile
+        wsck = request.websafeConferenceKey
+        c_key = storage.key(wsck)
+        conf = storage.get(c_key)
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+        if wsck in prof.conferenceKeysToAttend:
+            raise ConflictException(
+                "You have already registered for this conference")
+        if not addEntry(c_key, prof.key.id()):
+            raise ConflictException(
+                "You are already on the waitlist for this conference")
+        # a seat may have been freed in the meantime
+        if conf.seatsAvailable > 0:
+            schedulePromotion(c_key)
+        return BooleanMessage(data=True)
+
+    @staticmethod
+    def _promoteWaitlist(wsck):
+        """Register waitlisted users of a Conference, oldest first, in
+        batches until it runs out of seats or waitlist; used by the
+        waitlist promotion task. Returns the number promoted."""
+        c_key = storage.key(wsck)
+        promoted = []
+        cursor, more = None, True
+        while more:
+            # page on with the cursor: the query is eventually
+            # consistent, so re-reading the head could keep returning
+            # entries already promoted (_promoteBatch skips those)
+            entries, cursor, more = nextEntries(c_key, cursor)
+            if not entries:
+                break
+            batch, sold_out = storage.transaction(
+                lambda: ConferenceApi._promoteBatch(c_key, entries),
+                xg=True)
+            promoted.extend(batch)
+            if sold_out:
+                break
+
+        if promoted:
+            ConferenceApi()._seatsChanged()
+            conf = storage.get(c_key)
+            recordPopularity(conf)
+            values = {
+                'name': conf.name,
+                'city': conf.city or '',
+                'startDate': str(conf.startDate or 'TBA'),
+            }
+            for prof in promoted:
+                if prof.mainEmail:
+                    queueEmail(prof.mainEmail, 'waitlist_promoted', values)
+            scheduleDrain()
+        return len(promoted)
+
+    @staticmethod
+    def _promoteBatch(c_key, entries):
+        """Register the users of a batch of waitlist entries while
+        seats last; must run inside an XG transaction. Returns the
+        promoted Profiles and whether the Conference is sold out."""
+        wsck = c_key.urlsafe()
+        conf = storage.get(c_key)
+        if not conf:
+            return [], True
+        # re-read the entries: they may have been promoted already
+        waiting = ndb.get_multi([e.key for e in entries])
+        profiles = storage.getMulti(
+            [storage.profileKey(e.userId) for e in entries])
+
+        promoted = []
+        done = []
+        for entry, prof in zip(waiting, profiles):
+            if entry is None:
+                continue
+            if prof is None or wsck in prof.conferenceKeysToAttend:
+                # nothing to do for this one but drop the entry
+                done.append(entry.key)
+                continue
+            if conf.seatsAvailable <= 0:
+                break
+            prof.conferenceKeysToAttend.append(wsck)
+            conf.seatsAvailable -= 1
+            promoted.append(prof)
+            done.append(entry.key)
+
+        if promoted:
+            conf.version += 1
+            storage.putMulti(promoted + [conf])
+        ndb.delete_multi(done)
+        return promoted, conf.seatsAvailable <= 0
 
     @endpoints.method(
         message_types.VoidMessage,
@@ -1215,6 +2121,7 @@ class ConferenceApi(remote.Service):
         http_method='GET',
         name='filterPlayground'
     )
+    @instrumented
     def filterPlayground(self, request):
         """Filter Playground"""
         q = Conference.query()
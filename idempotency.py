@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+import functools
+import hashlib
+from datetime import datetime, timedelta
+
+import endpoints
+from protorpc import protobuf
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import ConflictException, IdempotentResponse
+from utils import getUserId
+
+"""idempotency.py
+
+Conference Central idempotency keys for mutating endpoints
+
+A client that may retry a request (e.g. after a timeout) sends the
+same X-Idempotency-Key header with every attempt. The first response
+to succeed is stored, in memcache and in the datastore, for
+IDEMPOTENCY_TTL; later attempts get that response back without the
+endpoint running again. Failed attempts store nothing, so they can be
+retried for real. createConference handles the header itself (the key
+determines the new Conference's ID), so it isn't wrapped.
+
+"""
+
+
+IDEMPOTENCY_HEADER = 'X-Idempotency-Key'
+IDEMPOTENCY_TTL = 24 * 60 * 60  # seconds a response is replayed for
+MEMCACHE_IDEMPOTENCY_KEY = 'IDEMPOTENT:%s'
+PENDING = 'PENDING'  # memcache marker of an attempt still running
+PENDING_TIMEOUT = 60  # seconds
+
+
+def getIdempotencyKey(request_state):
+    """Return the idempotency key sent with the request, if any."""
+    return request_state.headers.get(IDEMPOTENCY_HEADER)
+
+
+def _storedResponse(store_key):
+    """Return the stored encoded response (or PENDING), if any."""
+    cache_key = MEMCACHE_IDEMPOTENCY_KEY % store_key
+    cached = memcache.get(cache_key)
+    if cached is not None:
+        return cached
+    stored = ndb.Key(IdempotentResponse, store_key).get()
+    now = datetime.now()
+    if stored and stored.expires > now:
+        # only for what's left of the response's TTL
+        remaining = (stored.expires - now).total_seconds()
+        memcache.set(cache_key, stored.response,
+                     time=max(int(remaining), 1))
+        return stored.response
+    return None
+
+
+def idempotent(response_type):
+    """Decorator replaying the stored response_type message for a
+    repeated idempotency key. Apply underneath @endpoints.method."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(service, request):
+            client_key = getIdempotencyKey(service.request_state)
+            user = endpoints.get_current_user()
+            if not (client_key and user):
+                return func(service, request)
+
+            # scope the key by user & method so keys can't collide
+            store_key = hashlib.sha1((u'%s:%s:%s' % (
+                getUserId(user), func.__name__, client_key)
+            ).encode('utf-8')).hexdigest()
+            cache_key = MEMCACHE_IDEMPOTENCY_KEY % store_key
+
+            stored = _storedResponse(store_key)
+            if stored == PENDING or (
+                    stored is None and
+                    not memcache.add(cache_key, PENDING,
+                                     time=PENDING_TIMEOUT)):
+                raise ConflictException(
+                    'A request with this idempotency key is still '
+                    'in progress.')
+            if stored is not None:
+                return protobuf.decode_message(response_type, stored)
+
+            try:
+                response = func(service, request)
+            except Exception:
+                memcache.delete(cache_key)
+                raise
+
+            encoded = protobuf.encode_message(response)
+            IdempotentResponse(
+                key=ndb.Key(IdempotentResponse, store_key),
+                method=func.__name__,
+                response=encoded,
+                expires=datetime.now() + timedelta(seconds=IDEMPOTENCY_TTL)
+            ).put()
+            memcache.set(cache_key, encoded, time=IDEMPOTENCY_TTL)
+            return response
+        return wrapper
+    return decorator
+
+
+def purgeExpired(batch_size=500):
+    """Delete stored responses past their expiry; return the count."""
+    q = IdempotentResponse.query(IdempotentResponse.expires < datetime.now())
+    total = 0
+    # page on with the cursor: the query is eventually consistent, so
+    # running it again could keep returning keys already deleted
+    cursor, more = None, True
+    while more:
+        keys, cursor, more = q.fetch_page(
+            batch_size, start_cursor=cursor, keys_only=True)
+        ndb.delete_multi(keys)
+        total += len(keys)
+    return total
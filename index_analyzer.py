@@ -0,0 +1,372 @@
+#!/usr/bin/env python
+import argparse
+import ast
+import os
+import re
+import sys
+from collections import OrderedDict
+
+"""index_analyzer.py
+
+Conference Central composite index analyzer
+
+Enumerates the datastore query shapes the app can issue, works out
+which of them need a composite index (equality-only queries are
+served from the built-in indexes by merge join), compares that
+minimal set with index.yaml and estimates what every index costs per
+entity write. The filter fields & operators of queryConferences and
+querySessions are read from conference.py, and the indexed properties
+of each kind from models.py, so the analysis follows the code; the
+other queries are listed in OTHER_QUERIES below and need updating
+when a query is added. Run from the project root:
+
+    python index_analyzer.py            # report
+    python index_analyzer.py --write    # also write a pruned index.yaml
+
+"""
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+INDEX_YAML = 'index.yaml'
+AUTOGENERATED = '# AUTOGENERATED'
+
+# ancestor path length of each kind's entities, for ancestor indexes
+ANCESTOR_DEPTH = {'Session': 3, 'Conference': 2}
+
+UNINDEXED_TYPES = ('BlobProperty', 'TextProperty', 'JsonProperty',
+                   'PickleProperty', 'LocalStructuredProperty')
+
+
+class Shape(object):
+    """Shape -- the index-relevant parts of one datastore query"""
+
+    def __init__(self, kind, source, ancestor=False, equality=(),
+                 inequality=None, orders=(), projection=()):
+        self.kind = kind
+        self.source = source
+        self.ancestor = ancestor
+        self.equality = tuple(equality)
+        self.inequality = inequality
+        self.orders = tuple(orders)  # (property, 'asc'|'desc')
+        self.projection = tuple(projection)
+
+    def requiredIndex(self):
+        """Return the composite index this query needs as (kind,
+        ancestor, ((property, direction), ...)), or None if the
+        built-in indexes serve it."""
+        orders = [o for o in self.orders if o[0] != '__key__']
+        if not (self.inequality or orders or self.projection):
+            # no filters, or equality filters (merge join)
+            return None
+        involved = set(p for p, _ in orders)
+        involved.update(self.projection)
+        if self.inequality:
+            involved.add(self.inequality)
+        if (not self.ancestor and not self.equality and
+                len(involved) == 1 and len(orders) <= 1):
+            # one property: its built-in index
+            return None
+
+        props = [(p, 'asc') for p in sorted(self.equality)]
+        # the inequality property must be the first sort order
+        if self.inequality and not (
+                orders and orders[0][0] == self.inequality):
+            props.append((self.inequality, 'asc'))
+        props.extend(orders)
+        for p in self.projection:
+            if p not in [name for name, _ in props]:
+                props.append((p, 'asc'))
+        return (self.kind, self.ancestor, tuple(props))
+
+    def describe(self):
+        parts = []
+        if self.ancestor:
+            parts.append('ancestor')
+        parts.extend('%s =' % p for p in self.equality)
+        if self.inequality:
+            parts.append('%s <>' % self.inequality)
+        parts.extend('order %s %s' % o for o in self.orders)
+        if self.projection:
+            parts.append('project %s' % ','.join(self.projection))
+        return '%s(%s)' % (self.kind, ', '.join(parts) or 'all')
+
+
+# queries other than the per-filter queryConferences/querySessions ones
+OTHER_QUERIES = [
+    Shape('Conference', 'ConferenceApi._cacheAnnouncement',
+          inequality='seatsAvailable', projection=['name']),
+    Shape('Conference', 'ConferenceApi._createProfileObject',
+          equality=['organizerUserId']),
+    Shape('Conference', 'ConferenceApi.filterPlayground',
+          equality=['city', 'topics', 'month']),
+    Shape('Conference', 'getUserId',
+          equality=['mainEmail']),
+    Shape('Conference', 'NdbStorage.allConferences'),
+    Shape('Conference', 'leaderboard.buildSnapshot'),
+    Shape('Conference', 'leaderboard.buildSnapshot (city)',
+          equality=['city']),
+    Shape('Conference', 'leaderboard.buildSnapshot (month)',
+          equality=['month']),
+    Shape('Conference', 'NdbStorage.conferencesByOrganizer',
+          ancestor=True),
+    Shape('Conference', 'SeatReconciliation.query (full)',
+          orders=[('__key__', 'asc')]),
+    Shape('Conference', 'SeatReconciliation.query',
+          inequality='modified', orders=[('modified', 'asc')]),
+    Shape('Profile', 'SeatReconciliation.process',
+          equality=['conferenceKeysToAttend']),
+    Shape('Profile', 'NdbStorage.allProfiles'),
+    Shape('Profile', 'Recommendations.query',
+          orders=[('__key__', 'asc')]),
+    Shape('SessionRecommendations', 'recommendations.finishPass',
+          inequality='passId'),
+    Shape('Session', 'ConferenceApi._cacheFeaturedSpeaker',
+          ancestor=True, orders=[('speaker', 'asc')]),
+    Shape('Session', 'NdbStorage.sessionsForConference', ancestor=True),
+    Shape('Session', 'NdbStorage.sessionsForConference (type)',
+          ancestor=True, equality=['typeOfSession']),
+    Shape('Session', 'NdbStorage.sessionsForConference (speaker)',
+          ancestor=True, equality=['speaker']),
+    Shape('Session', 'NdbStorage.sessionsBySpeaker',
+          equality=['speaker']),
+    Shape('Session', 'speakers.buildIndex',
+          equality=['speaker'], orders=[('__key__', 'asc')]),
+    Shape('Conference', 'sync.changesPage',
+          inequality='modified', orders=[('modified', 'asc')]),
+    Shape('Session', 'sync.changesPage',
+          inequality='modified', orders=[('modified', 'asc')]),
+    Shape('Session', 'sync.changesPage (full)',
+          orders=[('__key__', 'asc')]),
+    Shape('Tombstone', 'sync.changesPage',
+          inequality='deleted', orders=[('deleted', 'asc')]),
+    Shape('Tombstone', 'sync.purgeTombstones', inequality='deleted'),
+    Shape('WaitlistEntry', 'waitlist.nextEntries',
+          equality=['conference'], orders=[('created', 'asc')]),
+    Shape('IdempotentResponse', 'idempotency.purgeExpired',
+          inequality='expires'),
+]
+
+
+# - - - Reading the code - - - - - - - - - - - - - - - - - - - -
+
+def _parse(filename):
+    with open(os.path.join(ROOT, filename)) as f:
+        return ast.parse(f.read(), filename)
+
+
+def moduleDicts(filename, names):
+    """Return the literal dicts assigned to names in a module."""
+    found = {}
+    for node in _parse(filename).body:
+        if isinstance(node, ast.Assign):
+            for target in node.targets:
+                if isinstance(target, ast.Name) and target.id in names:
+                    found[target.id] = ast.literal_eval(node.value)
+    return found
+
+
+def modelProperties(filename='models.py'):
+    """Return {kind: [(property, repeated), ...]} of the indexed
+    properties of every ndb model."""
+    kinds = {}
+    for node in _parse(filename).body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+        props = []
+        for stmt in node.body:
+            if not (isinstance(stmt, ast.Assign) and
+                    isinstance(stmt.value, ast.Call)):
+                continue
+            func = stmt.value.func
+            type_name = getattr(func, 'attr', getattr(func, 'id', ''))
+            if not type_name.endswith('Property'):
+                continue
+            kwargs = dict((k.arg, k.value) for k in stmt.value.keywords)
+            indexed = kwargs.get('indexed')
+            if type_name in UNINDEXED_TYPES or (
+                    indexed is not None and
+                    getattr(indexed, 'id', None) == 'False'):
+                continue
+            repeated = getattr(kwargs.get('repeated'), 'id', None) == 'True'
+            props.append((stmt.targets[0].id, repeated))
+        if props:
+            kinds[node.name] = props
+    return kinds
+
+
+def filterShapes():
+    """Return the shapes _getQuery & _getSessionQuery can issue: one
+    keys-only query per submitted filter (results are intersected in
+    memory), so never more than one filter per query."""
+    consts = moduleDicts('conference.py',
+                         ('OPERATORS', 'FIELDS', 'SESSION_FIELDS'))
+    shapes = []
+    for kind, fields, ancestor, source in (
+            ('Conference', consts['FIELDS'], False,
+             'ConferenceApi._getQuery'),
+            ('Session', consts['SESSION_FIELDS'], True,
+             'ConferenceApi._getSessionQuery')):
+        for field in sorted(fields.values()):
+            for op in sorted(set(consts['OPERATORS'].values())):
+                if op == '=':
+                    shape = Shape(kind, source, ancestor=ancestor,
+                                  equality=[field])
+                else:
+                    shape = Shape(kind, source, ancestor=ancestor,
+                                  inequality=field)
+                shape.operator = op
+                shapes.append(shape)
+    return shapes
+
+
+# - - - index.yaml - - - - - - - - - - - - - - - - - - - - - - - -
+
+def readIndexYaml(path):
+    """Return the indexes in index.yaml, as requiredIndex() tuples."""
+    indexes = []
+    current = None
+    with open(path) as f:
+        for line in f:
+            line = line.split('#', 1)[0].rstrip()
+            m = re.match(r'^- kind:\s*(\w+)', line)
+            if m:
+                current = [m.group(1), False, []]
+                indexes.append(current)
+                continue
+            if current is None:
+                continue
+            m = re.match(r'^\s+ancestor:\s*(\w+)', line)
+            if m:
+                current[1] = m.group(1).lower() in ('yes', 'true')
+                continue
+            m = re.match(r'^\s+- name:\s*(\w+)', line)
+            if m:
+                current[2].append([m.group(1), 'asc'])
+                continue
+            m = re.match(r'^\s+direction:\s*(\w+)', line)
+            if m and current[2]:
+                current[2][-1][1] = m.group(1)
+    return [(k, a, tuple(tuple(p) for p in props))
+            for k, a, props in indexes]
+
+
+def formatIndexYaml(indexes):
+    lines = ['indexes:', '',
+             '# Composite indexes the app needs, as worked out by',
+             '# index_analyzer.py; run it again after changing a query.',
+             '']
+    for kind, ancestor, props in indexes:
+        lines.append('- kind: %s' % kind)
+        if ancestor:
+            lines.append('  ancestor: yes')
+        lines.append('  properties:')
+        for name, direction in props:
+            lines.append('  - name: %s' % name)
+            if direction != 'asc':
+                lines.append('    direction: %s' % direction)
+        lines.append('')
+    lines.extend([
+        AUTOGENERATED,
+        '',
+        '# This index.yaml is automatically updated whenever the',
+        '# dev_appserver detects that a new type of query is run.  Indexes',
+        '# it adds below this line are not managed by index_analyzer.py;',
+        '# add the query to it and move the index above the marker line',
+        '# to keep it.',
+        '',
+    ])
+    return '\n'.join(lines)
+
+
+# - - - Write cost - - - - - - - - - - - - - - - - - - - - - - - -
+
+def indexEntries(index, properties, repeatedValues):
+    """Entries one entity has in a composite index: the product of
+    the value counts of its properties (times the ancestor path
+    length for ancestor indexes)."""
+    kind, ancestor, props = index
+    repeated = dict(properties.get(kind, []))
+    entries = ANCESTOR_DEPTH.get(kind, 1) if ancestor else 1
+    for name, _ in props:
+        entries *= repeatedValues if repeated.get(name) else 1
+    return entries
+
+
+def writeCost(kind, indexes, properties, repeatedValues):
+    """Write ops for creating one entity: the entity & kind index, two
+    built-in index rows per indexed value, and its composite index
+    entries."""
+    values = sum(repeatedValues if repeated else 1
+                 for _, repeated in properties.get(kind, []))
+    composite = sum(indexEntries(i, properties, repeatedValues)
+                    for i in indexes if i[0] == kind)
+    return 2 + 2 * values + composite, composite
+
+
+# - - - Report - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def formatIndex(index):
+    kind, ancestor, props = index
+    return '%s%s(%s)' % (kind, ' ancestor' if ancestor else '', ', '.join(
+        p if d == 'asc' else '%s %s' % (p, d) for p, d in props))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Conference Central composite index analyzer')
+    parser.add_argument('--write', action='store_true',
+                        help='write the pruned index.yaml')
+    parser.add_argument('--repeated', type=int, default=3,
+                        help='values assumed per repeated property '
+                             '(e.g. Conference.topics)')
+    args = parser.parse_args(argv)
+
+    properties = modelProperties()
+    shapes = filterShapes() + OTHER_QUERIES
+    needed = OrderedDict()
+    print 'Query shapes:'
+    for shape in shapes:
+        index = shape.requiredIndex()
+        label = shape.describe()
+        if hasattr(shape, 'operator'):
+            label += ' [%s]' % shape.operator
+        print '    %-55s %-40s %s' % (
+            label, shape.source,
+            formatIndex(index) if index else 'built-in')
+        if index:
+            needed.setdefault(index, []).append(shape.source)
+
+    path = os.path.join(ROOT, INDEX_YAML)
+    current = readIndexYaml(path)
+    print
+    print 'Indexes: %d in %s, %d needed' % (
+        len(current), INDEX_YAML, len(needed))
+    for index in current:
+        print '    %-6s %s' % (
+            'keep' if index in needed else 'DROP', formatIndex(index))
+    for index in needed:
+        if index not in current:
+            print '    %-6s %s' % ('ADD', formatIndex(index))
+
+    print
+    print 'Write ops per new entity (%d values per repeated property):' % (
+        args.repeated)
+    for kind in sorted(set(i[0] for i in current) | set(
+            i[0] for i in needed)):
+        before, before_c = writeCost(kind, current, properties,
+                                     args.repeated)
+        after, after_c = writeCost(kind, needed, properties,
+                                   args.repeated)
+        print '    %-20s %4d -> %4d  (composite entries %d -> %d)' % (
+            kind, before, after, before_c, after_c)
+
+    if args.write:
+        with open(path, 'w') as f:
+            f.write(formatIndexYaml(sorted(needed)))
+        print
+        print 'Wrote %s' % INDEX_YAML
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
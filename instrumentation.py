@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+import functools
+import logging
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map, memcache
+
+"""instrumentation.py
+
+Conference Central per-endpoint RPC and latency instrumentation
+
+Every ConferenceApi endpoint method is wrapped with @instrumented, which
+records wall time plus the datastore, memcache and task queue RPCs the
+call made (counted by API proxy hooks). Aggregates are kept in-process
+and periodically flushed to memcache, where main.py reports them.
+
+"""
+
+
+MEMCACHE_STATS_NAMESPACE = 'instrumentation'
+FLUSH_INTERVAL = 60  # seconds between flushes of local stats to memcache
+
+# upper bounds (in ms) of the latency histogram buckets; the last
+# bucket holds everything slower than LATENCY_BUCKETS[-1]
+LATENCY_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+COUNTERS = (
+    'datastoreGets',
+    'datastorePuts',
+    'datastoreQueries',
+    'datastoreAllocates',
+    'memcacheHits',
+    'memcacheMisses',
+    'taskEnqueues',
+)
+
+# (service, call) pairs counted once per RPC by the pre-call hook
+RPC_COUNTERS = {
+    ('datastore_v3', 'Get'): 'datastoreGets',
+    ('datastore_v3', 'Put'): 'datastorePuts',
+    ('datastore_v3', 'RunQuery'): 'datastoreQueries',
+    ('datastore_v3', 'AllocateIds'): 'datastoreAllocates',
+}
+
+_local = threading.local()
+
+
+# - - - API proxy hooks - - - - - - - - - - - - - - - - - - -
+
+def _currentRecord():
+    """Return the counter dict of the call in progress, if any."""
+    return getattr(_local, 'record', None)
+
+
+def _preCallHook(service, call, request, response):
+    """Count datastore RPCs and task enqueues for the current call."""
+    record = _currentRecord()
+    if record is None:
+        return
+    counter = RPC_COUNTERS.get((service, call))
+    if counter:
+        record[counter] += 1
+    elif service == 'taskqueue' and call == 'Add':
+        record['taskEnqueues'] += 1
+    elif service == 'taskqueue' and call == 'BulkAdd':
+        record['taskEnqueues'] += request.add_request_size()
+
+
+def _postCallHook(service, call, request, response):
+    """Count memcache hits and misses for the current call."""
+    record = _currentRecord()
+    if record is None:
+        return
+    if service == 'memcache' and call == 'Get':
+        hits = response.item_size()
+        record['memcacheHits'] += hits
+        record['memcacheMisses'] += request.key_size() - hits
+
+
+def installHooks():
+    """Register the API proxy hooks; safe to call more than once."""
+    apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+        'instrumentation', _preCallHook)
+    apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+        'instrumentation', _postCallHook)
+
+
+# - - - Aggregates - - - - - - - - - - - - - - - - - - - - - -
+
+class MethodStats(object):
+    """MethodStats -- latency histogram & RPC totals for one method"""
+
+    def __init__(self):
+        self.calls = 0
+        self.totalMs = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+
+    def add(self, elapsedMs, record):
+        """Fold a single call into the aggregate."""
+        self.calls += 1
+        self.totalMs += int(elapsedMs)
+        idx = 0
+        while (idx < len(LATENCY_BUCKETS) and
+               elapsedMs > LATENCY_BUCKETS[idx]):
+            idx += 1
+        self.buckets[idx] += 1
+        for name in COUNTERS:
+            self.counters[name] += record[name]
+
+    def items(self, method):
+        """Return (memcache key, value) pairs for this aggregate."""
+        yield _statKey(method, 'calls'), self.calls
+        yield _statKey(method, 'totalMs'), self.totalMs
+        for idx, count in enumerate(self.buckets):
+            yield _statKey(method, 'bucket%d' % idx), count
+        for name in COUNTERS:
+            yield _statKey(method, name), self.counters[name]
+
+
+def _statKey(method, name):
+    """Return the memcache key holding one statistic of a method."""
+    return '%s:%s' % (method, name)
+
+
+class StatsCollector(object):
+    """StatsCollector -- thread-safe, in-process store of MethodStats
+
+    Stats accumulate locally and are added to the memcache totals every
+    FLUSH_INTERVAL seconds, after which the local window starts over.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._lastFlush = time.time()
+
+    def add(self, method, elapsedMs, record):
+        """Record a finished call, flushing to memcache when due."""
+        with self._lock:
+            if method not in self._stats:
+                self._stats[method] = MethodStats()
+            self._stats[method].add(elapsedMs, record)
+            due = time.time() - self._lastFlush >= FLUSH_INTERVAL
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Add the local window to the memcache totals and reset it."""
+        with self._lock:
+            stats, self._stats = self._stats, {}
+            self._lastFlush = time.time()
+        deltas = {}
+        for method, ms in stats.items():
+            for key, value in ms.items(method):
+                if value:
+                    deltas[key] = value
+        if deltas:
+            try:
+                memcache.offset_multi(
+                    deltas, namespace=MEMCACHE_STATS_NAMESPACE,
+                    initial_value=0)
+            except Exception:
+                logging.exception('Failed to flush endpoint stats')
+
+    def local(self, method):
+        """Return the unflushed MethodStats of a method, or None."""
+        with self._lock:
+            return self._stats.get(method)
+
+
+collector = StatsCollector()
+
+
+def instrumented(func):
+    """Decorator recording wall time and RPC counts of an endpoint call.
+
+    Apply underneath @endpoints.method so the endpoint name is kept.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # nested calls are already counted by the outermost endpoint
+        if _currentRecord() is not None:
+            return func(*args, **kwargs)
+        _local.record = record = dict.fromkeys(COUNTERS, 0)
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.record = None
+            collector.add(
+                func.__name__, (time.time() - start) * 1000, record)
+    return wrapper
+
+
+# - - - Reporting - - - - - - - - - - - - - - - - - - - - - - -
+
+def _percentile(buckets, calls, fraction):
+    """Return the bucket upper bound (ms) that covers a percentile."""
+    if not calls:
+        return None
+    target = calls * fraction
+    seen = 0
+    for idx, count in enumerate(buckets):
+        seen += count
+        if seen >= target:
+            if idx < len(LATENCY_BUCKETS):
+                return LATENCY_BUCKETS[idx]
+            break
+    return None  # slower than the largest bucket
+
+
+def getStats(methods):
+    """Return per-method stats (memcache totals plus local window)."""
+    keys = []
+    for method in methods:
+        keys.extend(key for key, _ in MethodStats().items(method))
+    totals = memcache.get_multi(
+        keys, namespace=MEMCACHE_STATS_NAMESPACE) or {}
+
+    report = {}
+    for method in sorted(methods):
+        ms = MethodStats()
+        pending = collector.local(method)
+        calls = totals.get(_statKey(method, 'calls'), 0)
+        ms.calls = calls + (pending.calls if pending else 0)
+        if not ms.calls:
+            continue
+        ms.totalMs = totals.get(_statKey(method, 'totalMs'), 0)
+        for idx in range(len(ms.buckets)):
+            ms.buckets[idx] = totals.get(
+                _statKey(method, 'bucket%d' % idx), 0)
+        for name in COUNTERS:
+            ms.counters[name] = totals.get(_statKey(method, name), 0)
+        if pending:
+            ms.totalMs += pending.totalMs
+            ms.buckets = [a + b for a, b in zip(ms.buckets, pending.buckets)]
+            for name in COUNTERS:
+                ms.counters[name] += pending.counters[name]
+
+        entry = {
+            'calls': ms.calls,
+            'meanMs': ms.totalMs / float(ms.calls),
+            'p50Ms': _percentile(ms.buckets, ms.calls, 0.5),
+            'p95Ms': _percentile(ms.buckets, ms.calls, 0.95),
+            'histogram': dict(
+                zip([str(b) for b in LATENCY_BUCKETS] + ['inf'],
+                    ms.buckets)),
+        }
+        for name in COUNTERS:
+            entry[name] = ms.counters[name]
+            entry[name + 'PerCall'] = ms.counters[name] / float(ms.calls)
+        report[method] = entry
+    return report
+
+
+installHooks()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+import logging
+import time
+from datetime import datetime, timedelta
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import JobCheckpoint
+
+"""jobs.py
+
+Conference Central resumable batch jobs
+
+A BatchJob walks a query in batches, one task per batch. After each
+batch the query cursor and counters are saved to the job's
+JobCheckpoint, and the task for the next batch is added in the same
+transaction, so a job survives failed or repeated tasks and resumes
+from its last checkpoint: a task whose pass & batch number no longer
+match the checkpoint is a duplicate and does nothing. startJob (run
+from cron) starts a new pass, or resumes a pass whose tasks have
+stalled. Subclasses supply the query and the per-batch work.
+
+"""
+
+
+JOB_BATCH_SIZE = 50
+JOB_STALL_TIME = timedelta(minutes=30)  # no progress -> resume pass
+JOB_QUEUE = 'default'
+
+
+class BatchJob(object):
+    """BatchJob -- a resumable job over a query; subclass and set
+    name & url (of the task handler that calls runBatch)"""
+
+    name = None
+    url = None
+    batchSize = JOB_BATCH_SIZE
+
+    def beginPass(self, checkpoint, **options):
+        """Prepare the checkpoint for a new pass (counters are reset
+        already); e.g. set its since/until window."""
+
+    def query(self, checkpoint):
+        """Return the ndb query this pass walks; it must be stable
+        under a cursor (ordered)."""
+        raise NotImplementedError
+
+    def process(self, entities, checkpoint):
+        """Do the work for one batch; return (number changed, notes),
+        notes being a list merged into checkpoint.report by
+        addNotes. May be run more than once for a batch."""
+        raise NotImplementedError
+
+    def delay(self, changed, elapsed):
+        """Return the seconds to wait before the next batch, given
+        how many entities this one changed and how long it took;
+        override to throttle."""
+        return 0
+
+    def addNotes(self, checkpoint, notes):
+        """Fold a batch's notes into the checkpoint's report."""
+        report = checkpoint.report or {}
+        report.setdefault('notes', []).extend(notes)
+        checkpoint.report = report
+
+    def endPass(self, checkpoint):
+        """Finish a pass; the default moves the watermark up."""
+        checkpoint.completedUntil = checkpoint.until
+
+
+def checkpointKey(name):
+    return ndb.Key(JobCheckpoint, name)
+
+
+def _enqueueBatch(job, passId, batch, countdown=0):
+    """Add the task for a batch; call inside the checkpoint txn."""
+    taskqueue.add(
+        url=job.url,
+        params={'pass': passId, 'batch': batch},
+        queue_name=JOB_QUEUE,
+        countdown=countdown,
+        transactional=True
+    )
+
+
+def startJob(job, **options):
+    """Start a pass of the job, or resume a stalled one; returns the
+    pass ID, or None if a pass is already making progress."""
+
+    @ndb.transactional()
+    def txn():
+        cp = checkpointKey(job.name).get() or JobCheckpoint(
+            key=checkpointKey(job.name))
+        if cp.running:
+            if cp.updated and datetime.now() - cp.updated < JOB_STALL_TIME:
+                return None
+            # tasks stopped coming; carry on from the checkpoint
+            logging.warning('Resuming stalled job %s at batch %d',
+                            job.name, cp.batches)
+        else:
+            cp.running = True
+            cp.passId += 1
+            cp.batches = 0
+            cp.cursor = None
+            cp.processed = 0
+            cp.changed = 0
+            cp.report = None
+            cp.started = datetime.now()
+            cp.finished = None
+            job.beginPass(cp, **options)
+        cp.put()
+        _enqueueBatch(job, cp.passId, cp.batches)
+        return cp.passId
+
+    return txn()
+
+
+def runBatch(job, passId, batch):
+    """Run one batch of a pass (task handler); returns False if the
+    task was a duplicate or the pass has moved on."""
+    cp = checkpointKey(job.name).get()
+    if not (cp and cp.running and cp.passId == passId and
+            cp.batches == batch):
+        return False
+
+    started = time.time()
+    start = Cursor(urlsafe=cp.cursor) if cp.cursor else None
+    entities, cursor, more = job.query(cp).fetch_page(
+        job.batchSize, start_cursor=start)
+    changed, notes = job.process(entities, cp)
+    countdown = job.delay(changed, time.time() - started)
+
+    @ndb.transactional()
+    def txn():
+        cp = checkpointKey(job.name).get()
+        if not (cp.running and cp.passId == passId and
+                cp.batches == batch):
+            return False
+        cp.batches += 1
+        cp.cursor = cursor.urlsafe() if cursor else None
+        cp.processed += len(entities)
+        cp.changed += changed
+        if notes:
+            job.addNotes(cp, notes)
+        if more and cursor:
+            _enqueueBatch(job, passId, cp.batches, countdown)
+        else:
+            cp.running = False
+            cp.finished = datetime.now()
+            job.endPass(cp)
+        cp.put()
+        return True
+
+    return txn()
+
+
+def jobReport(name):
+    """Return a job's checkpoint as a dict, for the admin page."""
+    cp = checkpointKey(name).get()
+    if cp is None:
+        return None
+    report = cp.to_dict()
+    for field, value in report.items():
+        if isinstance(value, datetime):
+            report[field] = value.isoformat()
+    return report
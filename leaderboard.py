@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+import heapq
+import logging
+
+from google.appengine.api import memcache, taskqueue
+from google.appengine.ext import ndb
+
+from caching import POPULAR_CACHE, local, stats
+from models import Conference, PopularConferences
+from tasks import enqueueCoalesced
+
+"""leaderboard.py
+
+Conference Central popular conferences
+
+The datastore can't order Conferences by registrations (maxAttendees -
+seatsAvailable), so the most registered Conferences of each scope (all
+of them, a city or a month) are kept in a memcache snapshot that
+registrations update as they happen: once a registration commits, the
+Conference's new count is written into the snapshots of its scopes
+with a compare-and-set. A snapshot keeps POPULAR_KEEP entries, more
+than are served, so a Conference dropping out doesn't leave a gap
+straight away. Its floor is the highest count a Conference missing
+from it can have; only entries at or above the floor are certain to be
+in the top, and when fewer than the request's limit are, or the
+snapshot was evicted, a coalesced task rebuilds it from the datastore.
+Another coalesced task copies a changed snapshot to its
+PopularConferences entity, which is served after an eviction until the
+rebuild is done. A scope's snapshot is built on its first read.
+
+"""
+
+
+POPULAR_TOP_K = 10  # most entries served
+POPULAR_KEEP = 2 * POPULAR_TOP_K  # entries kept in a snapshot
+POPULAR_ALL = 'all'  # scope of every Conference
+POPULAR_CAS_RETRIES = 5
+MEMCACHE_POPULAR_KEY = 'POPULAR:%s'  # scope
+POPULAR_RECORD_URL = '/tasks/popular/record'
+POPULAR_PERSIST_URL = '/tasks/popular/persist'
+POPULAR_REBUILD_URL = '/tasks/popular/rebuild'
+
+# snapshot entry: [registered, websafe key, version, name, city, startDate]
+_REGISTERED, _WSCK, _VERSION = 0, 1, 2
+
+
+def popularScope(city=None, month=None):
+    """Return the name of the scope of a city, a month, or (neither)
+    every Conference."""
+    if city:
+        return 'city:%s' % city
+    if month:
+        return 'month:%d' % month
+    return POPULAR_ALL
+
+
+def conferenceScopes(conf):
+    """Return the scopes a Conference is ranked in."""
+    scopes = [POPULAR_ALL]
+    if conf.city:
+        scopes.append(popularScope(city=conf.city))
+    if conf.month:
+        scopes.append(popularScope(month=conf.month))
+    return scopes
+
+
+def _entry(conf):
+    registered = (conf.maxAttendees or 0) - (conf.seatsAvailable or 0)
+    return [max(registered, 0), conf.key.urlsafe(), conf.version,
+            conf.name, conf.city,
+            str(conf.startDate) if conf.startDate else None]
+
+
+def _rank(entry):
+    # ties go to the higher key, so every snapshot orders them alike
+    return entry[_REGISTERED], entry[_WSCK]
+
+
+def _apply(snapshot, entry, remove=False):
+    """Return the snapshot with a Conference's entry updated (or
+    removed), or None if that leaves it unchanged."""
+    entries, floor = snapshot['entries'], snapshot['floor']
+    old = None
+    for e in entries:
+        if e[_WSCK] == entry[_WSCK]:
+            old = e
+    if old is None:
+        if remove or entry[_REGISTERED] <= floor:
+            return None  # not in the snapshot, and not going in
+    elif old[_VERSION] >= entry[_VERSION]:
+        return None  # a later change got here first
+    entries = [e for e in entries if e[_WSCK] != entry[_WSCK]]
+    # a Conference at or below the floor is left out; any Conference
+    # missing from the snapshot may have that many
+    if not remove and entry[_REGISTERED] > floor:
+        entries.append(entry)
+    entries.sort(key=_rank, reverse=True)
+    for dropped in entries[POPULAR_KEEP:]:
+        floor = max(floor, dropped[_REGISTERED])
+    return {'entries': entries[:POPULAR_KEEP], 'floor': floor}
+
+
+def _update(scope, entry, remove=False):
+    """Write an entry into a scope's memcache snapshot, if there is
+    one (compare-and-set)."""
+    client = memcache.Client()
+    key = MEMCACHE_POPULAR_KEY % scope
+    for _ in range(POPULAR_CAS_RETRIES):
+        snapshot = client.gets(key)
+        if snapshot is None:
+            return  # built from the datastore on its next read
+        updated = _apply(snapshot, entry, remove)
+        if updated is None:
+            return
+        if client.cas(key, updated):
+            enqueueCoalesced(POPULAR_PERSIST_URL, {'scope': scope},
+                             bucket=scope)
+            return
+    logging.warning('Too much contention to update popular %s', scope)
+    _scheduleRebuild(scope)
+
+
+def recordPopularity(conf, previous=()):
+    """Write a Conference's registration count into the snapshots of
+    its scopes, and take it out of the previous scopes it has left
+    (its city or month changed). Call once its change has committed."""
+    entry = _entry(conf)
+    scopes = conferenceScopes(conf)
+    for scope in scopes:
+        _update(scope, entry)
+    for scope in previous:
+        if scope not in scopes:
+            _update(scope, entry, remove=True)
+
+
+def schedulePopularity(conf, previous=()):
+    """Record a Conference's popularity once the transaction it's
+    changed in commits (task); call inside that transaction."""
+    taskqueue.add(
+        url=POPULAR_RECORD_URL,
+        params={'conf': conf.key.urlsafe(), 'previous': list(previous)},
+        transactional=True
+    )
+
+
+def recordFromTask(wsck, previous):
+    """Record the popularity of a Conference (task)."""
+    conf = ndb.Key(urlsafe=wsck).get()
+    if conf is not None:
+        recordPopularity(conf, previous)
+
+
+def _scheduleRebuild(scope):
+    enqueueCoalesced(POPULAR_REBUILD_URL, {'scope': scope}, bucket=scope)
+
+
+def _scopeQuery(scope):
+    if scope.startswith('city:'):
+        return Conference.query(Conference.city == scope[len('city:'):])
+    if scope.startswith('month:'):
+        return Conference.query(
+            Conference.month == int(scope[len('month:'):]))
+    return Conference.query()
+
+
+def _store(scope, snapshot):
+    PopularConferences(id=scope, entries=snapshot['entries'],
+                       floor=snapshot['floor']).put()
+
+
+def buildSnapshot(scope, batch_size=500):
+    """Rank every Conference of a scope & replace its snapshot (task).
+    A registration committed while this runs may be missed; the next
+    change to that Conference puts it right."""
+    ranked = heapq.nlargest(
+        POPULAR_KEEP + 1,
+        (_entry(conf) for conf in _scopeQuery(scope).iter(
+            batch_size=batch_size)),
+        key=_rank)
+    ranked = [e for e in ranked if e[_REGISTERED] > 0]
+    floor = ranked[POPULAR_KEEP][_REGISTERED] \
+        if len(ranked) > POPULAR_KEEP else 0
+    snapshot = {'entries': ranked[:POPULAR_KEEP], 'floor': floor}
+    memcache.set(MEMCACHE_POPULAR_KEY % scope, snapshot)
+    if snapshot['entries'] or \
+            ndb.Key(PopularConferences, scope).get() is not None:
+        # scopes nobody registered in (e.g. a misspelt city) are only
+        # cached, so reads can't fill the datastore with them
+        _store(scope, snapshot)
+    return snapshot
+
+
+def persistSnapshot(scope):
+    """Copy a scope's memcache snapshot to the datastore (task)."""
+    snapshot = memcache.get(MEMCACHE_POPULAR_KEY % scope)
+    if snapshot is None:
+        return False
+    _store(scope, snapshot)
+    return True
+
+
+def _loadSnapshot(scope, limit):
+    key = MEMCACHE_POPULAR_KEY % scope
+    snapshot = memcache.get(key)
+    if snapshot is not None:
+        stats.hit(POPULAR_CACHE)
+    else:
+        stats.miss(POPULAR_CACHE)
+        # changes made since the last copy may be missing from it
+        _scheduleRebuild(scope)
+        stored = ndb.Key(PopularConferences, scope).get()
+        if stored is None:
+            return None
+        snapshot = {'entries': stored.entries, 'floor': stored.floor}
+        memcache.add(key, snapshot)
+    if snapshot['floor'] > 0 and len(_certain(snapshot)) < limit:
+        _scheduleRebuild(scope)
+    return snapshot
+
+
+def _certain(snapshot):
+    return [e for e in snapshot['entries']
+            if e[_REGISTERED] >= snapshot['floor']]
+
+
+def popularConferences(scope, limit=POPULAR_TOP_K):
+    """Return up to limit entries of a scope's snapshot as dicts, most
+    registered first, through the instance's local cache."""
+    snapshot = local.get(
+        POPULAR_CACHE, '%s:%d' % (MEMCACHE_POPULAR_KEY % scope, limit),
+        lambda: _loadSnapshot(scope, limit))
+    if snapshot is None:
+        return []
+    return [dict(registered=e[0], websafeKey=e[1], name=e[3], city=e[4],
+                 startDate=e[5])
+            for e in _certain(snapshot)[:limit]]
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+import json
+import logging
+import threading
+import time
+from Queue import Empty, Queue
+
+from google.appengine.api import app_identity, taskqueue
+
+from tasks import enqueueCoalesced
+
+"""mailer.py
+
+Conference Central batched confirmation email pipeline
+
+Producers add one pull task per email to MAIL_QUEUE, holding a JSON
+payload (recipient + template values). A coalesced push task then
+drains the queue: it leases tasks in batches, renders each message
+from its template, sends with bounded concurrency and deletes the
+tasks that were sent. Failed sends keep their lease for an
+exponentially growing backoff, after which they are leased again.
+
+"""
+
+
+MAIL_QUEUE = 'confirmation-email'  # pull queue, see queue.yaml
+MAIL_DRAIN_URL = '/tasks/send_confirmation_emails'
+MAIL_BATCH_SIZE = 100  # tasks leased per batch
+MAIL_LEASE_SECONDS = 60
+MAIL_SEND_CONCURRENCY = 5  # messages in flight at once
+MAIL_MAX_ATTEMPTS = 5
+MAIL_BACKOFF_BASE = 30  # seconds; doubled after every failed attempt
+MAIL_DRAIN_DEADLINE = 8 * 60  # stay inside the 10 minute task limit
+
+TEMPLATES = {
+    'conference_created': {
+        'subject': 'You created a new Conference!',
+        'body': (
+            'Hi, you have created the following conference:\r\n'
+            '\r\n'
+            'Name: %(name)s\r\n'
+            'Description: %(description)s\r\n'
+            'City: %(city)s\r\n'
+            'Topics: %(topics)s\r\n'
+            'Start date: %(startDate)s\r\n'
+            'End date: %(endDate)s\r\n'
+            'Maximum attendees: %(maxAttendees)s\r\n'
+        ),
+    },
+    'waitlist_promoted': {
+        'subject': 'You got a seat!',
+        'body': (
+            'Hi, a seat became available and you have been registered '
+            'for the following conference:\r\n'
+            '\r\n'
+            'Name: %(name)s\r\n'
+            'City: %(city)s\r\n'
+            'Start date: %(startDate)s\r\n'
+        ),
+    },
+}
+
+
+# - - - Producers - - - - - - - - - - - - - - - - - - - - - - -
+
+def conferencePayload(form):
+    """Return the template values for a ConferenceForm."""
+    return {
+        'name': form.name,
+        'description': form.description or '',
+        'city': form.city or '',
+        'topics': ', '.join(form.topics or []),
+        'startDate': form.startDate or 'TBA',
+        'endDate': form.endDate or 'TBA',
+        'maxAttendees': form.maxAttendees or 0,
+    }
+
+
+def queueEmail(to, template, values, transactional=False):
+    """Add an email to the pull queue; it is sent by the next drain."""
+    if template not in TEMPLATES:
+        raise ValueError('Unknown email template: %s' % template)
+    payload = json.dumps({'to': to, 'template': template, 'values': values})
+    taskqueue.Queue(MAIL_QUEUE).add(
+        taskqueue.Task(payload=payload, method='PULL'),
+        transactional=transactional)
+
+
+def scheduleDrain():
+    """Make sure a drain task runs shortly (coalesced)."""
+    return enqueueCoalesced(MAIL_DRAIN_URL, bucket=MAIL_QUEUE)
+
+
+# - - - Consumer - - - - - - - - - - - - - - - - - - - - - - - -
+
+def renderEmail(payload):
+    """Return (to, subject, body) for a decoded task payload."""
+    tpl = TEMPLATES[payload['template']]
+    return (payload['to'], tpl['subject'], tpl['body'] % payload['values'])
+
+
+def _sendBatch(tasks, sender):
+    """Send the emails of the leased tasks using at most
+    MAIL_SEND_CONCURRENCY threads; return (sent, failed) task lists."""
+    # only drain requests send mail; import it here (before the worker
+    # threads start) rather than on every instance
+    from google.appengine.api import mail
+    work = Queue()
+    for task in tasks:
+        work.put(task)
+    sent = []
+    failed = []
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            try:
+                task = work.get_nowait()
+            except Empty:
+                return
+            try:
+                to, subject, body = renderEmail(json.loads(task.payload))
+                mail.send_mail(sender, to, subject, body)
+                outcome = sent
+            except Exception:
+                logging.exception('Failed to send email task %s', task.name)
+                outcome = failed
+            with lock:
+                outcome.append(task)
+
+    threads = [threading.Thread(target=worker)
+               for _ in range(min(MAIL_SEND_CONCURRENCY, len(tasks)))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sent, failed
+
+
+def drainMailQueue():
+    """Lease and send queued emails in batches until the queue is empty
+    (or the deadline is near); return the number of emails sent."""
+    queue = taskqueue.Queue(MAIL_QUEUE)
+    sender = 'noreply@%s.appspotmail.com' % (
+        app_identity.get_application_id())
+    started = time.time()
+    total = 0
+
+    while time.time() - started < MAIL_DRAIN_DEADLINE:
+        tasks = queue.lease_tasks(MAIL_LEASE_SECONDS, MAIL_BATCH_SIZE)
+        if not tasks:
+            break
+        sent, failed = _sendBatch(tasks, sender)
+        total += len(sent)
+
+        for task in failed:
+            if task.retry_count >= MAIL_MAX_ATTEMPTS:
+                logging.error('Giving up on email task %s after %d attempts',
+                              task.name, task.retry_count)
+                sent.append(task)  # drop it from the queue
+            else:
+                # keep it leased until its backoff expires
+                attempts = max(task.retry_count, 1)
+                queue.modify_task_lease(
+                    task, MAIL_BACKOFF_BASE * 2 ** (attempts - 1))
+        if sent:
+            queue.delete_tasks(sent)
+
+    return total
@@ -1,8 +1,21 @@
 #!/usr/bin/env python
+import json
+import logging
+
 import webapp2
 from google.appengine.api import app_identity
-from google.appengine.api import mail
 from conference import ConferenceApi
+from caching import CACHES, flights, local, stats
+from idempotency import purgeExpired
+from instrumentation import getStats
+from jobs import jobReport, runBatch, startJob
+from leaderboard import buildSnapshot, persistSnapshot, recordFromTask
+from mailer import drainMailQueue
+from migrations import MIGRATIONS
+from reconcile import reconciliation
+from recommendations import finishPass, recommendations
+from startup import profiler
+from sync import purgeTombstones
 
 """
 main.py -- Udacity conference server-side Python App Engine
@@ -25,6 +38,10 @@ class SetAnnouncementHandler(webapp2.RequestHandler):
         ConferenceApi._cacheAnnouncement()
         self.response.set_status(204)
 
+    def post(self):
+        """Set Announcement in Memcache (coalesced task)."""
+        self.get()
+
 
 class SetFeaturedSpeakers(webapp2.RequestHandler):
     def post(self):
@@ -33,9 +50,131 @@ class SetFeaturedSpeakers(webapp2.RequestHandler):
         self.response.set_status(204)
 
 
+class BuildAgendaHandler(webapp2.RequestHandler):
+    def post(self):
+        """Rebuild a Conference's stored agenda (coalesced task)."""
+        ConferenceApi._cacheAgenda(self.request.get('conf'))
+        self.response.set_status(204)
+
+
+class RecordPopularityHandler(webapp2.RequestHandler):
+    def post(self):
+        """Update a changed conference's place in the popular
+        conferences (task)."""
+        recordFromTask(self.request.get('conf'),
+                       self.request.get_all('previous'))
+        self.response.set_status(204)
+
+
+class PersistPopularHandler(webapp2.RequestHandler):
+    def post(self):
+        """Save a scope's popular conferences (coalesced task)."""
+        persistSnapshot(self.request.get('scope'))
+        self.response.set_status(204)
+
+
+class RebuildPopularHandler(webapp2.RequestHandler):
+    def post(self):
+        """Rank a scope's conferences again (coalesced task)."""
+        buildSnapshot(self.request.get('scope'))
+        self.response.set_status(204)
+
+
+class TouchProfileHandler(webapp2.RequestHandler):
+    def post(self):
+        """Re-save a renamed user's conferences & sessions for delta
+        sync (coalesced task)."""
+        ConferenceApi._touchProfile(self.request.get('profile'))
+        self.response.set_status(204)
+
+
+class PromoteWaitlistHandler(webapp2.RequestHandler):
+    def post(self):
+        """Register waitlisted users for freed seats (coalesced task)."""
+        ConferenceApi._promoteWaitlist(self.request.get('conf'))
+        self.response.set_status(204)
+
+
+class PurgeIdempotencyKeysHandler(webapp2.RequestHandler):
+    def get(self):
+        """Delete expired idempotent responses (cron)."""
+        purgeExpired()
+        self.response.set_status(204)
+
+
+class PurgeTombstonesHandler(webapp2.RequestHandler):
+    def get(self):
+        """Delete tombstones older than any sync token still honoured
+        (cron)."""
+        purgeTombstones()
+        self.response.set_status(204)
+
+
+class ReconcileSeatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start a seat reconciliation pass (cron); ?full=1 recounts
+        every conference rather than those changed since the last."""
+        startJob(reconciliation, full=bool(self.request.get('full')))
+        self.response.set_status(204)
+
+    def post(self):
+        """Reconcile one batch of conferences (task)."""
+        runBatch(reconciliation, int(self.request.get('pass')),
+                 int(self.request.get('batch')))
+        self.response.set_status(204)
+
+
+class BuildRecommendationsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start a session recommendations pass (cron)."""
+        startJob(recommendations)
+        self.response.set_status(204)
+
+    def post(self):
+        """Count the wishlists of one batch of profiles (task)."""
+        runBatch(recommendations, int(self.request.get('pass')),
+                 int(self.request.get('batch')))
+        self.response.set_status(204)
+
+
+class FinishRecommendationsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Store the recommendations of a finished pass (task)."""
+        finishPass(int(self.request.get('pass')))
+        self.response.set_status(204)
+
+
+class MigrateHandler(webapp2.RequestHandler):
+    def post(self, name):
+        """Migrate one batch of entities (task)."""
+        if name not in MIGRATIONS:
+            # renamed or removed since the task was added; a 404 would
+            # be retried forever, so acknowledge the task & drop it
+            logging.warning('Dropping task of unknown migration %s', name)
+            self.response.set_status(204)
+            return
+        runBatch(MIGRATIONS[name], int(self.request.get('pass')),
+                 int(self.request.get('batch')))
+        self.response.set_status(204)
+
+
+class SendConfirmationEmailsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Send queued confirmation emails in batches (cron)."""
+        drainMailQueue()
+        self.response.set_status(204)
+
+    def post(self):
+        """Send queued confirmation emails in batches (task)."""
+        self.get()
+
+
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
     def post(self):
-        """Send email confirming Conference creation."""
+        """Send email confirming Conference creation; only serves tasks
+        enqueued before confirmation emails moved to the pull queue."""
+        # legacy path; don't pay for importing mail on every instance
+        from google.appengine.api import mail
         mail.send_mail(
             'noreply@%s.appspotmail.com' % (
                 app_identity.get_application_id()),     # from
@@ -47,8 +186,106 @@ class SendConfirmationEmailHandler(webapp2.RequestHandler):
         )
 
 
+class WarmupHandler(webapp2.RequestHandler):
+    def get(self):
+        """Prime a new instance (App Engine warmup request)."""
+        # the app is imported by now; stop the import profiler
+        profiler.finish()
+        timings = ConferenceApi._warmup()
+        logging.info('warmup: %s\n%s', ', '.join(
+            '%s %dms' % timing for timing in timings),
+            profiler.formatReport())
+        self.response.set_status(200)
+
+
+class StartupProfileHandler(webapp2.RequestHandler):
+    def get(self):
+        """Report this instance's startup import profile (admin only);
+        stops the profiler if no warmup request has."""
+        profiler.finish()
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(
+            json.dumps(profiler.report(), indent=2, sort_keys=True))
+
+
+class EndpointStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Report per-method latency & RPC stats (admin only)."""
+        report = getStats(ConferenceApi.all_remote_methods().keys())
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(report, indent=2, sort_keys=True))
+
+
+class JobsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Report batch job checkpoints (admin only)."""
+        report = dict((job.name, jobReport(job.name)) for job in JOBS)
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(report, indent=2, sort_keys=True))
+
+
+class MigrationsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Report the progress of every migration (admin only)."""
+        report = dict(
+            (name, m.progress()) for name, m in MIGRATIONS.items())
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(report, indent=2, sort_keys=True))
+
+    def post(self):
+        """Start (or resume) the migration named by ?name= (admin
+        only)."""
+        name = self.request.get('name')
+        if name not in MIGRATIONS:
+            self.abort(404)
+        passId = startJob(MIGRATIONS[name])
+        self.response.headers['Content-Type'] = 'application/json'
+        if passId is None:
+            self.response.set_status(409)  # already running
+        else:
+            self.response.set_status(202)
+        self.response.write(json.dumps({'name': name, 'pass': passId}))
+
+
+class CacheStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Report cache hit/miss counts (admin only); local counts are
+        this instance's only."""
+        report = stats.report(CACHES)
+        report['local'] = local.report()
+        report['singleflight'] = flights.report()
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(report, indent=2, sort_keys=True))
+
+
+# batch jobs reported by /admin/jobs
+JOBS = (reconciliation, recommendations)
+
 app = webapp2.WSGIApplication([
+    ('/_ah/warmup', WarmupHandler),
+    ('/admin/cache_stats', CacheStatsHandler),
+    ('/admin/jobs', JobsHandler),
+    ('/admin/migrations', MigrationsHandler),
+    ('/admin/startup', StartupProfileHandler),
+    ('/admin/stats', EndpointStatsHandler),
+    ('/crons/build_recommendations', BuildRecommendationsHandler),
+    ('/crons/purge_idempotency_keys', PurgeIdempotencyKeysHandler),
+    ('/crons/purge_tombstones', PurgeTombstonesHandler),
+    ('/crons/reconcile_seats', ReconcileSeatsHandler),
+    ('/crons/send_confirmation_emails', SendConfirmationEmailsHandler),
     ('/crons/set_announcement', SetAnnouncementHandler),
+    ('/tasks/build_agenda', BuildAgendaHandler),
+    ('/tasks/build_recommendations', BuildRecommendationsHandler),
+    ('/tasks/build_recommendations/finish', FinishRecommendationsHandler),
+    (r'/tasks/migrate/(\w+)', MigrateHandler),
+    ('/tasks/popular/persist', PersistPopularHandler),
+    ('/tasks/popular/rebuild', RebuildPopularHandler),
+    ('/tasks/popular/record', RecordPopularityHandler),
+    ('/tasks/promote_waitlist', PromoteWaitlistHandler),
+    ('/tasks/reconcile_seats', ReconcileSeatsHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
-    ('/tasks/set_featured_speakers', SetFeaturedSpeakers)
+    ('/tasks/send_confirmation_emails', SendConfirmationEmailsHandler),
+    ('/tasks/set_announcement', SetAnnouncementHandler),
+    ('/tasks/set_featured_speakers', SetFeaturedSpeakers),
+    ('/tasks/touch_profile', TouchProfileHandler)
 ], debug=True)
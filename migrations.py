@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+from collections import OrderedDict
+from datetime import datetime
+
+from google.appengine.ext import ndb
+
+from caching import CONFERENCE_GENERATION, bumpGeneration
+from jobs import BatchJob, checkpointKey, jobReport
+from models import Conference
+
+"""migrations.py
+
+Conference Central data migrations
+
+A migration is a small function declared with @migration: it gets a
+batch of entities of one kind and returns those it changed, which are
+then written with one put_multi. Migrations run as resumable BatchJobs
+(see jobs.py): started from /admin/migrations, one task per batch
+(/tasks/migrate/<name>), checkpointed after every batch and throttled
+to a target write rate. A migration can be run again, so its function
+must be idempotent: an entity that's already migrated comes back
+unchanged.
+
+    @migration('backfill_something', Conference)
+    def backfillSomething(conferences):
+        changed = []
+        for conf in conferences:
+            ...
+        return changed
+
+"""
+
+
+MIGRATION_BATCH_SIZE = 100  # entities per batch (and put_multi)
+MIGRATION_WRITE_RATE = 50  # target entity writes per second
+MIGRATION_URL = '/tasks/migrate/%s'
+
+# name -> Migration, in declaration order
+MIGRATIONS = OrderedDict()
+
+
+class Migration(BatchJob):
+    """Migration -- a BatchJob applying a function to every entity of
+    a kind, ordered by key"""
+
+    def __init__(self, name, model, func, batchSize, writeRate,
+                 generation=None):
+        self.name = name
+        self.url = MIGRATION_URL % name
+        self.model = model
+        self.func = func
+        self.batchSize = batchSize
+        self.writeRate = writeRate
+        self.generation = generation  # cached data to invalidate
+
+    def query(self, checkpoint):
+        return self.model.query().order(self.model.key)
+
+    def process(self, entities, checkpoint):
+        changed = self.func(entities) or []
+        if changed:
+            ndb.put_multi(changed)
+            if self.generation:
+                bumpGeneration(self.generation)
+        return len(changed), []
+
+    def delay(self, changed, elapsed):
+        # spread the writes out to writeRate per second
+        return max(changed / float(self.writeRate) - elapsed, 0)
+
+    def endPass(self, checkpoint):
+        pass
+
+    def progress(self):
+        """Return the checkpoint plus the current rate (entities per
+        second) of the migration."""
+        report = jobReport(self.name) or {'running': False}
+        report['kind'] = self.model._get_kind()
+        report['writeRate'] = self.writeRate
+        cp = checkpointKey(self.name).get()
+        if cp and cp.started:
+            end = datetime.now() if cp.running else cp.finished
+            seconds = (end - cp.started).total_seconds()
+            if seconds > 0:
+                report['entitiesPerSecond'] = round(
+                    cp.processed / seconds, 1)
+        return report
+
+
+def migration(name, model, batchSize=MIGRATION_BATCH_SIZE,
+              writeRate=MIGRATION_WRITE_RATE, generation=None):
+    """Declare a migration of every `model` entity; the decorated
+    function gets a list of entities and returns those it changed.
+    generation names cached data (see caching.py) the migration makes
+    stale."""
+    def register(func):
+        MIGRATIONS[name] = Migration(
+            name, model, func, batchSize, writeRate, generation)
+        return func
+    return register
+
+
+# - - - Migrations - - - - - - - - - - - - - - - - - - - - - - -
+
+@migration('backfill_conference_month', Conference,
+           generation=CONFERENCE_GENERATION)
+def backfillConferenceMonth(conferences):
+    """Set month from startDate (0 without one, as createConference
+    does); Conferences created before month was added lack it. Saving
+    also sets modified, which incremental seat reconciliation passes
+    rely on."""
+    changed = []
+    for conf in conferences:
+        month = conf.startDate.month if conf.startDate else 0
+        if conf.month != month or conf.modified is None:
+            conf.month = month
+            conf.version += 1  # ConferenceForm etags
+            changed.append(conf)
+    return changed
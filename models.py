@@ -25,6 +25,12 @@ class ConflictException(endpoints.ServiceException):
     http_status = httplib.CONFLICT
 
 
+class NotModifiedException(endpoints.ServiceException):
+    """NotModifiedException -- the client's copy is current; mapped to
+    HTTP 412 because Endpoints v1 turns a 304 into an error"""
+    http_status = httplib.PRECONDITION_FAILED
+
+
 class Profile(ndb.Model):
     """Profile -- User profile object"""
     displayName = ndb.StringProperty()
@@ -34,6 +40,14 @@ class Profile(ndb.Model):
     sessionWishList = ndb.StringProperty(repeated=True)
 
 
+class IdempotentResponse(ndb.Model):
+    """IdempotentResponse -- stored response of a mutating API call,
+    keyed by user, method & client-supplied idempotency key"""
+    method = ndb.StringProperty(indexed=False)
+    response = ndb.BlobProperty()  # protobuf-encoded response message
+    expires = ndb.DateTimeProperty()
+
+
 class ProfileMiniForm(messages.Message):
     """ProfileMiniForm -- update Profile form message"""
     displayName = messages.StringField(1)
@@ -57,6 +71,7 @@ class ProfileForms(messages.Message):
 class StringMessage(messages.Message):
     """StringMessage-- outbound (single) string message"""
     data = messages.StringField(1, required=True)
+    etag = messages.StringField(2)
 
 
 class BooleanMessage(messages.Message):
@@ -64,6 +79,20 @@ class BooleanMessage(messages.Message):
     data = messages.BooleanField(1)
 
 
+class QueryStageForm(messages.Message):
+    """QueryStageForm -- one step of a query plan outbound form message"""
+    stage = messages.StringField(1)  # filter, intersect, get_multi, ...
+    description = messages.StringField(2)
+    resultCount = messages.IntegerField(3, variant=messages.Variant.INT32)
+    elapsedMs = messages.FloatField(4)
+
+
+class QueryPlanForm(messages.Message):
+    """QueryPlanForm -- query plan ("explain") outbound form message"""
+    stages = messages.MessageField(QueryStageForm, 1, repeated=True)
+    totalMs = messages.FloatField(2)
+
+
 class Conference(ndb.Model):
     """Conference -- Conference object"""
     name = ndb.StringProperty(required=True)
@@ -76,6 +105,9 @@ class Conference(ndb.Model):
     endDate = ndb.DateProperty()
     maxAttendees = ndb.IntegerProperty()
     seatsAvailable = ndb.IntegerProperty()
+    version = ndb.IntegerProperty(default=0)  # bumped on every change
+    sessionsVersion = ndb.IntegerProperty(default=0)  # bumped on Sessions
+    modified = ndb.DateTimeProperty(auto_now=True)
 
 
 class ConferenceForm(messages.Message):
@@ -92,11 +124,39 @@ class ConferenceForm(messages.Message):
     endDate = messages.StringField(10)  # DateTimeField()
     websafeKey = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
+    etag = messages.StringField(13)
 
 
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    plan = messages.MessageField(QueryPlanForm, 2)  # only if explain set
+
+
+class PopularConferenceForm(messages.Message):
+    """PopularConferenceForm -- a Conference's place in the popular
+    conferences outbound form message"""
+    websafeKey = messages.StringField(1)
+    name = messages.StringField(2)
+    city = messages.StringField(3)
+    startDate = messages.StringField(4)
+    registered = messages.IntegerField(5, variant=messages.Variant.INT32)
+
+
+class PopularConferenceForms(messages.Message):
+    """PopularConferenceForms -- most registered Conferences outbound
+    form message"""
+    items = messages.MessageField(PopularConferenceForm, 1, repeated=True)
+
+
+class BootstrapForm(messages.Message):
+    """BootstrapForm -- initial page load outbound form message"""
+    profile = messages.MessageField(ProfileForm, 1)
+    announcement = messages.StringField(2)
+    featuredSpeaker = messages.StringField(3)
+    conferencesToAttend = messages.MessageField(
+        ConferenceForm, 4, repeated=True)
+    sessionWishList = messages.StringField(5, repeated=True)
 
 
 class TeeShirtSize(messages.Enum):
@@ -129,6 +189,8 @@ class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm
     inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    explain = messages.BooleanField(2)  # return the query plan as well
+    fields = messages.StringField(3)  # ConferenceForm fields to return
 
 
 class SessionType(messages.Enum):
@@ -150,6 +212,86 @@ class Session(ndb.Model):
     date = ndb.DateProperty(required=True)
     duration = ndb.IntegerProperty()  # length of session in minutes
     startTime = ndb.TimeProperty(required=True)
+    modified = ndb.DateTimeProperty(auto_now=True)
+
+
+class SpeakerIndex(ndb.Model):
+    """SpeakerIndex -- keys of a speaker's Sessions across all
+    Conferences, keyed by the speaker Profile's websafe key"""
+    sessionKeys = ndb.KeyProperty(kind='Session', repeated=True,
+                                  indexed=False)
+    version = ndb.IntegerProperty(default=0, indexed=False)
+    # False until built from a query: it may lack older Sessions
+    complete = ndb.BooleanProperty(default=True, indexed=False)
+    # deleted Sessions; their keys stay put in sessionKeys
+    deletedKeys = ndb.KeyProperty(kind='Session', repeated=True,
+                                  indexed=False)
+
+
+class JobCheckpoint(ndb.Model):
+    """JobCheckpoint -- progress of a resumable batch job, keyed by job
+    name (see jobs.py)"""
+    running = ndb.BooleanProperty(default=False)
+    passId = ndb.IntegerProperty(default=0, indexed=False)
+    batches = ndb.IntegerProperty(default=0, indexed=False)
+    cursor = ndb.StringProperty(indexed=False)  # urlsafe query cursor
+    processed = ndb.IntegerProperty(default=0, indexed=False)
+    changed = ndb.IntegerProperty(default=0, indexed=False)
+    since = ndb.DateTimeProperty(indexed=False)  # pass covers changes
+    until = ndb.DateTimeProperty(indexed=False)  # in (since, until]
+    completedUntil = ndb.DateTimeProperty(indexed=False)
+    started = ndb.DateTimeProperty(indexed=False)
+    finished = ndb.DateTimeProperty(indexed=False)
+    report = ndb.JsonProperty()  # job-specific details of the pass
+    updated = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+
+class CooccurrenceCounts(ndb.Model):
+    """CooccurrenceCounts -- wishlist counts of one Conference's
+    Sessions gathered by a recommendations pass, keyed by pass &
+    conference (see recommendations.py)"""
+    saves = ndb.JsonProperty(compressed=True)  # session ID -> saves
+    pairs = ndb.JsonProperty(compressed=True)  # "id:id" -> saved together
+    batches = ndb.IntegerProperty(repeated=True, indexed=False)  # merged
+
+
+class SessionRecommendations(ndb.Model):
+    """SessionRecommendations -- the Sessions most often wishlisted
+    with a Session, best first, keyed by its websafe key"""
+    sessionKeys = ndb.KeyProperty(kind='Session', repeated=True,
+                                  indexed=False)
+    scores = ndb.FloatProperty(repeated=True, indexed=False)
+    passId = ndb.IntegerProperty()  # of the pass that computed them
+
+
+class PopularConferences(ndb.Model):
+    """PopularConferences -- the last saved snapshot of a scope's most
+    registered Conferences, keyed by scope (see leaderboard.py)"""
+    entries = ndb.JsonProperty(compressed=True)
+    floor = ndb.IntegerProperty(indexed=False)
+    updated = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+
+class WaitlistEntry(ndb.Model):
+    """WaitlistEntry -- a user waiting for a seat at a sold out
+    Conference, keyed by conference & user (see waitlist.py)"""
+    conference = ndb.KeyProperty(kind='Conference', required=True)
+    userId = ndb.StringProperty(required=True)
+    created = ndb.DateTimeProperty(auto_now_add=True)
+
+
+class Tombstone(ndb.Model):
+    """Tombstone -- record of a deleted Conference or Session for
+    getChangesSince, keyed by its websafe key (see sync.py)"""
+    kind = ndb.StringProperty(indexed=False)
+    deleted = ndb.DateTimeProperty(auto_now_add=True)
+
+
+class ConferenceAgenda(ndb.Model):
+    """ConferenceAgenda -- pre-rendered Sessions of a Conference, keyed
+    by the Conference's websafe key (see agenda.py)"""
+    sessionsVersion = ndb.IntegerProperty(indexed=False)
+    forms = ndb.BlobProperty()  # SessionForms packed by caching.packMessage
 
 
 class SessionForm(messages.Message):
@@ -169,6 +311,29 @@ class SessionForm(messages.Message):
 class SessionForms(messages.Message):
     """SessionForms -- multiple Conference Session outbound form messages"""
     items = messages.MessageField(SessionForm, 1, repeated=True)
+    plan = messages.MessageField(QueryPlanForm, 2)  # only if explain set
+    etag = messages.StringField(3)
+
+
+class SpeakerProfileForm(messages.Message):
+    """SpeakerProfileForm -- speaker & one page of their Sessions
+    outbound form message"""
+    displayName = messages.StringField(1)
+    websafeKey = messages.StringField(2)
+    sessions = messages.MessageField(SessionForm, 3, repeated=True)
+    totalSessions = messages.IntegerField(4, variant=messages.Variant.INT32)
+    nextCursor = messages.StringField(5)  # absent on the last page
+
+
+class ChangesForm(messages.Message):
+    """ChangesForm -- one page of Conference & Session changes
+    outbound form message"""
+    conferences = messages.MessageField(ConferenceForm, 1, repeated=True)
+    sessions = messages.MessageField(SessionForm, 2, repeated=True)
+    deleted = messages.StringField(3, repeated=True)  # websafe keys
+    nextCursor = messages.StringField(4)  # absent on the last page
+    syncToken = messages.StringField(5)  # only on the last page
+    fullSync = messages.BooleanField(6)  # replace, don't merge, local data
 
 
 class SessionQueryForm(messages.Message):
@@ -183,3 +348,5 @@ class SessionQueryForms(messages.Message):
     inbound form messages"""
     websafeConferenceKey = messages.StringField(1)
     filters = messages.MessageField(SessionQueryForm, 2, repeated=True)
+    explain = messages.BooleanField(3)  # return the query plan as well
+    fields = messages.StringField(4)  # SessionForm fields to return
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+import json
+import logging
+import random
+import time
+
+from models import QueryPlanForm, QueryStageForm
+from settings import SLOW_QUERY_THRESHOLD_MS, SLOW_QUERY_LOG_SAMPLE_RATE
+
+"""queryplan.py
+
+Conference Central query plan ("explain") & slow query log
+
+_getQuery and _getSessionQuery run one keys-only query per filter and
+intersect the results before a get_multi; a QueryPlan records the key
+count and timing of each of those steps so it can be returned to the
+client (explain mode) or logged when the query is slow.
+
+"""
+
+
+class QueryPlan(object):
+    """QueryPlan -- per-stage result counts & timings of one query"""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.stages = []
+        self.started = time.time()
+
+    def record(self, stage, description, resultCount, started):
+        """Record a stage that began at time.time() == started."""
+        self.stages.append({
+            'stage': stage,
+            'description': description,
+            'resultCount': resultCount,
+            'elapsedMs': (time.time() - started) * 1000,
+        })
+
+    @property
+    def totalMs(self):
+        return (time.time() - self.started) * 1000
+
+    def toForm(self):
+        """Return the plan as a QueryPlanForm."""
+        return QueryPlanForm(
+            stages=[QueryStageForm(**s) for s in self.stages],
+            totalMs=self.totalMs
+        )
+
+    def logIfSlow(self):
+        """Write a sampled structured log record for a slow query."""
+        total = self.totalMs
+        if total < SLOW_QUERY_THRESHOLD_MS:
+            return False
+        if random.random() >= SLOW_QUERY_LOG_SAMPLE_RATE:
+            return False
+        logging.warning('slow query: %s', json.dumps({
+            'kind': self.kind,
+            'totalMs': total,
+            'thresholdMs': SLOW_QUERY_THRESHOLD_MS,
+            'stages': self.stages,
+        }, sort_keys=True))
+        return True
+
+
+def describeFilter(filtr):
+    """Return a readable description of a formatted filter dict."""
+    return '%s %s %s' % (filtr['field'], filtr['operator'], filtr['value'])
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+import heapq
+import math
+from collections import defaultdict
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from jobs import JOB_QUEUE, BatchJob, checkpointKey
+from models import CooccurrenceCounts, Profile, SessionRecommendations
+
+"""recommendations.py
+
+Conference Central session recommendations
+
+"People who saved this also saved": a nightly batch job walks every
+Profile's wishlist and counts, per Conference, how often each pair of
+its Sessions was saved by the same user. Each batch counts its
+wishlists as the Gram matrix of a users x sessions incidence matrix
+(NumPy) and merges the result into a CooccurrenceCounts entity per
+conference. When the pass is done, a finishing task scores each pair
+(cosine: saved together / sqrt(saves of one * saves of the other)) and
+stores the top RECOMMEND_TOP_K Sessions of every Session in a
+SessionRecommendations entity, which getRecommendedSessions serves with
+one get and one get_multi.
+
+"""
+
+
+RECOMMEND_TOP_K = 10
+RECOMMEND_MIN_COUNT = 2  # users who saved both before a pair counts
+RECOMMEND_BATCH_SIZE = 200  # Profiles per batch
+RECOMMEND_FINISH_URL = '/tasks/build_recommendations/finish'
+
+
+def recommendationsKey(sessionKey):
+    """Return the key of a Session's SessionRecommendations."""
+    return ndb.Key(SessionRecommendations, sessionKey.urlsafe())
+
+
+def _countsKey(passId, wsck):
+    return ndb.Key(CooccurrenceCounts, '%d:%s' % (passId, wsck))
+
+
+def countCooccurrence(rows):
+    """Count a list of rows, each the set of Session IDs one user saved
+    in a Conference; return ({id: saves}, {(id, id): saved together})
+    with the pairs' lower ID first."""
+    import numpy  # only the batch job needs it
+    ids = sorted(set(sid for row in rows for sid in row))
+    column = dict((sid, n) for n, sid in enumerate(ids))
+    incidence = numpy.zeros((len(rows), len(ids)), dtype=numpy.int32)
+    for r, row in enumerate(rows):
+        incidence[r, [column[sid] for sid in row]] = 1
+    # entry (i, j): users who saved both i & j; diagonal: saves of i
+    gram = incidence.T.dot(incidence)
+    saves = dict((sid, int(gram[n, n])) for n, sid in enumerate(ids))
+    first, second = numpy.nonzero(numpy.triu(gram, 1))
+    pairs = dict(((ids[i], ids[j]), int(gram[i, j]))
+                 for i, j in zip(first, second))
+    return saves, pairs
+
+
+@ndb.transactional()
+def _mergeCounts(passId, batch, wsck, saves, pairs):
+    """Add a batch's counts to the pass's counts of a Conference,
+    unless that batch was merged already (a re-run task)."""
+    key = _countsKey(passId, wsck)
+    counts = key.get() or CooccurrenceCounts(
+        key=key, saves={}, pairs={}, batches=[])
+    if batch in counts.batches:
+        return
+    for sid, n in saves.items():
+        counts.saves[str(sid)] = counts.saves.get(str(sid), 0) + n
+    for (a, b), n in pairs.items():
+        pair = '%s:%s' % (a, b)
+        counts.pairs[pair] = counts.pairs.get(pair, 0) + n
+    counts.batches.append(batch)
+    counts.put()
+
+
+class Recommendations(BatchJob):
+    """Recommendations -- count wishlist co-occurrence of Sessions"""
+
+    name = 'build_recommendations'
+    url = '/tasks/build_recommendations'
+    batchSize = RECOMMEND_BATCH_SIZE
+
+    def query(self, checkpoint):
+        return Profile.query().order(Profile.key)
+
+    def process(self, profiles, checkpoint):
+        rows = defaultdict(list)  # websafe conference key -> rows
+        for prof in profiles:
+            saved = defaultdict(set)
+            for wssk in prof.sessionWishList:
+                s_key = ndb.Key(urlsafe=wssk)
+                saved[s_key.parent().urlsafe()].add(s_key.id())
+            for wsck, ids in saved.items():
+                rows[wsck].append(ids)
+        for wsck, conf_rows in rows.items():
+            saves, pairs = countCooccurrence(conf_rows)
+            _mergeCounts(checkpoint.passId, checkpoint.batches, wsck,
+                         saves, pairs)
+        # the notes are the conferences to finish at the end
+        return len(rows), rows.keys()
+
+    def addNotes(self, checkpoint, notes):
+        report = checkpoint.report or {}
+        conferences = set(report.get('conferences', []))
+        conferences.update(notes)
+        report['conferences'] = sorted(conferences)
+        checkpoint.report = report
+
+    def endPass(self, checkpoint):
+        taskqueue.add(
+            url=RECOMMEND_FINISH_URL,
+            params={'pass': checkpoint.passId},
+            queue_name=JOB_QUEUE,
+            transactional=True
+        )
+
+
+def topRecommendations(confKey, counts, passId):
+    """Return SessionRecommendations for the Sessions of a Conference
+    from the pass's counts."""
+    neighbours = defaultdict(list)
+    for pair, together in counts.pairs.items():
+        if together < RECOMMEND_MIN_COUNT:
+            continue
+        a, b = pair.split(':')
+        score = together / math.sqrt(counts.saves[a] * counts.saves[b])
+        neighbours[a].append((score, together, b))
+        neighbours[b].append((score, together, a))
+
+    def sessionKey(sid):
+        return ndb.Key('Session', int(sid), parent=confKey)
+
+    recommendations = []
+    for sid, scored in neighbours.items():
+        top = heapq.nlargest(RECOMMEND_TOP_K, scored)
+        recommendations.append(SessionRecommendations(
+            key=recommendationsKey(sessionKey(sid)),
+            sessionKeys=[sessionKey(other) for _, _, other in top],
+            scores=[round(s, 4) for s, _, _ in top],
+            passId=passId
+        ))
+    return recommendations
+
+
+def finishPass(passId, batch_size=500):
+    """Store the recommendations of a finished pass & drop those of
+    Sessions it found none for (task); safe to re-run."""
+    cp = checkpointKey(Recommendations.name).get()
+    if cp is None or cp.running or cp.passId != passId:
+        return False
+    for wsck in (cp.report or {}).get('conferences', []):
+        key = _countsKey(passId, wsck)
+        counts = key.get()
+        if counts is None:
+            continue  # finished by an earlier run of this task
+        ndb.put_multi(topRecommendations(
+            ndb.Key(urlsafe=wsck), counts, passId))
+        key.delete()
+
+    # the query is eventually consistent, so check each entity's pass
+    # with a get before deleting it
+    q = SessionRecommendations.query(
+        SessionRecommendations.passId < passId)
+    cursor, more = None, True
+    while more:
+        keys, cursor, more = q.fetch_page(
+            batch_size, start_cursor=cursor, keys_only=True)
+        stale = [r.key for r in ndb.get_multi(keys)
+                 if r and r.passId < passId]
+        ndb.delete_multi(stale)
+    return True
+
+
+recommendations = Recommendations()
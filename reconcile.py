@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+import logging
+from datetime import datetime, timedelta
+
+from google.appengine.ext import ndb
+
+from caching import CONFERENCE_GENERATION, bumpGeneration
+from jobs import BatchJob
+from leaderboard import schedulePopularity
+from models import Conference, Profile
+from tasks import enqueueCoalesced
+from waitlist import schedulePromotion
+
+"""reconcile.py
+
+Conference Central seat inventory reconciliation
+
+seatsAvailable is kept up to date by += 1 / -= 1 on registration, and
+can be overwritten through updateConference, so it drifts. This job
+recounts the registrations (Profiles listing the conference) of each
+Conference, sets seatsAvailable to maxAttendees minus that count and
+reports the discrepancies it fixed. The first pass covers every
+Conference; after that a pass only covers Conferences modified since
+the previous one. Conferences modified in the last
+RECONCILE_SETTLE_TIME are left for the next pass, because the
+registration count is an eventually consistent query.
+
+"""
+
+
+RECONCILE_SETTLE_TIME = timedelta(minutes=2)
+RECONCILE_MAX_REPORTED = 100  # discrepancies kept in the checkpoint
+
+
+@ndb.transactional()
+def _fixSeats(c_key, version, seats):
+    """Set seatsAvailable unless the Conference changed since it was
+    counted (that change brings it into the next pass); return the
+    previous value, or None if nothing was written."""
+    conf = c_key.get()
+    if conf is None or conf.version != version:
+        return None
+    previous = conf.seatsAvailable
+    conf.seatsAvailable = seats
+    conf.version += 1
+    conf.put()
+    schedulePopularity(conf)  # the registration count changed
+    return previous
+
+
+class SeatReconciliation(BatchJob):
+    """SeatReconciliation -- recount registrations, fix seatsAvailable"""
+
+    name = 'reconcile_seats'
+    url = '/tasks/reconcile_seats'
+
+    def beginPass(self, checkpoint, full=False):
+        checkpoint.since = None if full else checkpoint.completedUntil
+        checkpoint.until = datetime.now() - RECONCILE_SETTLE_TIME
+
+    def query(self, checkpoint):
+        if checkpoint.since is None:
+            # Conferences saved before `modified` existed aren't in
+            # its index, so a full pass walks them by key
+            return Conference.query().order(Conference.key)
+        return Conference.query(
+            Conference.modified > checkpoint.since,
+            Conference.modified <= checkpoint.until
+        ).order(Conference.modified)
+
+    def process(self, conferences, checkpoint):
+        notes = []
+        freed = []
+        for conf in conferences:
+            if conf.modified and conf.modified > checkpoint.until:
+                continue  # still settling; the next pass covers it
+            wsck = conf.key.urlsafe()
+            registered = Profile.query(
+                Profile.conferenceKeysToAttend == wsck).count()
+            seats = max((conf.maxAttendees or 0) - registered, 0)
+            if conf.seatsAvailable == seats:
+                continue
+            previous = _fixSeats(conf.key, conf.version, seats)
+            if previous is None:
+                continue
+            logging.warning(
+                'Conference %s (%s): seatsAvailable was %s, %d '
+                'registered of %s; set to %d', wsck, conf.name,
+                previous, registered, conf.maxAttendees, seats)
+            notes.append({
+                'conference': wsck,
+                'name': conf.name,
+                'seatsAvailable': previous,
+                'registered': registered,
+                'maxAttendees': conf.maxAttendees,
+                'fixedTo': seats,
+            })
+            if seats > (previous or 0):
+                freed.append(conf.key)
+
+        if notes:
+            # cached ConferenceForms & the announcement show seats
+            bumpGeneration(CONFERENCE_GENERATION)
+            enqueueCoalesced('/tasks/set_announcement',
+                             bucket='announcement')
+        for c_key in freed:
+            schedulePromotion(c_key)
+        return len(notes), notes
+
+    def addNotes(self, checkpoint, notes):
+        report = checkpoint.report or {}
+        reported = report.setdefault('discrepancies', [])
+        reported.extend(notes[:RECONCILE_MAX_REPORTED - len(reported)])
+        report['truncated'] = (
+            checkpoint.changed > RECONCILE_MAX_REPORTED)
+        checkpoint.report = report
+
+
+reconciliation = SeatReconciliation()
@@ -17,3 +17,19 @@ WEB_CLIENT_ID = ('replace with Web client ID')
 ANDROID_CLIENT_ID = 'replace with Android client ID'
 IOS_CLIENT_ID = 'replace with iOS client ID'
 ANDROID_AUDIENCE = WEB_CLIENT_ID
+
+# Conference/Session queries slower than this (in milliseconds) have
+# their query plan logged; only a sample of them is logged to keep the
+# log volume down.
+SLOW_QUERY_THRESHOLD_MS = 500
+SLOW_QUERY_LOG_SAMPLE_RATE = 0.1
+
+# Storage backend used by ConferenceApi (see storage.py); 'sqlite' is
+# for local benchmarking only.
+STORAGE_BACKEND = 'ndb'
+
+# Time the imports of new instances (see startup.py) in production as
+# well as on the dev_appserver, where it's always on. The profiler
+# hooks every import until the warmup request, so leave this off
+# unless investigating startup latency.
+PROFILE_STARTUP_IMPORTS = False
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+import base64
+
+from google.appengine.ext import ndb
+
+from caching import flights
+from models import Session, SpeakerIndex
+
+"""speakers.py
+
+Conference Central speaker index
+
+A SpeakerIndex lists the keys of a speaker's Sessions in every
+Conference, so a speaker page is one get_multi rather than a query
+across all Sessions. Session writes append to the index in the same
+transaction, creating it if the speaker has none yet; an index created
+that way is marked incomplete, as the speaker may have older Sessions.
+A missing or incomplete index is completed from a query the first time
+it's read (by one request; concurrent readers wait for it), and from
+then on kept up to date by writes. A written key is never left to the
+eventually consistent query. New keys are only ever appended and a
+deleted Session's key stays where it is (pages skip it), which keeps
+offset-based page cursors stable while Sessions come and go. Every
+change bumps the index version, which cached speaker pages are keyed
+on.
+
+"""
+
+
+# speaker's websafe key, index version, offset, limit
+MEMCACHE_SPEAKER_PAGE_KEY = 'SPEAKER_PAGE:%s:%d:%d:%d'
+SPEAKER_PAGE_CACHE_TIME = 60 * 60  # seconds
+SPEAKER_PAGE_SIZE = 20
+SPEAKER_PAGE_MAX = 100
+SPEAKER_INDEX_FILL_KEY = 'SPEAKER_INDEX:%s'  # singleflight key
+
+
+def indexKey(speakerKey):
+    """Return the key of a speaker's SpeakerIndex."""
+    return ndb.Key(SpeakerIndex, speakerKey.urlsafe())
+
+
+def addToIndex(speakerKey, sessionKey):
+    """Append a Session to its speaker's index, creating the index
+    (incomplete) if there is none; call inside the transaction that
+    writes the Session (xg)."""
+    index = indexKey(speakerKey).get()
+    if index is None:
+        # the query may not see this Session yet, so don't leave it
+        # to the build
+        index = SpeakerIndex(key=indexKey(speakerKey), sessionKeys=[],
+                             complete=False)
+    if sessionKey not in index.sessionKeys:
+        index.sessionKeys.append(sessionKey)
+        index.version += 1
+        index.put()
+
+
+def markDeleted(speakerKey, sessionKey):
+    """Record a deleted Session in its speaker's index, leaving its key
+    in place so later keys keep their offsets; call inside the
+    transaction that deletes the Session (xg)."""
+    index = indexKey(speakerKey).get()
+    if index is None:
+        # keep the build from adding it back from a stale query
+        index = SpeakerIndex(key=indexKey(speakerKey), sessionKeys=[],
+                             complete=False)
+    if sessionKey not in index.deletedKeys:
+        index.deletedKeys.append(sessionKey)
+        index.version += 1
+        index.put()
+
+
+def sessionCount(index):
+    """Return the number of a speaker's Sessions that still exist."""
+    deleted = set(index.deletedKeys)
+    return len([k for k in index.sessionKeys if k not in deleted])
+
+
+@ndb.transactional()
+def touchIndex(speakerKey):
+    """Bump the index version, retiring cached pages (e.g. after the
+    speaker's display name changed)."""
+    index = indexKey(speakerKey).get()
+    if index is not None:
+        index.version += 1
+        index.put()
+
+
+@ndb.transactional()
+def _mergeIndex(speakerKey, sessionKeys):
+    """Complete the index with queried keys, keeping any that writes
+    appended."""
+    index = indexKey(speakerKey).get()
+    if index is None:
+        index = SpeakerIndex(key=indexKey(speakerKey), sessionKeys=[])
+    known = set(index.sessionKeys) | set(index.deletedKeys)
+    added = [k for k in sessionKeys if k not in known]
+    if added:
+        index.sessionKeys = added + index.sessionKeys
+        index.version += 1
+    index.complete = True
+    index.put()
+    return index
+
+
+def _buildIndex(speakerKey):
+    keys = Session.query(Session.speaker == speakerKey).order(
+        Session.key).fetch(keys_only=True)
+    return _mergeIndex(speakerKey, keys)
+
+
+def buildIndex(speakerKey):
+    """Complete a speaker's SpeakerIndex from their Sessions, unless
+    another request is already doing so; return it."""
+    return flights.fill(
+        SPEAKER_INDEX_FILL_KEY % speakerKey.urlsafe(),
+        lambda: _completeIndex(indexKey(speakerKey).get()),
+        lambda: _buildIndex(speakerKey)
+    )
+
+
+def _completeIndex(index):
+    return index if index is not None and index.complete else None
+
+
+def getIndex(speakerKey):
+    """Return a speaker's SpeakerIndex, building it if needed."""
+    return _completeIndex(indexKey(speakerKey).get()) or \
+        buildIndex(speakerKey)
+
+
+def encodeCursor(offset):
+    return base64.urlsafe_b64encode(str(offset))
+
+
+def decodeCursor(cursor):
+    """Return the offset encoded in a page cursor (0 if none); raise
+    ValueError if the cursor is invalid."""
+    if not cursor:
+        return 0
+    try:
+        offset = int(base64.urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor: %s' % cursor)
+    if offset < 0:
+        raise ValueError('Invalid cursor: %s' % cursor)
+    return offset
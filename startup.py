@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+import __builtin__
+import sys
+import threading
+import time
+
+"""startup.py
+Conference Central instance startup (import) profiler
+
+appengine_config.py installs an ImportProfiler (on the dev_appserver,
+or when settings.PROFILE_STARTUP_IMPORTS is on) before the runtime
+imports main.py or conference.py, so the first imports on a new
+instance are timed: per module, the cumulative time (including the
+modules it imported) and its own time. The warmup handler stops
+profiling and logs the report; /admin/startup returns it as JSON.
+
+The profile can also be taken outside App Engine, with the SDK on
+the path:
+
+    python startup.py --sdk /path/to/google_appengine [module ...]
+
+Keep this module free of heavy imports; it is loaded first.
+
+"""
+
+
+REPORT_SIZE = 30  # slowest modules listed in the report
+
+
+class ImportProfiler(object):
+    """ImportProfiler -- times first imports via an __import__ hook"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._original = None
+        self.started = None
+        self.finished = None
+        # module name -> [cumulative seconds, own seconds]
+        self.modules = {}
+
+    def install(self):
+        """Start timing imports; a no-op if already installed."""
+        with self._lock:
+            if self._original is not None:
+                return
+            self._original = __builtin__.__import__
+            self.started = time.time()
+            __builtin__.__import__ = self._import
+
+    def finish(self):
+        """Stop timing imports; safe to call more than once."""
+        with self._lock:
+            if self._original is None:
+                return
+            __builtin__.__import__ = self._original
+            self._original = None
+            self.finished = time.time()
+
+    def _import(self, name, *args, **kwargs):
+        original = self._original or __builtin__.__import__
+        fromlist = args[2] if len(args) > 2 else kwargs.get('fromlist')
+        # only the first import of a module costs anything
+        if name in sys.modules and not fromlist:
+            return original(name, *args, **kwargs)
+
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(0.0)  # time spent in nested imports
+        started = time.time()
+        try:
+            return original(name, *args, **kwargs)
+        finally:
+            elapsed = time.time() - started
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            if name not in self.modules or elapsed > self.modules[name][0]:
+                self.modules[name] = [elapsed, elapsed - nested]
+
+    def report(self, size=REPORT_SIZE):
+        """Return the total import time and the slowest modules."""
+        rows = sorted(self.modules.items(), key=lambda item: -item[1][0])
+        end = self.finished or time.time()
+        return {
+            'totalMs': int((end - self.started) * 1000)
+            if self.started else 0,
+            'finished': self.finished is not None,
+            'modules': [{
+                'module': name,
+                'cumulativeMs': round(cumulative * 1000, 1),
+                'ownMs': round(own * 1000, 1),
+            } for name, (cumulative, own) in rows[:size]],
+        }
+
+    def formatReport(self, size=REPORT_SIZE):
+        """Return the report as a text table (for the log)."""
+        report = self.report(size)
+        lines = ['startup imports: %dms' % report['totalMs'],
+                 '%10s %10s  %s' % ('cum. ms', 'own ms', 'module')]
+        for row in report['modules']:
+            lines.append('%10.1f %10.1f  %s' % (
+                row['cumulativeMs'], row['ownMs'], row['module']))
+        return '\n'.join(lines)
+
+
+profiler = ImportProfiler()
+
+
+def main(argv):
+    if len(argv) > 1 and argv[0] == '--sdk':
+        sys.path.insert(0, argv[1])
+        import dev_appserver
+        dev_appserver.fix_sys_path()
+        argv = argv[2:]
+    profiler.install()
+    for name in argv or ['main', 'conference']:
+        __import__(name)
+    profiler.finish()
+    print profiler.formatReport()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
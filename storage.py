@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+"""storage.py
+
+Conference Central storage (repository) interface
+
+ConferenceApi reads and writes Conferences, Sessions, Profiles,
+registrations and wishlists through a Storage object rather than
+calling ndb directly, so that the same access patterns can be run
+against another backend. Two backends exist:
+
+    ndb     storage_ndb.NdbStorage, the App Engine datastore (default)
+    sqlite  storage_sqlite.SqliteStorage, an indexed in-process SQLite
+            database used by benchmark.py for fast, repeatable
+            throughput tests without the App Engine SDK
+
+The interface deliberately mirrors ndb: backends hand out key objects
+(with urlsafe(), id(), kind() and parent()) and records whose
+attributes are named like the properties in models.py. Registrations
+and wishlists are the conferenceKeysToAttend and sessionWishList
+lists of a Profile record; how they are stored is up to the backend.
+
+Only the core paths are backend-neutral: Conference, Session & Profile
+CRUD, conference & session queries, registrations and wishlists. The
+derived data added on top of them is ndb-only and uses ndb directly:
+speaker indexes (speakers.py), stored agendas (agenda.py), waitlists,
+delta sync, recommendations, the popular conferences leaderboard,
+idempotent responses and the batch jobs. Endpoints built on those
+can't be served by the sqlite backend.
+
+"""
+
+
+BACKENDS = {
+    'ndb': ('storage_ndb', 'NdbStorage'),
+    'sqlite': ('storage_sqlite', 'SqliteStorage'),
+}
+
+
+class Storage(object):
+    """Storage -- repository interface implemented by each backend"""
+
+    # - - - keys & records - - - - - - - - - - - - - - - - - - -
+
+    def key(self, websafeKey):
+        """Return the key object for a websafe key string."""
+        raise NotImplementedError
+
+    def profileKey(self, user_id):
+        """Return the key of the Profile of a user."""
+        raise NotImplementedError
+
+    def get(self, key):
+        """Return the record for a key, or None."""
+        raise NotImplementedError
+
+    def getMulti(self, keys):
+        """Return records for keys, in order (None where missing)."""
+        raise NotImplementedError
+
+    def put(self, record):
+        """Store a record; return its key."""
+        raise NotImplementedError
+
+    def putMulti(self, records):
+        """Store several records; return their keys."""
+        raise NotImplementedError
+
+    def transaction(self, func, xg=False):
+        """Run func() atomically and return its result."""
+        raise NotImplementedError
+
+    # - - - new records - - - - - - - - - - - - - - - - - - - - -
+
+    def newProfile(self, user_id, **values):
+        """Return a new, unsaved Profile record for a user."""
+        raise NotImplementedError
+
+    def newConference(self, user_id, **values):
+        """Return a new, unsaved Conference record (with a fresh key)
+        organised by a user."""
+        raise NotImplementedError
+
+    def newSession(self, confKey, **values):
+        """Return a new, unsaved Session record (with a fresh key)
+        belonging to a Conference."""
+        raise NotImplementedError
+
+    # - - - queries - - - - - - - - - - - - - - - - - - - - - - -
+
+    def allConferences(self):
+        """Return all Conference records."""
+        raise NotImplementedError
+
+    def conferencesByOrganizer(self, user_id):
+        """Return the Conference records created by a user."""
+        raise NotImplementedError
+
+    def conferenceKeysWhere(self, field, operator, value):
+        """Return the keys of Conferences matching one filter, where
+        operator is one of =, !=, <, <=, >, >=."""
+        raise NotImplementedError
+
+    def sessionsForConference(self, confKey, typeOfSession=None,
+                              speakerKey=None):
+        """Return a Conference's Session records, optionally only
+        those of one type (by SessionType name; KeyError if invalid)
+        or one speaker."""
+        raise NotImplementedError
+
+    def sessionKeysWhere(self, confKey, field, operator, value):
+        """Return the keys of a Conference's Sessions matching one
+        filter (typeOfSession only supports = and !=)."""
+        raise NotImplementedError
+
+    def sessionsBySpeaker(self, speakerKey):
+        """Return the Session records of a speaker, across all
+        Conferences."""
+        raise NotImplementedError
+
+    def allProfiles(self):
+        """Return all Profile records."""
+        raise NotImplementedError
+
+
+def getStorage(backend='ndb', **options):
+    """Return a Storage instance for the named backend; the backend
+    module is only imported when it is used."""
+    module_name, class_name = BACKENDS[backend]
+    module = __import__(module_name)
+    return getattr(module, class_name)(**options)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+from google.appengine.ext import ndb
+
+from models import Conference, Profile, Session, SessionType
+from storage import Storage
+
+"""storage_ndb.py
+
+Conference Central App Engine datastore (ndb) storage backend
+
+"""
+
+
+class NdbStorage(Storage):
+    """NdbStorage -- Storage backed by the ndb models in models.py"""
+
+    def key(self, websafeKey):
+        return ndb.Key(urlsafe=websafeKey)
+
+    def profileKey(self, user_id):
+        return ndb.Key(Profile, user_id)
+
+    def get(self, key):
+        return key.get()
+
+    def getMulti(self, keys):
+        return ndb.get_multi(keys)
+
+    def put(self, record):
+        return record.put()
+
+    def putMulti(self, records):
+        return ndb.put_multi(records)
+
+    def transaction(self, func, xg=False):
+        return ndb.transaction(func, xg=xg)
+
+    def newProfile(self, user_id, **values):
+        return Profile(key=self.profileKey(user_id), **values)
+
+    def newConference(self, user_id, **values):
+        p_key = self.profileKey(user_id)
+        c_id = Conference.allocate_ids(size=1, parent=p_key)[0]
+        return Conference(
+            key=ndb.Key(Conference, c_id, parent=p_key),
+            organizerUserId=user_id, **values)
+
+    def newSession(self, confKey, **values):
+        s_id = Session.allocate_ids(size=1, parent=confKey)[0]
+        return Session(key=ndb.Key(Session, s_id, parent=confKey), **values)
+
+    def allConferences(self):
+        return Conference.query().fetch()
+
+    def conferencesByOrganizer(self, user_id):
+        return Conference.query(ancestor=self.profileKey(user_id)).fetch()
+
+    def conferenceKeysWhere(self, field, operator, value):
+        return Conference.query(
+            ndb.query.FilterNode(field, operator, value)
+        ).fetch(keys_only=True)
+
+    def sessionsForConference(self, confKey, typeOfSession=None,
+                              speakerKey=None):
+        q = Session.query(ancestor=confKey)
+        if typeOfSession is not None:
+            q = q.filter(
+                Session.typeOfSession ==
+                SessionType.lookup_by_name(typeOfSession))
+        if speakerKey is not None:
+            q = q.filter(Session.speaker == speakerKey)
+        return q.fetch()
+
+    def sessionKeysWhere(self, confKey, field, operator, value):
+        q = Session.query(ancestor=confKey)
+        if field == 'typeOfSession':
+            # Enum values have to go through the property so they're
+            # converted to what is stored; FilterNode takes raw values
+            node = Session.typeOfSession._comparison(
+                operator, SessionType.lookup_by_name(value))
+        else:
+            node = ndb.query.FilterNode(field, operator, value)
+        return q.filter(node).fetch(keys_only=True)
+
+    def sessionsBySpeaker(self, speakerKey):
+        return Session.query(Session.speaker == speakerKey).fetch()
+
+    def allProfiles(self):
+        return Profile.query().fetch()
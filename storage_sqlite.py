@@ -0,0 +1,447 @@
+#!/usr/bin/env python
+import base64
+import json
+import sqlite3
+import threading
+from datetime import date, datetime, time
+
+from storage import Storage
+
+"""storage_sqlite.py
+
+Conference Central in-process SQLite storage backend
+
+Stores the same data as the ndb models in models.py in indexed SQLite
+tables, so that ConferenceApi's access patterns can be benchmarked
+without the App Engine SDK or its datastore stub (see benchmark.py).
+Repeated properties live in their own tables (topics, registrations,
+wishlists) so that they can be indexed like the datastore does.
+
+"""
+
+
+# mirrors models.SessionType, which needs the App Engine SDK to import
+SESSION_TYPE_NAMES = (
+    'NOT_SPECIFIED', 'Brownbag', 'Keynote', 'Lecture', 'Roundtable',
+    'Workshop',
+)
+
+OPERATORS = ('=', '!=', '<', '<=', '>', '>=')
+
+# per kind: table, scalar columns, how to convert them, and which
+# repeated properties are kept in a child table (table, value column)
+KINDS = {
+    'Profile': {
+        'table': 'profiles',
+        'columns': ('displayName', 'mainEmail', 'teeShirtSize'),
+        'lists': {
+            'conferenceKeysToAttend': ('registrations', 'conference'),
+            'sessionWishList': ('wishlists', 'session'),
+        },
+    },
+    'Conference': {
+        'table': 'conferences',
+        'columns': ('name', 'description', 'organizerUserId', 'city',
+                    'startDate', 'month', 'endDate', 'maxAttendees',
+                    'seatsAvailable', 'version', 'sessionsVersion'),
+        'dates': ('startDate', 'endDate'),
+        'defaults': {'version': 0, 'sessionsVersion': 0},
+        'lists': {
+            'topics': ('conference_topics', 'topic'),
+        },
+    },
+    'Session': {
+        'table': 'sessions',
+        'columns': ('conference', 'name', 'highlights', 'speaker',
+                    'typeOfSession', 'date', 'duration', 'startTime'),
+        'dates': ('date',),
+        'times': ('startTime',),
+        'keys': ('speaker',),
+        'lists': {},
+    },
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS counters (
+    kind TEXT PRIMARY KEY,
+    next INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS profiles (
+    key TEXT PRIMARY KEY,
+    displayName TEXT,
+    mainEmail TEXT,
+    teeShirtSize TEXT
+);
+CREATE TABLE IF NOT EXISTS registrations (
+    owner TEXT NOT NULL,
+    conference TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (owner, conference)
+);
+CREATE INDEX IF NOT EXISTS registrations_conference
+    ON registrations (conference);
+CREATE TABLE IF NOT EXISTS wishlists (
+    owner TEXT NOT NULL,
+    session TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (owner, session)
+);
+CREATE INDEX IF NOT EXISTS wishlists_session ON wishlists (session);
+CREATE TABLE IF NOT EXISTS conferences (
+    key TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    description TEXT,
+    organizerUserId TEXT,
+    city TEXT,
+    startDate TEXT,
+    month INTEGER,
+    endDate TEXT,
+    maxAttendees INTEGER,
+    seatsAvailable INTEGER,
+    version INTEGER,
+    sessionsVersion INTEGER
+);
+CREATE INDEX IF NOT EXISTS conferences_organizer
+    ON conferences (organizerUserId);
+CREATE INDEX IF NOT EXISTS conferences_city ON conferences (city);
+CREATE INDEX IF NOT EXISTS conferences_month ON conferences (month);
+CREATE INDEX IF NOT EXISTS conferences_maxAttendees
+    ON conferences (maxAttendees);
+CREATE INDEX IF NOT EXISTS conferences_seatsAvailable
+    ON conferences (seatsAvailable);
+CREATE TABLE IF NOT EXISTS conference_topics (
+    owner TEXT NOT NULL,
+    topic TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (owner, topic)
+);
+CREATE INDEX IF NOT EXISTS conference_topics_topic
+    ON conference_topics (topic);
+CREATE TABLE IF NOT EXISTS sessions (
+    key TEXT PRIMARY KEY,
+    conference TEXT NOT NULL,
+    name TEXT NOT NULL,
+    highlights TEXT,
+    speaker TEXT,
+    typeOfSession TEXT,
+    date TEXT,
+    duration INTEGER,
+    startTime TEXT
+);
+CREATE INDEX IF NOT EXISTS sessions_type
+    ON sessions (conference, typeOfSession);
+CREATE INDEX IF NOT EXISTS sessions_date ON sessions (conference, date);
+CREATE INDEX IF NOT EXISTS sessions_startTime
+    ON sessions (conference, startTime);
+CREATE INDEX IF NOT EXISTS sessions_duration
+    ON sessions (conference, duration);
+CREATE INDEX IF NOT EXISTS sessions_speaker ON sessions (speaker);
+"""
+
+
+class RecordKey(object):
+    """RecordKey -- ndb.Key look-alike: a path of (kind, id) pairs"""
+
+    def __init__(self, *pairs):
+        self._pairs = tuple(tuple(p) for p in pairs)
+
+    @classmethod
+    def fromUrlsafe(cls, websafeKey):
+        padded = str(websafeKey) + '=' * (-len(websafeKey) % 4)
+        return cls(*json.loads(
+            base64.urlsafe_b64decode(padded).decode('utf-8')))
+
+    def urlsafe(self):
+        return base64.urlsafe_b64encode(
+            json.dumps(self._pairs).encode('utf-8')
+        ).decode('ascii').rstrip('=')
+
+    def kind(self):
+        return self._pairs[-1][0]
+
+    def id(self):
+        return self._pairs[-1][1]
+
+    def parent(self):
+        return RecordKey(*self._pairs[:-1]) if len(self._pairs) > 1 else None
+
+    def pairs(self):
+        return self._pairs
+
+    def __eq__(self, other):
+        return isinstance(other, RecordKey) and self._pairs == other._pairs
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._pairs)
+
+    def __repr__(self):
+        return 'RecordKey%r' % (self._pairs,)
+
+
+class Record(object):
+    """Record -- entity look-alike: a key plus property attributes"""
+
+    def __init__(self, key, **values):
+        self.key = key
+        for name, value in values.items():
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return 'Record(%r)' % (self.key,)
+
+
+class SqliteStorage(Storage):
+    """SqliteStorage -- Storage kept in an (in-memory) SQLite database"""
+
+    def __init__(self, path=':memory:'):
+        self._conn = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False)
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._conn.executescript(SCHEMA)
+
+    # - - - transactions - - - - - - - - - - - - - - - - - - - -
+
+    def transaction(self, func, xg=False):
+        with self._lock:
+            if self._depth == 0:
+                self._conn.execute('BEGIN IMMEDIATE')
+            self._depth += 1
+            try:
+                result = func()
+            except Exception:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._conn.execute('ROLLBACK')
+                raise
+            self._depth -= 1
+            if self._depth == 0:
+                self._conn.execute('COMMIT')
+            return result
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    # - - - value conversion - - - - - - - - - - - - - - - - - -
+
+    @staticmethod
+    def _toDb(field, value):
+        """Convert a property value to what is stored in SQLite."""
+        if isinstance(value, RecordKey):
+            return value.urlsafe()
+        if isinstance(value, datetime):
+            # filters pass times of day as datetimes on 1970-01-01
+            if field == 'startTime':
+                return value.time().isoformat()
+            return value.date().isoformat()
+        if isinstance(value, (date, time)):
+            return value.isoformat()
+        if hasattr(value, 'name') and field == 'typeOfSession':
+            return value.name  # SessionType enum
+        return value
+
+    @staticmethod
+    def _fromDb(kind, field, value):
+        """Convert a stored SQLite value back to a property value."""
+        if value is None:
+            return None
+        spec = KINDS[kind]
+        if field in spec.get('dates', ()):
+            return datetime.strptime(value, '%Y-%m-%d').date()
+        if field in spec.get('times', ()):
+            return datetime.strptime(value[:8], '%H:%M:%S').time()
+        if field in spec.get('keys', ()):
+            return RecordKey.fromUrlsafe(value)
+        return value
+
+    # - - - keys & records - - - - - - - - - - - - - - - - - - -
+
+    def key(self, websafeKey):
+        return RecordKey.fromUrlsafe(websafeKey)
+
+    def profileKey(self, user_id):
+        return RecordKey(('Profile', user_id))
+
+    def _allocateId(self, kind):
+        def allocate():
+            rows = self._query(
+                'SELECT next FROM counters WHERE kind = ?', (kind,))
+            next_id = rows[0][0] if rows else 1
+            self._query('INSERT OR REPLACE INTO counters VALUES (?, ?)',
+                        (kind, next_id + 1))
+            return next_id
+        return self.transaction(allocate)
+
+    def _newRecord(self, key, values):
+        spec = KINDS[key.kind()]
+        record = Record(key)
+        for column in spec['columns']:
+            if column != 'conference':  # implied by the key path
+                setattr(record, column, spec.get('defaults', {}).get(column))
+        for name in spec['lists']:
+            setattr(record, name, [])
+        for name, value in values.items():
+            setattr(record, name, value)
+        return record
+
+    def _load(self, kind, rows):
+        """Build records (with their repeated properties) from rows."""
+        spec = KINDS[kind]
+        columns = ('key',) + spec['columns']
+        records = {}
+        owners = []
+        for row in rows:
+            values = dict(zip(columns, row))
+            owner = values.pop('key')
+            values.pop('conference', None)  # implied by the key path
+            records[owner] = self._newRecord(
+                RecordKey.fromUrlsafe(owner),
+                dict((f, self._fromDb(kind, f, v))
+                     for f, v in values.items()))
+            owners.append(owner)
+
+        for name, (table, column) in spec['lists'].items():
+            for chunk in _chunks(owners, 500):
+                for owner, value in self._query(
+                        'SELECT owner, %s FROM %s WHERE owner IN (%s) '
+                        'ORDER BY owner, position' % (
+                            column, table, ','.join('?' * len(chunk))),
+                        chunk):
+                    getattr(records[owner], name).append(value)
+        return [records[owner] for owner in owners]
+
+    def _select(self, kind, where='', params=()):
+        spec = KINDS[kind]
+        rows = self._query('SELECT key, %s FROM %s %s' % (
+            ', '.join(spec['columns']), spec['table'], where), params)
+        return self._load(kind, rows)
+
+    def get(self, key):
+        return self.getMulti([key])[0]
+
+    def getMulti(self, keys):
+        found = {}
+        by_kind = {}
+        for key in keys:
+            by_kind.setdefault(key.kind(), []).append(key.urlsafe())
+        for kind, websafeKeys in by_kind.items():
+            for chunk in _chunks(websafeKeys, 500):
+                for record in self._select(
+                        kind, 'WHERE key IN (%s)' % ','.join('?' * len(chunk)),
+                        chunk):
+                    found[record.key] = record
+        return [found.get(key) for key in keys]
+
+    def put(self, record):
+        return self.putMulti([record])[0]
+
+    def putMulti(self, records):
+        def write():
+            for record in records:
+                kind = record.key.kind()
+                spec = KINDS[kind]
+                websafeKey = record.key.urlsafe()
+                values = [websafeKey]
+                for column in spec['columns']:
+                    if column == 'conference':
+                        values.append(record.key.parent().urlsafe())
+                    else:
+                        values.append(self._toDb(
+                            column, getattr(record, column, None)))
+                self._query('INSERT OR REPLACE INTO %s VALUES (%s)' % (
+                    spec['table'], ','.join('?' * len(values))), values)
+                for name, (table, column) in spec['lists'].items():
+                    self._query('DELETE FROM %s WHERE owner = ?' % table,
+                                (websafeKey,))
+                    for position, value in enumerate(
+                            getattr(record, name, None) or []):
+                        self._query(
+                            'INSERT OR IGNORE INTO %s VALUES (?, ?, ?)' %
+                            table, (websafeKey, value, position))
+            return [record.key for record in records]
+        return self.transaction(write)
+
+    # - - - new records - - - - - - - - - - - - - - - - - - - - -
+
+    def newProfile(self, user_id, **values):
+        return self._newRecord(self.profileKey(user_id), values)
+
+    def newConference(self, user_id, **values):
+        key = RecordKey(('Profile', user_id),
+                        ('Conference', self._allocateId('Conference')))
+        values['organizerUserId'] = user_id
+        return self._newRecord(key, values)
+
+    def newSession(self, confKey, **values):
+        key = RecordKey(*(confKey.pairs() +
+                          (('Session', self._allocateId('Session')),)))
+        return self._newRecord(key, values)
+
+    # - - - queries - - - - - - - - - - - - - - - - - - - - - - -
+
+    def allConferences(self):
+        return self._select('Conference')
+
+    def conferencesByOrganizer(self, user_id):
+        return self._select(
+            'Conference', 'WHERE organizerUserId = ?', (user_id,))
+
+    def conferenceKeysWhere(self, field, operator, value):
+        _checkFilter('Conference', field, operator)
+        if field == 'topics':
+            rows = self._query(
+                'SELECT DISTINCT owner FROM conference_topics '
+                'WHERE topic %s ?' % operator, (value,))
+        else:
+            rows = self._query(
+                'SELECT key FROM conferences WHERE %s %s ?' % (
+                    field, operator), (self._toDb(field, value),))
+        return [RecordKey.fromUrlsafe(r[0]) for r in rows]
+
+    def sessionsForConference(self, confKey, typeOfSession=None,
+                              speakerKey=None):
+        where = 'WHERE conference = ?'
+        params = [confKey.urlsafe()]
+        if typeOfSession is not None:
+            if typeOfSession not in SESSION_TYPE_NAMES:
+                raise KeyError(typeOfSession)
+            where += ' AND typeOfSession = ?'
+            params.append(typeOfSession)
+        if speakerKey is not None:
+            where += ' AND speaker = ?'
+            params.append(speakerKey.urlsafe())
+        return self._select('Session', where, params)
+
+    def sessionKeysWhere(self, confKey, field, operator, value):
+        _checkFilter('Session', field, operator)
+        if field == 'typeOfSession' and value not in SESSION_TYPE_NAMES:
+            raise KeyError(value)
+        rows = self._query(
+            'SELECT key FROM sessions WHERE conference = ? AND %s %s ?' % (
+                field, operator),
+            (confKey.urlsafe(), self._toDb(field, value)))
+        return [RecordKey.fromUrlsafe(r[0]) for r in rows]
+
+    def sessionsBySpeaker(self, speakerKey):
+        return self._select(
+            'Session', 'WHERE speaker = ?', (speakerKey.urlsafe(),))
+
+    def allProfiles(self):
+        return self._select('Profile')
+
+
+def _checkFilter(kind, field, operator):
+    """Guard the identifiers that are interpolated into SQL."""
+    spec = KINDS[kind]
+    if operator not in OPERATORS or (
+            field not in spec['columns'] and field not in spec['lists']):
+        raise ValueError('Invalid filter: %s %s' % (field, operator))
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+import base64
+import json
+from datetime import datetime, timedelta
+
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import Conference, Session, Tombstone
+
+"""sync.py
+
+Conference Central delta sync
+
+Conferences & Sessions carry an auto_now `modified` timestamp and a
+deleted one leaves a Tombstone, so a client can ask for what changed
+since its last sync instead of fetching every list again. A sync token
+is the upper bound of the window the previous sync covered; a sync
+covers (token, now - SYNC_SETTLE_TIME] and pages through Conferences,
+then Sessions, then Tombstones changed in it, each ordered by time.
+The window stops short of now because the timestamp is set before the
+write commits and global queries are eventually consistent, so the
+newest changes could be missed; they're in the next window instead.
+Without a token, or with one older than the tombstones are kept, a
+sync is a full one: every Conference & Session, walked by key.
+
+"""
+
+
+SYNC_SETTLE_TIME = timedelta(seconds=30)
+SYNC_TOMBSTONE_TTL = timedelta(days=30)  # older tokens get a full sync
+SYNC_PAGE_SIZE = 100
+SYNC_PAGE_MAX = 500
+SYNC_PHASES = (Conference, Session, Tombstone)
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _toMicros(dt):
+    delta = dt - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + \
+        delta.microseconds
+
+
+def _fromMicros(micros):
+    return _EPOCH + timedelta(microseconds=micros)
+
+
+def _encode(value):
+    return base64.urlsafe_b64encode(json.dumps(value))
+
+
+def _decode(value, what):
+    try:
+        return json.loads(base64.urlsafe_b64decode(str(value)))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid %s: %s' % (what, value))
+
+
+def newSync(token=None):
+    """Return the paging state of a sync since a token (None for a
+    full sync); raise ValueError if the token is invalid."""
+    until = datetime.now() - SYNC_SETTLE_TIME
+    since = None
+    if token:
+        micros = _decode(token, 'sync token')
+        if not isinstance(micros, (int, long)):
+            raise ValueError('Invalid sync token: %s' % token)
+        since = _fromMicros(micros)
+        if since < datetime.now() - SYNC_TOMBSTONE_TTL:
+            since = None  # deletions since then may be forgotten
+        elif since >= until:
+            # synced within the settle time; nothing new to cover
+            until = since
+    return {
+        'since': _toMicros(since) if since else None,
+        'until': _toMicros(until),
+        'phase': 0,
+        'cursor': None,
+    }
+
+
+def encodeSyncCursor(state):
+    return _encode(state)
+
+
+def decodeSyncCursor(cursor):
+    """Return the paging state in a page cursor; raise ValueError if
+    the cursor is invalid."""
+    state = _decode(cursor, 'cursor')
+    if not (isinstance(state, dict) and
+            set(state) == set(['since', 'until', 'phase', 'cursor'])):
+        raise ValueError('Invalid cursor: %s' % cursor)
+    return state
+
+
+def syncToken(state):
+    """Return the token to pass to the sync after this one."""
+    return _encode(state['until'])
+
+
+def _changesQuery(model, state):
+    """Return the query for a phase, or None to skip it."""
+    if state['since'] is None:
+        if model is Tombstone:
+            return None  # a full sync has nothing to delete
+        # entities saved before `modified` existed aren't in its
+        # index, so a full sync walks them by key
+        return model.query().order(model.key)
+    prop = Tombstone.deleted if model is Tombstone else model.modified
+    return model.query(
+        prop > _fromMicros(state['since']),
+        prop <= _fromMicros(state['until'])
+    ).order(prop)
+
+
+def changesPage(state, limit=SYNC_PAGE_SIZE):
+    """Fetch up to limit changes; return (Conferences, Sessions,
+    websafe keys of deleted entities, state of the next page or None
+    on the last one)."""
+    found = dict((model, []) for model in SYNC_PHASES)
+    count = 0
+    while count < limit and state['phase'] < len(SYNC_PHASES):
+        model = SYNC_PHASES[state['phase']]
+        q = _changesQuery(model, state)
+        more = False
+        if q is not None:
+            start = Cursor(urlsafe=state['cursor']) if state['cursor'] \
+                else None
+            results, cursor, more = q.fetch_page(
+                limit - count, start_cursor=start)
+            found[model].extend(results)
+            count += len(results)
+        if more and cursor:
+            state = dict(state, cursor=cursor.urlsafe())
+        else:
+            state = dict(state, phase=state['phase'] + 1, cursor=None)
+    if state['phase'] >= len(SYNC_PHASES):
+        state = None
+    return (found[Conference], found[Session],
+            [t.key.id() for t in found[Tombstone]], state)
+
+
+def tombstone(key):
+    """Return a Tombstone for a deleted entity; put it in the same
+    transaction as the delete."""
+    return Tombstone(id=key.urlsafe(), kind=key.kind())
+
+
+@ndb.transactional()
+def _touch(key):
+    entity = key.get()
+    if entity is None:
+        return
+    if isinstance(entity, Conference):
+        entity.version += 1  # ConferenceForm etags
+        entity.put()
+        return
+    # the Conference's agenda & SessionForms etag show the Session
+    conf = key.parent().get()
+    if conf is not None:
+        conf.sessionsVersion += 1
+        ndb.put_multi([entity, conf])
+    else:
+        entity.put()
+
+
+def touch(keys):
+    """Re-save entities whose forms changed although they didn't
+    (e.g. their organiser or speaker was renamed), so that they're in
+    the next sync and their etags change."""
+    for key in keys:
+        _touch(key)
+
+
+def purgeTombstones(batch_size=500):
+    """Delete Tombstones older than any token still honoured; return
+    the count."""
+    q = Tombstone.query(
+        Tombstone.deleted < datetime.now() - SYNC_TOMBSTONE_TTL)
+    total = 0
+    # follow the cursor rather than re-run the (eventually consistent)
+    # query, which could return deleted keys again
+    cursor, more = None, True
+    while more:
+        keys, cursor, more = q.fetch_page(
+            batch_size, start_cursor=cursor, keys_only=True)
+        ndb.delete_multi(keys)
+        total += len(keys)
+    return total
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+import hashlib
+import re
+import time
+
+from google.appengine.api import taskqueue
+
+"""tasks.py
+
+Conference Central coalesced task scheduling
+
+Cache-rebuild tasks only need to run once after a burst of writes, so
+they are added as named tasks: the name is derived from the handler
+URL, a bucket (e.g. the conference key) and the current time window.
+Every enqueue within the same window maps to the same name, and the
+task queue drops the duplicates. The task is scheduled to run just
+after its window closes, so writes made late in the window are still
+seen by the single recompute.
+
+"""
+
+
+COALESCE_WINDOW = 10  # seconds of writes collapsed into one task
+COALESCE_DELAY = 2  # seconds after the window closes the task runs
+
+
+def coalescedTaskName(url, bucket, window=COALESCE_WINDOW, now=None):
+    """Return the task name shared by all enqueues of url/bucket in
+    the current time window."""
+    slot = int((now or time.time()) // window)
+    return '%s-%s-%d' % (
+        re.sub(r'[^a-zA-Z0-9-]', '-', url.strip('/')),
+        hashlib.md5(bucket.encode('utf-8')).hexdigest(),
+        slot
+    )
+
+
+def enqueueCoalesced(url, params=None, bucket='', window=COALESCE_WINDOW,
+                     queue_name='default'):
+    """Add a task to url unless one for the same bucket is already
+    pending in this window; return True if a task was added."""
+    now = time.time()
+    window_end = (int(now // window) + 1) * window
+    try:
+        taskqueue.add(
+            url=url,
+            params=params or {},
+            name=coalescedTaskName(url, bucket, window, now),
+            countdown=window_end - now + COALESCE_DELAY,
+            queue_name=queue_name
+        )
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        # an identical task is already scheduled for this window
+        return False
+    return True
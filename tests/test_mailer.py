@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from google.appengine.api import mail, taskqueue
+from google.appengine.ext import testbed
+
+import mailer
+
+"""test_mailer.py
+
+Tests of the batched confirmation email pipeline against the task
+queue & mail stubs. Run from the project root with the App Engine SDK
+on PYTHONPATH:
+
+    python -m unittest discover tests
+
+"""
+
+
+VALUES = {
+    'name': 'PyCon', 'description': '', 'city': 'Portland',
+    'topics': 'Python', 'startDate': '2026-05-01', 'endDate': 'TBA',
+    'maxAttendees': 100,
+}
+
+
+class MailerTest(unittest.TestCase):
+    """MailerTest -- queue emails, drain the pull queue, check mail"""
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_app_identity_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_mail_stub()
+        # root_path makes the stub read queue.yaml (the pull queue)
+        self.testbed.init_taskqueue_stub(root_path=ROOT)
+        self.mailStub = self.testbed.get_stub(testbed.MAIL_SERVICE_NAME)
+        self.queue = taskqueue.Queue(mailer.MAIL_QUEUE)
+
+        self.failFor = set()  # recipients whose sends raise
+        self.leases = []  # lease_seconds of modify_task_lease calls
+        self._sendMail = mail.send_mail
+        self._modifyLease = taskqueue.Queue.modify_task_lease
+        self._maxAttempts = mailer.MAIL_MAX_ATTEMPTS
+
+        def sendMail(sender, to, subject, body, **kwargs):
+            if to in self.failFor:
+                raise mail.Error('refused: %s' % to)
+            return self._sendMail(sender, to, subject, body, **kwargs)
+
+        def modifyLease(queue, task, lease_seconds):
+            self.leases.append(lease_seconds)
+            return self._modifyLease(queue, task, lease_seconds)
+
+        mail.send_mail = sendMail
+        taskqueue.Queue.modify_task_lease = modifyLease
+
+    def tearDown(self):
+        mail.send_mail = self._sendMail
+        taskqueue.Queue.modify_task_lease = self._modifyLease
+        mailer.MAIL_MAX_ATTEMPTS = self._maxAttempts
+        self.testbed.deactivate()
+
+    def pending(self):
+        return self.queue.fetch_statistics().tasks
+
+    def testDrainSendsQueuedEmails(self):
+        mailer.queueEmail('a@example.com', 'conference_created', VALUES)
+        mailer.queueEmail('b@example.com', 'waitlist_promoted', VALUES)
+        self.assertEqual(self.pending(), 2)
+
+        self.assertEqual(mailer.drainMailQueue(), 2)
+
+        sent = self.mailStub.get_sent_messages(to='a@example.com')
+        self.assertEqual(len(sent), 1)
+        self.assertEqual(sent[0].subject, 'You created a new Conference!')
+        self.assertIn('Name: PyCon', sent[0].body.decode())
+        self.assertEqual(
+            len(self.mailStub.get_sent_messages(to='b@example.com')), 1)
+        self.assertEqual(self.pending(), 0)
+
+    def testFailedSendIsKeptForBackoff(self):
+        self.failFor.add('b@example.com')
+        mailer.queueEmail('a@example.com', 'conference_created', VALUES)
+        mailer.queueEmail('b@example.com', 'conference_created', VALUES)
+
+        self.assertEqual(mailer.drainMailQueue(), 1)
+
+        self.assertEqual(
+            len(self.mailStub.get_sent_messages(to='a@example.com')), 1)
+        self.assertEqual(
+            self.mailStub.get_sent_messages(to='b@example.com'), [])
+        # the failed task stays queued, leased for the first backoff,
+        # so the next drain doesn't pick it up straight away
+        self.assertEqual(self.leases, [mailer.MAIL_BACKOFF_BASE])
+        self.assertEqual(self.pending(), 1)
+        self.assertEqual(
+            self.queue.lease_tasks(mailer.MAIL_LEASE_SECONDS, 10), [])
+
+    def testGivesUpAfterMaxAttempts(self):
+        mailer.MAIL_MAX_ATTEMPTS = 0  # every failure is the last
+        self.failFor.add('b@example.com')
+        mailer.queueEmail('b@example.com', 'conference_created', VALUES)
+
+        self.assertEqual(mailer.drainMailQueue(), 0)
+
+        self.assertEqual(self.leases, [])
+        self.assertEqual(self.pending(), 0)
+
+    def testUnknownTemplate(self):
+        self.assertRaises(ValueError, mailer.queueEmail,
+                          'a@example.com', 'no_such_template', VALUES)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,10 @@
+import hashlib
 import json
 import os
+import threading
 import time
 import uuid
 
-from google.appengine.api import urlfetch
 # from models import Profile
 from models import Conference
 
@@ -21,6 +22,8 @@ def getUserId(user, id_type="email"):
             token_type = 'access_token'
         url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
                % (token_type, token))
+        # only this (unused by default) branch needs urlfetch
+        from google.appengine.api import urlfetch
         user = {}
         wait = 1
         for i in range(3):
@@ -45,3 +48,86 @@ def getUserId(user, id_type="email"):
             return profile.id()
         else:
             return str(uuid.uuid1().get_hex())
+
+
+class IdPool(object):
+    """IdPool -- per-instance pool of pre-allocated datastore IDs for a
+    model, refilled `size` IDs at a time with one allocate_ids call."""
+
+    def __init__(self, model, size):
+        self._model = model
+        self._size = size
+        self._lock = threading.Lock()
+        self._next = 1
+        self._last = 0
+
+    def next(self):
+        """Return an unused ID, allocating a new range when empty."""
+        with self._lock:
+            if self._next > self._last:
+                self._next, self._last = self._model.allocate_ids(
+                    size=self._size)
+            id_ = self._next
+            self._next += 1
+        return id_
+
+
+# (form class, model class) -> names of the form fields the model has
+_COPY_PLANS = {}
+
+
+def copyPlan(form_cls, model_cls):
+    """Return the names of the fields of a ProtoRPC message class that
+    have a matching property on a model class, in field order. Worked
+    out once per pair, so _copy*ToForm don't have to probe every field
+    of every entity they copy."""
+    plan = _COPY_PLANS.get((form_cls, model_cls))
+    if plan is None:
+        plan = tuple(
+            field.name for field in sorted(
+                form_cls.all_fields(), key=lambda f: f.number)
+            if hasattr(model_cls, field.name)
+        )
+        _COPY_PLANS[(form_cls, model_cls)] = plan
+    return plan
+
+
+# fields a masked form always keeps: its identity & caching metadata
+MASK_ALWAYS = frozenset(['websafeKey', 'etag'])
+
+
+def parseFields(form_cls, fields):
+    """Return the names of the fields of form_cls that a `fields` mask
+    (comma-separated field names, for a partial response) asks for, or
+    None if there's no mask; raise ValueError for unknown names."""
+    if not fields:
+        return None
+    names = set(name.strip() for name in fields.split(',') if name.strip())
+    unknown = names - set(field.name for field in form_cls.all_fields())
+    if unknown:
+        raise ValueError('Unknown field(s) in fields mask: %s' %
+                         ', '.join(sorted(unknown)))
+    return frozenset(names | MASK_ALWAYS)
+
+
+def wants(fields, name):
+    """Whether a field mask (None for everything) includes name."""
+    return fields is None or name in fields
+
+
+def maskTag(fields):
+    """Return the etag suffix of a field mask ("" for none), so that a
+    partial response and the full one never share an etag."""
+    if fields is None:
+        return ''
+    return ':' + hashlib.md5(','.join(sorted(fields))).hexdigest()[:8]
+
+
+def maskForm(form, fields):
+    """Clear the fields of a form that the mask leaves out (e.g. of a
+    form rendered in full for the cache); return the form."""
+    if fields is not None:
+        for field in form.all_fields():
+            if field.name not in fields:
+                form.reset(field.name)
+    return form
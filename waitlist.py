@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+from google.appengine.ext import ndb
+
+from models import WaitlistEntry
+from tasks import enqueueCoalesced
+
+"""waitlist.py
+
+Conference Central conference waitlists
+
+Instead of retrying registerForConference until a seat frees up, a
+user joins a sold out Conference's waitlist once. Entries are root
+entities keyed by conference & user, so joining never contends with
+registrations, and a user can only be on a waitlist once. Whenever a
+seat is freed, a coalesced promotion task moves the oldest entries
+onto the attendee list in FIFO batches (ConferenceApi._promoteWaitlist).
+
+"""
+
+
+PROMOTE_URL = '/tasks/promote_waitlist'
+# users promoted per transaction: each needs its Profile & entry in
+# the transaction as well as the Conference, and XG transactions are
+# limited to 25 entity groups
+PROMOTE_BATCH_SIZE = 10
+
+
+def entryKey(confKey, user_id):
+    """Return the key of a user's waitlist entry for a Conference."""
+    return ndb.Key(WaitlistEntry, '%s:%s' % (confKey.urlsafe(), user_id))
+
+
+@ndb.transactional()
+def addEntry(confKey, user_id):
+    """Put the user on the waitlist; return False if already on it."""
+    key = entryKey(confKey, user_id)
+    if key.get() is not None:
+        return False
+    WaitlistEntry(key=key, conference=confKey, userId=user_id).put()
+    return True
+
+
+def removeEntry(confKey, user_id):
+    """Take the user off the waitlist (if they're on it)."""
+    entryKey(confKey, user_id).delete()
+
+
+def nextEntries(confKey, cursor=None, size=PROMOTE_BATCH_SIZE):
+    """Return a page of a Conference's waitlist entries, oldest
+    first, after the cursor of the previous page: (entries, cursor,
+    whether there are more)."""
+    return WaitlistEntry.query(
+        WaitlistEntry.conference == confKey
+    ).order(WaitlistEntry.created).fetch_page(size, start_cursor=cursor)
+
+
+def schedulePromotion(confKey):
+    """Make sure a promotion task runs shortly (coalesced)."""
+    return enqueueCoalesced(
+        PROMOTE_URL,
+        params={'conf': confKey.urlsafe()},
+        bucket=confKey.urlsafe()
+    )